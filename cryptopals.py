@@ -2,19 +2,185 @@ from Crypto.Cipher import AES
 from Crypto.Random import random
 from numpy.random import randint
 from Crypto.Util import number
+from concurrent.futures import ProcessPoolExecutor
 import random as rndm
 import base64
+import binascii
+import collections
+import heapq
+import hmac
+import mmap
+import os
+import time
+import numpy as np
+import md4
+import number_theory
 import sha1
 
 
-def bitwise_xor(a, b):
-    """Returns the bitwise XOR of two byte vectors: a and b"""
+# Below this many bytes it's cheaper to XOR two Python ints than to set up
+# NumPy arrays (16 byte AES blocks, 64 byte HMAC pads, etc.)
+XOR_SMALL_SIZE = 256
+
+
+def bitwise_xor_ref(a, b):
+    """
+    Reference (pure Python) bitwise XOR of two byte vectors: a and b.
+    Output is truncated to the shorter of the two inputs.
+    """
 
     c = [(a ^ b) for a, b in zip(a, b)]
 
     return(bytes(c))
 
 
+def as_uint8(data):
+    """
+    Returns a flat uint8 NumPy array for data.  Anything supporting the
+    buffer protocol (bytes, bytearray, memoryview, ...) is viewed without
+    copying; lists / tuples of ints are converted.
+    """
+
+    if isinstance(data, np.ndarray):
+        if data.dtype == np.uint8:
+            return(data.reshape(-1))
+        return(data.astype(np.uint8).reshape(-1))
+
+    try:
+        return(np.frombuffer(data, dtype=np.uint8))
+    except TypeError:
+        return(np.asarray(data, dtype=np.uint8).reshape(-1))
+
+
+def _xor_arrays(a, b, out):
+    """XOR equal length uint8 arrays into out, 8 bytes at a time where possible"""
+
+    n8 = len(out) & ~7
+    if n8:
+        np.bitwise_xor(a[:n8].view(np.uint64), b[:n8].view(np.uint64),
+                       out=out[:n8].view(np.uint64))
+    np.bitwise_xor(a[n8:], b[n8:], out=out[n8:])
+
+    return(out)
+
+
+def bitwise_xor(a, b, out=None):
+    """
+    Returns the bitwise XOR of two byte vectors: a and b
+
+    Same behaviour as bitwise_xor_ref (output truncated to the shorter
+    input), but whole buffers are XOR'd at once: as Python ints for short
+    inputs and with NumPy for long ones.
+
+    If out is given (any writable buffer, e.g. a bytearray, at least as long
+    as the result) the result is written into it and out is returned.  out
+    may be the same object as a or b.
+    """
+
+    n = min(len(a), len(b))
+
+    if out is None and n < XOR_SMALL_SIZE:
+        if isinstance(a, (bytes, bytearray)) and \
+           isinstance(b, (bytes, bytearray)):
+            c = int.from_bytes(a[:n], 'little') ^ \
+                int.from_bytes(b[:n], 'little')
+            return(c.to_bytes(n, 'little'))
+        return(bitwise_xor_ref(a, b))
+
+    a_arr = as_uint8(a)[:n]
+    b_arr = as_uint8(b)[:n]
+
+    if out is None:
+        return(_xor_arrays(a_arr, b_arr, np.empty(n, np.uint8)).tobytes())
+
+    _xor_arrays(a_arr, b_arr, as_uint8(out)[:n])
+
+    return(out)
+
+
+def xor_repeating(data, key, out=None):
+    """
+    XOR's data against key repeated out to the length of data (i.e. a
+    repeating keystream) without building the full keystream.
+
+    out behaves the same as for bitwise_xor.
+    """
+
+    n = len(data)
+    k = len(key)
+    if k == 0:
+        raise(ValueError('Key must not be empty'))
+
+    d_arr = as_uint8(data)
+    k_arr = as_uint8(key)
+
+    # Tile the key out to a row of ~4KB so the broadcast below works on
+    # long rows rather than one short row per repetition of the key.
+    row_len = k * max(1, 4096 // k)
+    row = np.tile(k_arr, row_len // k)
+
+    if out is None:
+        o_arr = np.empty(n, np.uint8)
+    else:
+        o_arr = as_uint8(out)[:n]
+
+    n_rows = n // row_len
+    body = n_rows * row_len
+    if n_rows:
+        np.bitwise_xor(d_arr[:body].reshape(n_rows, row_len), row,
+                       out=o_arr[:body].reshape(n_rows, row_len))
+    np.bitwise_xor(d_arr[body:], row[:n-body], out=o_arr[body:])
+
+    if out is None:
+        return(o_arr.tobytes())
+
+    return(out)
+
+
+def run_xor_benchmark(n_bytes=8*2**20):
+    """
+    Checks bitwise_xor / xor_repeating against the reference implementation
+    and prints the speedup on an n_bytes buffer.
+    """
+
+    for size in [0, 1, 15, 16, 17, 255, 256, 257, 4099]:
+        a = os.urandom(size)
+        b = os.urandom(size + 3)
+        assert(bitwise_xor(a, b) == bitwise_xor_ref(a, b))
+        assert(bitwise_xor(list(a), b) == bitwise_xor_ref(a, b))
+        buf = bytearray(a)
+        assert(bitwise_xor(buf, b, out=buf) == bitwise_xor_ref(a, b))
+        key = os.urandom(7)
+        assert(xor_repeating(a, key) ==
+               bitwise_xor_ref(a, key * (size // 7 + 1)))
+
+    a = os.urandom(n_bytes)
+    b = os.urandom(n_bytes)
+
+    t0 = time.perf_counter()
+    ref_out = bitwise_xor_ref(a, b)
+    t_ref = time.perf_counter() - t0
+
+    # Best of a few runs for the fast paths -- they're short enough that
+    # first-touch page faults on the output buffer show up.
+    t_fast = float('inf')
+    t_out = float('inf')
+    out = bytearray(n_bytes)
+    for ii in range(5):
+        t0 = time.perf_counter()
+        fast_out = bitwise_xor(a, b)
+        t_fast = min(t_fast, time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        bitwise_xor(a, b, out=out)
+        t_out = min(t_out, time.perf_counter() - t0)
+
+    assert(ref_out == fast_out == out)
+    print(f'bitwise_xor_ref: {t_ref:.4f} s')
+    print(f'bitwise_xor:     {t_fast:.4f} s, speedup = {t_ref/t_fast:.0f}x')
+    print(f'bitwise_xor out: {t_out:.4f} s, speedup = {t_ref/t_out:.0f}x')
+
+
 def count_chars(s, chars):
     """
     Counts the number of occurences of a given list of characters within
@@ -49,7 +215,323 @@ def argmin(some_list):
     return(min(range(len(some_list)), key=lambda x: some_list[x]))
 
 
-def break_single_char_XOR(encoded_bv):
+# Relative frequency of the letters (case-folded) and space in English text.
+ENGLISH_FREQS = {
+    ' ': 0.19182, 'e': 0.10410, 't': 0.07292, 'a': 0.06517, 'o': 0.05964,
+    'n': 0.05641, 'i': 0.05581, 's': 0.05158, 'r': 0.04978, 'h': 0.04930,
+    'd': 0.03500, 'l': 0.03314, 'u': 0.02252, 'c': 0.02177, 'm': 0.02024,
+    'f': 0.01979, 'w': 0.01713, 'g': 0.01586, 'y': 0.01459, 'p': 0.01370,
+    'b': 0.01293, 'v': 0.00830, 'k': 0.00573, 'x': 0.00141, 'q': 0.00096,
+    'j': 0.00090, 'z': 0.00063}
+
+# Frequency (%) of the most common letter pairs in English.
+ENGLISH_BIGRAMS = {
+    'th': 3.56, 'he': 3.07, 'in': 2.43, 'er': 2.05, 'an': 1.99, 're': 1.85,
+    'on': 1.76, 'at': 1.49, 'en': 1.45, 'nd': 1.35, 'ti': 1.34, 'es': 1.34,
+    'or': 1.28, 'te': 1.20, 'of': 1.17, 'ed': 1.17, 'is': 1.13, 'it': 1.12,
+    'al': 1.09, 'ar': 1.07, 'st': 1.05, 'to': 1.04, 'nt': 1.04, 'ng': 0.95,
+    'se': 0.93, 'ha': 0.93, 'as': 0.87, 'ou': 0.87, 'io': 0.83, 'le': 0.83,
+    've': 0.83, 'co': 0.79, 'me': 0.79, 'de': 0.76, 'hi': 0.76, 'ri': 0.73,
+    'ro': 0.73, 'ic': 0.70, 'ne': 0.69, 'ea': 0.69, 'ra': 0.69, 'ce': 0.65}
+
+
+def english_byte_probs():
+    """
+    Probability of each of the 256 byte values in English text: letters and
+    space from ENGLISH_FREQS (mostly lower case), a small share spread over
+    the rest of printable ASCII and a very small share for everything else.
+    """
+
+    probs = np.full(256, 0.0005 / 256)
+
+    other = bytes(range(33, 127)) + b'\n\r\t'
+    probs[list(other)] += 0.045 / len(other)
+
+    for c, f in ENGLISH_FREQS.items():
+        probs[ord(c)] = 0.95 * f
+        if c != ' ':
+            probs[ord(c.upper())] = 0.05 * f
+
+    return(probs / probs.sum())
+
+
+def english_byte_weights():
+    """
+    Per-byte version of score_english: +1 for each byte in score_english's
+    list of good characters, -1 for everything else.
+    """
+
+    goodChars = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.,! '
+    weights = -np.ones(256, dtype=np.int64)
+    weights[list(goodChars)] = 1
+
+    return(weights)
+
+
+def xor_score_table(weights):
+    """
+    Builds the 256x256 table mapping (ciphertext byte, key) to the score
+    of the decrypted byte, i.e. table[c, k] = weights[c ^ k].
+    """
+
+    idx = np.arange(256)
+
+    return(weights[idx[:, None] ^ idx[None, :]])
+
+
+def byte_histogram(data):
+    """Returns the 256-bin histogram of the byte values in data"""
+
+    return(np.bincount(as_uint8(data), minlength=256))
+
+
+def column_histograms(columns):
+    """
+    Returns the byte histograms of a list of byte strings as a
+    (len(columns), 256) array, using a single bincount.
+    """
+
+    lengths = [len(col) for col in columns]
+    data = np.frombuffer(b''.join(map(bytes, columns)), dtype=np.uint8)
+    row = np.repeat(np.arange(len(columns)), lengths)
+    hists = np.bincount(row*256 + data, minlength=len(columns)*256)
+
+    return(hists.reshape(len(columns), 256))
+
+
+class ByteScorer:
+    """
+    Scores text as the sum of a per-byte weight (e.g. a log-probability).
+    The weights are compiled into a 256-entry table, and a 256x256
+    (ciphertext byte, key) table for scoring every single-byte XOR key from
+    one histogram.  Higher scores are more English-like.
+    """
+
+    def __init__(self, weights):
+
+        self.weights = np.asarray(weights)
+        # Float so the histogram products go through BLAS (exact for the
+        # small integer weights of the 'count' scorer too)
+        self.xor_table = xor_score_table(self.weights).astype(float)
+
+    def score(self, data):
+        return(self.weights[as_uint8(data)].sum().item())
+
+    def score_keys(self, data):
+        """Returns the scores of data XOR'd with each of the 256 keys"""
+        return(byte_histogram(data) @ self.xor_table)
+
+    def score_keys_many(self, columns):
+        """score_keys for a list of columns, as a (len(columns), 256) array"""
+
+        return(self.score_keys_hists(column_histograms(columns)))
+
+    def score_keys_hists(self, hists):
+        """score_keys given the (m, 256) byte histograms of m columns"""
+
+        return(hists @ self.xor_table)
+
+
+class BigramScorer:
+    """
+    Scores text as its log-likelihood under a first order (bigram) model.
+    log P(b | a) for every byte pair is compiled into a 65536-entry table
+    indexed by (a << 8) | b, so scoring is one gather over the pairs.
+    """
+
+    def __init__(self, first_weights, pair_weights):
+
+        self.first_weights = np.asarray(first_weights)
+        self.pair_weights = np.asarray(pair_weights).reshape(65536)
+
+    def score(self, data):
+
+        arr = as_uint8(data)
+        if len(arr) == 0:
+            return(0.0)
+        pairs = (arr[:-1].astype(np.int64) << 8) | arr[1:]
+
+        return((self.first_weights[arr[0]] +
+                self.pair_weights[pairs].sum()).item())
+
+    def score_keys(self, data):
+
+        arr = as_uint8(data)
+        if len(arr) == 0:
+            return(np.zeros(256))
+
+        # XOR'ing both bytes of a pair with k is the same as XOR'ing the
+        # pair index with k * 257, so score each distinct pair once.
+        pairs = (arr[:-1].astype(np.int64) << 8) | arr[1:]
+        pairs, counts = np.unique(pairs, return_counts=True)
+        keys = np.arange(256)
+        pair_scores = self.pair_weights[pairs[None, :] ^ (keys[:, None]*257)]
+
+        return(self.first_weights[arr[0] ^ keys] + pair_scores @ counts)
+
+    def score_keys_many(self, columns):
+        return(np.array([self.score_keys(col) for col in columns]))
+
+
+class ChiSquaredScorer:
+    """
+    Scores text by (minus) the chi-squared statistic of its character
+    counts against reference English frequencies.  Bytes are mapped into
+    classes (case-folded letters, space, other printable, non-printable)
+    through a 256-entry table.
+    """
+
+    def __init__(self, class_map, expected):
+
+        self.class_map = np.asarray(class_map)
+        self.expected = np.asarray(expected, dtype=float)
+        n_classes = len(self.expected)
+
+        # key_class[b, k] = k*n_classes + (class of b ^ k): bin numbers for
+        # counting classes under every key at once.
+        idx = np.arange(256)
+        self.key_class = idx[None, :]*n_classes + \
+            self.class_map[idx[:, None] ^ idx[None, :]]
+
+    def _chi2(self, class_counts, n):
+
+        exp = self.expected * max(n, 1)
+        return(((class_counts - exp)**2 / exp).sum(axis=-1))
+
+    def score(self, data):
+
+        arr = as_uint8(data)
+        counts = np.bincount(self.class_map[arr],
+                             minlength=len(self.expected))
+
+        return(-self._chi2(counts, len(arr)).item())
+
+    def _score_keys_hist(self, hist):
+
+        n_classes = len(self.expected)
+        present = np.flatnonzero(hist)
+
+        class_counts = np.bincount(
+            self.key_class[present].ravel(),
+            weights=np.repeat(hist[present], 256),
+            minlength=256*n_classes).reshape(256, n_classes)
+
+        return(-self._chi2(class_counts, hist.sum()))
+
+    def score_keys(self, data):
+        return(self._score_keys_hist(byte_histogram(data)))
+
+    def score_keys_many(self, columns):
+        return(self.score_keys_hists(column_histograms(columns)))
+
+    def score_keys_hists(self, hists):
+        return(np.array([self._score_keys_hist(h) for h in hists]))
+
+
+def english_unigram_scorer():
+    """Log-likelihood of the text under english_byte_probs()"""
+
+    return(ByteScorer(np.log(english_byte_probs())))
+
+
+def english_bigram_scorer():
+    """
+    Log-likelihood under a bigram model: log P(b | a) = log P(b) + a boost
+    for the common letter pairs in ENGLISH_BIGRAMS (case-folded).
+    """
+
+    log_p = np.log(english_byte_probs())
+    pair_weights = np.tile(log_p, (256, 1))
+
+    for pair, pct in ENGLISH_BIGRAMS.items():
+        boost = np.log((pct / 100) /
+                       (ENGLISH_FREQS[pair[0]] * ENGLISH_FREQS[pair[1]]) /
+                       (1 - ENGLISH_FREQS[' '])**2)
+        for a in (pair[0], pair[0].upper()):
+            for b in (pair[1], pair[1].upper()):
+                pair_weights[ord(a), ord(b)] += boost
+
+    return(BigramScorer(log_p, pair_weights))
+
+
+def english_chi2_scorer():
+    """Chi-squared against ENGLISH_FREQS, see ChiSquaredScorer"""
+
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    printable = bytes(range(32, 127)) + b'\n\r\t'
+
+    class_map = np.full(256, 28)
+    class_map[list(printable)] = 27
+    class_map[ord(' ')] = 26
+    for ii, c in enumerate(letters):
+        class_map[ord(c)] = ii
+        class_map[ord(c.upper())] = ii
+
+    expected = [0.97 * ENGLISH_FREQS[c] for c in letters + ' '] + \
+               [0.0295, 0.0005]
+
+    return(ChiSquaredScorer(class_map, np.array(expected) / sum(expected)))
+
+
+SCORERS = {
+    'count': ByteScorer(english_byte_weights()),
+    'unigram': english_unigram_scorer(),
+    'bigram': english_bigram_scorer(),
+    'chi2': english_chi2_scorer(),
+}
+
+
+def register_scorer(name, scorer):
+    """
+    Adds a scorer to SCORERS.  A scorer needs score(data) and
+    score_keys(data) methods (and score_keys_many(columns)); see
+    ByteScorer.
+    """
+
+    SCORERS[name] = scorer
+
+
+def get_scorer(scorer=None):
+    """Looks up a scorer by name; None gives the default ('count')"""
+
+    if scorer is None:
+        return(SCORERS['count'])
+    if isinstance(scorer, str):
+        return(SCORERS[scorer])
+
+    return(scorer)
+
+
+def rank_single_char_XOR_keys(encoded_bv, n_best=1, scorer=None):
+    """
+    Scores all 256 single-byte keys against encoded_bv in one go: the
+    ciphertext histogram is taken once and multiplied through a
+    precomputed (ciphertext byte, key) score table.
+
+    Returns a list of the n_best (key, score) tuples, best first.  Ties go
+    to the lower key, same as argmax().
+    """
+
+    scores = get_scorer(scorer).score_keys(encoded_bv)
+    order = np.argsort(-scores, kind='stable')[:n_best]
+
+    return([(int(k), scores[k].item()) for k in order])
+
+
+def break_XOR_columns(columns, scorer=None):
+    """
+    Runs the single-byte XOR crack on each of a list of columns (e.g. the
+    transposed blocks of a repeating-key XOR ciphertext, or the n'th byte
+    of a set of fixed-nonce CTR ciphertexts) and returns the best key byte
+    for each column as bytes.
+    """
+
+    scores = get_scorer(scorer).score_keys_many(columns)
+
+    return(bytes(np.argmax(scores, axis=1).astype(np.uint8)))
+
+
+def break_single_char_XOR(encoded_bv, scorer=None):
     """
     Implements the solution to Set 1, Problem 3
 
@@ -57,18 +539,222 @@ def break_single_char_XOR(encoded_bv):
     will search for the "key" and return it along with the decoded
     message.
     """
-    score_vec = [0]*256
 
-    for ii in range(0, 256):
-        decoded_bv = bitwise_xor(encoded_bv, [ii] * len(encoded_bv))
-        score_vec[ii] = score_english(decoded_bv)
-
-    correct_key = argmax(score_vec)
-    decoded_bv = bitwise_xor(encoded_bv, [correct_key] * len(encoded_bv))
+    ((correct_key, _),) = rank_single_char_XOR_keys(encoded_bv, 1, scorer)
+    decoded_bv = xor_repeating(encoded_bv, bytes([correct_key]))
 
     return (correct_key, decoded_bv)
 
 
+def iter_line_chunks(f, chunk_size=2**20):
+    """
+    Yields the contents of file object f in pieces of roughly chunk_size
+    bytes, always split on a line ending.  The file is mmap'd so only the
+    chunk being handed out is read into memory.
+    """
+
+    if os.fstat(f.fileno()).st_size == 0:
+        return
+
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < len(mm):
+            end = mm.find(b'\n', start + chunk_size)
+            end = len(mm) if end == -1 else end + 1
+            yield mm[start:end]
+            start = end
+
+
+def scan_file(file_name, chunk_fn, n_best=10, n_workers=None,
+              chunk_size=2**20, initializer=None, initargs=()):
+    """
+    Runs chunk_fn over a (possibly huge) line-oriented file and keeps the
+    n_best results.
+
+    The file is read in chunks of whole lines (see iter_line_chunks) and
+    chunk_fn(chunk, n_best) is called on each one in a ProcessPoolExecutor
+    (chunk_fn has to be a module level function).  It must return
+    (number of lines in chunk, candidates, number of bad lines skipped),
+    where each candidate is (score, line index within chunk, ...).  Only
+    the best n_best are kept, in a heap, so memory use doesn't grow with
+    the file.  n_workers=1 runs everything in this process.
+
+    Returns (candidates, stats): candidates is a list of
+    (score, line number, ...), best first (ties go to the earlier line);
+    stats has the line and bad line counts, elapsed time and lines per
+    second.
+    """
+
+    if n_workers is None:
+        n_workers = os.cpu_count()
+
+    heap = []
+    n_lines = 0
+    n_bad = 0
+    t0 = time.perf_counter()
+
+    def merge(chunk_lines, result, chunk_bad):
+        nonlocal n_bad
+        n_bad += chunk_bad
+        for (score, idx, *rest) in result:
+            item = (score, -(n_lines + idx), *rest)
+            if len(heap) < n_best:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+        return(n_lines + chunk_lines)
+
+    with open(file_name, 'rb') as f:
+
+        chunks = iter_line_chunks(f, chunk_size)
+
+        if n_workers == 1:
+            if initializer is not None:
+                initializer(*initargs)
+            for chunk in chunks:
+                n_lines = merge(*chunk_fn(chunk, n_best))
+
+        else:
+            with ProcessPoolExecutor(n_workers, initializer=initializer,
+                                     initargs=initargs) as pool:
+                # Only keep a couple of chunks per worker in flight, rather
+                # than reading the whole file into the task queue.
+                pending = collections.deque()
+                for chunk in chunks:
+                    pending.append(pool.submit(chunk_fn, chunk, n_best))
+                    if len(pending) >= 2*n_workers:
+                        n_lines = merge(*pending.popleft().result())
+                while pending:
+                    n_lines = merge(*pending.popleft().result())
+
+    dt = time.perf_counter() - t0
+    candidates = [(score, -neg_line, *rest) for (score, neg_line, *rest)
+                  in sorted(heap, reverse=True)]
+    stats = {'lines': n_lines, 'bad_lines': n_bad, 'seconds': dt,
+             'lines_per_sec': n_lines / dt if dt > 0 else float('inf')}
+
+    return(candidates, stats)
+
+
+def _unhex_lines(lines):
+    """
+    Decodes the non-blank hex lines of a chunk, skipping any that aren't
+    valid hex (odd length, stray characters) rather than failing the whole
+    scan.  Returns (line indices, decoded lines, number skipped).
+    """
+
+    idxs, decoded = [], []
+    n_bad = 0
+    for ii, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            decoded.append(binascii.unhexlify(line))
+        except (binascii.Error, ValueError):
+            n_bad += 1
+            continue
+        idxs.append(ii)
+
+    return(idxs, decoded, n_bad)
+
+
+def _scan_worker_init(scorer):
+
+    global _scan_scorer
+    _scan_scorer = get_scorer(scorer)
+
+
+def _scan_single_char_XOR_chunk(chunk, n_best):
+    """
+    scan_file chunk_fn: cracks every hex line in chunk, candidates are
+    (score, line index within chunk, key, plaintext).
+    """
+
+    lines = chunk.splitlines()
+    idxs, cts, n_bad = _unhex_lines(lines)
+    if not idxs:
+        return(len(lines), [], n_bad)
+
+    scores = _scan_scorer.score_keys_many(cts)
+    keys = np.argmax(scores, axis=1)
+    best = scores[np.arange(len(cts)), keys]
+
+    top = np.argsort(-best, kind='stable')[:n_best]
+    candidates = [(best[ii].item(), idxs[ii], int(keys[ii]),
+                   xor_repeating(cts[ii], bytes([keys[ii]]))) for ii in top]
+
+    return(len(lines), candidates, n_bad)
+
+
+def scan_single_char_XOR_file(file_name, n_best=10, scorer=None,
+                              n_workers=None, chunk_size=2**20):
+    """
+    Set 1, Challenge 4 for big inputs: finds the lines of a file of
+    hex-encoded ciphertexts most likely to be English XOR'd with a single
+    byte.  Each chunk of lines is cracked with the batched scorer in a
+    worker process (see scan_file).
+
+    Returns (candidates, stats): candidates is a list of
+    (score, line number, key, plaintext), best first; stats has the line
+    count, how many lines weren't valid hex (and were skipped), elapsed
+    time and lines per second.
+    """
+
+    return(scan_file(file_name, _scan_single_char_XOR_chunk, n_best,
+                     n_workers, chunk_size, initializer=_scan_worker_init,
+                     initargs=(scorer,)))
+
+
+def run_scorer_benchmark(scorers=None):
+    """
+    Compares the registered scorers for accuracy and throughput on the
+    set 1 data:
+
+      * 4.txt: which line / key each scorer picks as the single-char XOR
+        line (the answer is line 170, key 53) and lines per second.
+      * 6.txt: the plaintext is cut into chunks of 8-64 bytes, each XOR'd
+        with a random byte, and we count how often the key comes back.
+    """
+
+    if scorers is None:
+        scorers = list(SCORERS)
+
+    with open('challenge-data/4.txt') as f:
+        lines = [bytes.fromhex(l.strip()) for l in f]
+
+    with open('challenge-data/6.txt') as f:
+        ct = base64.b64decode(f.read())
+    pt = encrypt_repeating_key_XOR(ct, b'Terminator X: Bring the noise')
+
+    rng = np.random.default_rng(0)
+
+    for name in scorers:
+        scorer = get_scorer(name)
+
+        t0 = time.perf_counter()
+        best = [rank_single_char_XOR_keys(l, 1, scorer)[0] for l in lines]
+        dt = time.perf_counter() - t0
+        line_idx = argmax([s for (k, s) in best])
+        print(f'{name:>8}  4.txt: line {line_idx}, key {best[line_idx][0]}, '
+              f'{len(lines)/dt:,.0f} lines/s')
+
+        for chunk_len in [8, 16, 32, 64]:
+            chunks = [pt[ii:ii+chunk_len]
+                      for ii in range(0, len(pt)-chunk_len+1, chunk_len)]
+            keys = rng.integers(0, 256, len(chunks))
+            n_correct = 0
+            t0 = time.perf_counter()
+            for chunk, key in zip(chunks, keys):
+                enc = xor_repeating(chunk, bytes([key]))
+                n_correct += rank_single_char_XOR_keys(enc, 1, scorer)[0][0] \
+                    == key
+            dt = time.perf_counter() - t0
+            print(f'{"":>8}  6.txt {chunk_len:2d} byte chunks: '
+                  f'{100*n_correct/len(chunks):5.1f}% correct, '
+                  f'{len(chunks)/dt:,.0f} chunks/s')
+
+
 def encrypt_repeating_key_XOR(plaintext, key):
     """
     Implements the colution to Set 1, Problem 5
@@ -77,20 +763,174 @@ def encrypt_repeating_key_XOR(plaintext, key):
     plaintext.
     """
 
-    keystream = (key*round(len(plaintext)/len(key)))[:len(plaintext)+1]
-    ciphertext = bitwise_xor(plaintext, keystream)
+    ciphertext = xor_repeating(plaintext, key)
 
     return(ciphertext)
 
 
+# Number of set bits in each byte value
+POPCOUNT = np.array([bin(ii).count('1') for ii in range(256)], dtype=np.uint8)
+
+
 def hamming_distance(a, b):
     """Return the hamming (edit) distance between two byte strings"""
 
-    HD = 0
-    for ii in range(len(a)):
-        HD += bin(a[ii] ^ b[ii]).count('1')
+    return(int(POPCOUNT[as_uint8(bitwise_xor(a, b))].sum(dtype=np.int64)))
+
+
+class KeysizeEstimator:
+    """
+    Ranks candidate repeating-key XOR key sizes by the normalised Hamming
+    distance between ciphertext blocks (Set 1, Challenge 6), averaged over
+    ALL pairs of blocks rather than the first few.
+
+    For a bit position where c of the n blocks have a 1, c*(n-c) of the
+    block pairs differ, so the total over all n*(n-1)/2 pairs comes from
+    the per-column bit counts in O(n) instead of O(n**2).  Only the first
+    sample_size bytes are used; that's plenty for a stable estimate.
+    """
+
+    def __init__(self, min_keysize=1, max_keysize=40, sample_size=2**20):
 
-    return(HD)
+        self.min_keysize = min_keysize
+        self.max_keysize = max_keysize
+        self.sample_size = sample_size
+
+    def distance(self, ciphertext, keysize):
+        """Mean Hamming distance per byte between pairs of keysize blocks"""
+
+        arr = as_uint8(ciphertext)[:self.sample_size]
+        n_blocks = len(arr) // keysize
+        if n_blocks < 2:
+            return(float('inf'))
+
+        blocks = arr[:n_blocks*keysize].reshape(n_blocks, keysize)
+        ones = np.unpackbits(blocks, axis=1).sum(axis=0, dtype=np.int64)
+        diff_pairs = (ones * (n_blocks - ones)).sum()
+        n_pairs = n_blocks * (n_blocks - 1) // 2
+
+        return(diff_pairs.item() / n_pairs / keysize)
+
+    def estimate(self, ciphertext):
+        """Returns [(keysize, normalised distance), ...], best first"""
+
+        scores = [(k, self.distance(ciphertext, k)) for k in
+                  range(self.min_keysize, self.max_keysize + 1)]
+
+        return(sorted(scores, key=lambda x: x[1]))
+
+
+def transpose_blocks(ciphertext, keysize):
+    """
+    Set 1, Challenge 6 step 6: returns column j (every keysize'th byte
+    starting at j) for each j, as strided NumPy views (no copying).
+    """
+
+    arr = as_uint8(ciphertext)
+
+    return([arr[j::keysize] for j in range(keysize)])
+
+
+def repeating_key_histograms(ciphertext, keysize, chunk_size=2**22):
+    """
+    Byte histograms of the transposed blocks (see transpose_blocks) as a
+    (keysize, 256) array.  Works through the ciphertext in chunks so the
+    index arrays stay small however big the ciphertext is.
+    """
+
+    arr = as_uint8(ciphertext)
+    chunk_size = max(keysize, chunk_size - (chunk_size % keysize))
+    bins = (np.arange(chunk_size) % keysize) * 256
+
+    hists = np.zeros(keysize*256, dtype=np.int64)
+    for start in range(0, len(arr), chunk_size):
+        chunk = arr[start:start+chunk_size]
+        hists += np.bincount(bins[:len(chunk)] + chunk,
+                             minlength=keysize*256)
+
+    return(hists.reshape(keysize, 256))
+
+
+def shortest_period(key):
+    """Returns the shortest p such that key is key[:p] repeated"""
+
+    for p in range(1, len(key)):
+        if len(key) % p == 0 and key == key[:p] * (len(key) // p):
+            return(key[:p])
+
+    return(key)
+
+
+def break_repeating_key_XOR(ciphertext, max_keysize=40, scorer=None,
+                            n_keysizes=3):
+    """
+    Set 1, Challenge 6 end to end: estimates the key size, transposes the
+    blocks and cracks each column as single-byte XOR.
+
+    The n_keysizes best key sizes from KeysizeEstimator are all cracked and
+    the one whose decryption scores best is kept (a multiple of the true
+    size decrypts just as well, so the key is reduced to its shortest
+    period).  Returns (key, plaintext).
+    """
+
+    scorer = get_scorer(scorer)
+    ranked = KeysizeEstimator(max_keysize=max_keysize).estimate(ciphertext)
+
+    best_score = None
+    for keysize, _ in ranked[:n_keysizes]:
+
+        if hasattr(scorer, 'score_keys_hists'):
+            hists = repeating_key_histograms(ciphertext, keysize)
+            scores = scorer.score_keys_hists(hists)
+        else:
+            scores = scorer.score_keys_many(transpose_blocks(ciphertext,
+                                                             keysize))
+
+        key_bytes = np.argmax(scores, axis=1)
+        total = scores[np.arange(keysize), key_bytes].sum()
+
+        if best_score is None or total > best_score:
+            best_score = total
+            key = bytes(key_bytes.astype(np.uint8))
+
+    key = shortest_period(key)
+
+    return(key, xor_repeating(ciphertext, key))
+
+
+ECBStats = collections.namedtuple(
+    'ECBStats', ['n_blocks', 'n_duplicates', 'repeated_blocks', 'score'])
+
+
+def ecb_block_stats(ciphertext, blockSize=16):
+    """
+    Counts repeated blocks in a ciphertext without comparing every pair or
+    copying any block: the ciphertext is viewed as an array of
+    blockSize-byte records and np.unique groups the equal ones.  A short
+    last block can't repeat.
+
+    Returns an ECBStats: the number of blocks, how many blocks are copies
+    of an earlier one, the (sorted) indices of every block that appears
+    more than once, and a repetition score (duplicates / blocks).
+    """
+
+    n_blocks = -(-len(ciphertext) // blockSize)
+    n_full = len(ciphertext) // blockSize
+    if n_full < 2:
+        return(ECBStats(n_blocks, 0, [], 0.0))
+
+    blocks = np.frombuffer(ciphertext, dtype=f'V{blockSize}', count=n_full)
+    _, inverse, counts = np.unique(blocks, return_inverse=True,
+                                   return_counts=True)
+    n_duplicates = n_full - len(counts)
+
+    if n_duplicates == 0:
+        return(ECBStats(n_blocks, 0, [], 0.0))
+
+    repeated = np.flatnonzero(counts[inverse.ravel()] > 1).tolist()
+
+    return(ECBStats(n_blocks, n_duplicates, repeated,
+                    n_duplicates / n_blocks))
 
 
 def detect_AES_ECB(ciphertext, blockSize=16):
@@ -100,16 +940,7 @@ def detect_AES_ECB(ciphertext, blockSize=16):
     was used to encrypt.
     """
 
-    CT_Blocks = [ciphertext[ii:ii+blockSize] for ii in
-                 range(0, len(ciphertext), blockSize)]
-
-    for ii in range(0, len(CT_Blocks)-1):
-        for jj in range(ii+1, len(CT_Blocks)):
-            if CT_Blocks[ii] == CT_Blocks[jj]:
-                return(True)
-
-    # Didn't find any matching blocks...ECB not detected
-    return(False)
+    return(ecb_block_stats(ciphertext, blockSize).n_duplicates > 0)
 
 
 def detect_AES_ECB_adjacent(ciphertext, blockSize=16):
@@ -118,16 +949,77 @@ def detect_AES_ECB_adjacent(ciphertext, blockSize=16):
     data.  If two output blocks are identical, it's a good indication
     that ECB mode was used to encrypt.
     """
-    CT_Blocks = [ciphertext[ii:ii+blockSize] for ii in
-                 range(0, len(ciphertext), blockSize)]
 
-    for block_idx in range(len(CT_Blocks)-1):
-        if CT_Blocks[block_idx] == CT_Blocks[block_idx+1]:
-            return block_idx
+    repeated = ecb_block_stats(ciphertext, blockSize).repeated_blocks
+
+    for block_idx, next_idx in zip(repeated, repeated[1:]):
+        if next_idx == block_idx + 1:
+            start = block_idx * blockSize
+            if ciphertext[start:start+blockSize] == \
+               ciphertext[start+blockSize:start+2*blockSize]:
+                return block_idx
 
     return(-1)
 
 
+def rank_ECB_ciphertexts(ciphertexts, blockSize=16, n_workers=None):
+    """
+    Runs ecb_block_stats over a list of ciphertexts (in a process pool when
+    there are lots of them) and returns [(index, ECBStats), ...] ordered
+    by repetition score, most ECB-like first.
+    """
+
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    block_sizes = [blockSize] * len(ciphertexts)
+
+    if n_workers == 1 or len(ciphertexts) < 1000:
+        stats = list(map(ecb_block_stats, ciphertexts, block_sizes))
+    else:
+        chunksize = max(1, len(ciphertexts) // (4*n_workers))
+        with ProcessPoolExecutor(n_workers) as pool:
+            stats = list(pool.map(ecb_block_stats, ciphertexts, block_sizes,
+                                  chunksize=chunksize))
+
+    order = sorted(range(len(stats)), key=lambda ii: -stats[ii].score)
+
+    return([(ii, stats[ii]) for ii in order])
+
+
+def _scan_ECB_chunk(chunk, n_best):
+    """
+    scan_file chunk_fn: ecb_block_stats for every hex line in chunk,
+    candidates are (score, line index within chunk, ECBStats).
+    """
+
+    lines = chunk.splitlines()
+    idxs, cts, n_bad = _unhex_lines(lines)
+    candidates = []
+    for idx, ct in zip(idxs, cts):
+        stats = ecb_block_stats(ct)
+        if stats.n_duplicates:
+            candidates.append((stats.score, idx, stats))
+
+    candidates.sort(key=lambda c: -c[0])
+
+    return(len(lines), candidates[:n_best], n_bad)
+
+
+def scan_ECB_file(file_name, n_best=10, n_workers=None, chunk_size=2**20):
+    """
+    Set 1, Challenge 8 for big inputs: finds the lines of a file of
+    hex-encoded ciphertexts with the most repeated 16 byte blocks (see
+    scan_file).  Lines without any repeats aren't reported, and lines that
+    aren't valid hex are skipped and counted in stats['bad_lines'].
+
+    Returns (candidates, stats): candidates is a list of
+    (score, line number, ECBStats), best first.
+    """
+
+    return(scan_file(file_name, _scan_ECB_chunk, n_best, n_workers,
+                     chunk_size))
+
+
 def PKCS7_pad(data, blocksize=16):
     """
     Returns PKCS7 padded data for a given input and block size.
@@ -168,80 +1060,325 @@ def valid_PKCS7_pad(data):
         return(False)
     
 
-def AESEncrypt(plaintext, key, mode='ECB', IV=[0]*16, pad=True):
+def ctr_keystream_blocks(aes, nonce, start, count):
+    """
+    Returns keystream blocks start .. start+count-1 for CTR mode with this
+    repo's counter layout: 8 byte nonce || 8 byte little-endian block
+    counter.  aes is an AES ECB object; all the counter blocks are built
+    as one NumPy array and encrypted in a single call.
+    """
 
-    if not(mode == 'CTR') and (pad==True):
-        if not(valid_PKCS7_pad(plaintext)) or ((len(plaintext) % 16) != 0):
-            plaintext = PKCS7_pad(plaintext, 16)
+    counters = np.empty((count, 2), dtype='<u8')
+    counters[:, 0] = int.from_bytes(bytes(nonce), 'little')
+    counters[:, 1] = np.arange(start, start + count, dtype=np.uint64)
 
-    blockSize = 16
-    ciphertext = b''
+    return(aes.encrypt(memoryview(counters).cast('B')))
 
-    aes = AES.new(key, AES.MODE_ECB)
 
-    if mode == 'ECB':
+def _as_buffer(data):
+    """Contiguous byte memoryview of data (bytes, lists of ints, arrays...)"""
 
-        ciphertext = aes.encrypt(plaintext)
+    if isinstance(data, (bytes, bytearray)):
+        return(memoryview(data))
 
-    elif mode == 'CBC':
+    return(memoryview(np.ascontiguousarray(as_uint8(data))))
 
-        PT_Blocks = [plaintext[ii:ii+blockSize] for ii in
-                     range(0, len(plaintext), blockSize)]
 
-        for block in PT_Blocks:
+class AESCipher:
+    """
+    Streaming AES in the modes supported by AESEncrypt / AESDecrypt
+    ('ECB', 'CBC' and 'CTR').  Pass data through update() as it arrives and
+    call finalize() at the end; the concatenated outputs are the same
+    bytes AESEncrypt / AESDecrypt produce for the whole message.
+
+    IV is the CBC IV (default all zeros) or the 8 byte CTR nonce (default
+    all zeros).  If pad is set, finalize() PKCS#7 pads when encrypting
+    ECB / CBC; decryption never strips padding (same as AESDecrypt).
+
+    CTR keystream is generated in batches (see ctr_keystream_blocks) and
+    CBC decryption is done as one ECB decrypt of all the blocks followed by
+    a single XOR with the shifted ciphertext.  Output goes into a
+    preallocated bytearray rather than being built up block by block.
+    """
 
-            AES_input = bitwise_xor(block, IV)
-            IV = aes.encrypt(AES_input)
-            ciphertext += IV
+    block_size = 16
 
-    elif mode == 'CTR':
+    # Counter blocks per ECB call in CTR mode (1 MB of keystream)
+    ctr_chunk_blocks = 2**16
 
-        if (len(IV) == 16) and (IV == [0]*16):
-            # If all zeros nonce or none was passed in, set it to 8 x 0's
-            IV = [0]*8
+    def __init__(self, key, mode='ECB', IV=None, decrypt=False, pad=False):
 
-        elif len(IV) != 8:
+        self.mode = mode
+        self.decrypt = decrypt
+        self.pad = pad
+        self.aes = AES.new(bytes(key), AES.MODE_ECB)
+        self.remainder = b''
+        self.finalized = False
+
+        if mode == 'ECB':
+
+            pass
+
+        elif mode == 'CBC':
+
+            iv = bytes(16) if IV is None else bytes(IV)
+            if len(iv) != 16:
+                raise(ValueError('IV must be 16 bytes for CBC mode'))
+
+            if decrypt:
+                self.prev_block = iv
+            else:
+                self.cbc = AES.new(bytes(key), AES.MODE_CBC, iv=iv)
+
+        elif mode == 'CTR':
+
+            self.nonce = bytes(8) if IV is None else bytes(IV)
+            if len(self.nonce) != 8:
+                raise(ValueError('Nonce must be 8 bytes for CTR mode'))
+            self.offset = 0
+
+        else:
+
+            raise(ValueError(f'Mode {mode} is not supported yet!'))
+
+    def update(self, data):
+
+        if self.finalized:
+            raise(ValueError('update() called after finalize()'))
+
+        data = _as_buffer(data)
+
+        if self.mode == 'CTR':
+            return(self._update_CTR(data))
+
+        if self.remainder:
+            data = memoryview(self.remainder + bytes(data))
+
+        n_full = len(data) - (len(data) % self.block_size)
+        self.remainder = bytes(data[n_full:])
+
+        return(self._process_blocks(data[:n_full]))
+
+    def finalize(self):
+
+        self.finalized = True
+
+        if self.mode == 'CTR':
+            return(b'')
+
+        if self.pad and not self.decrypt:
+            return(self._process_blocks(memoryview(
+                PKCS7_pad(self.remainder, self.block_size))))
+
+        if self.remainder:
+            raise(ValueError('Data must be aligned to the 16 byte block '
+                             f'boundary in {self.mode} mode'))
+
+        return(b'')
+
+    def _process_blocks(self, data):
+
+        n = len(data)
+        if n == 0:
+            return(b'')
+
+        out = bytearray(n)
+
+        if self.mode == 'ECB':
+
+            if self.decrypt:
+                self.aes.decrypt(data, output=out)
+            else:
+                self.aes.encrypt(data, output=out)
+
+        elif self.decrypt:
+
+            # P_i = D(C_i) ^ C_(i-1): decrypt every block at once, then
+            # XOR against the ciphertext shifted along by one block.
+            self.aes.decrypt(data, output=out)
+            out_mv = memoryview(out)
+            bitwise_xor(out_mv[:16], self.prev_block, out=out_mv[:16])
+            bitwise_xor(out_mv[16:], data[:-16], out=out_mv[16:])
+            self.prev_block = bytes(data[-16:])
+
+        else:
+
+            self.cbc.encrypt(data, output=out)
+
+        return(bytes(out))
+
+    def _update_CTR(self, data):
+
+        n = len(data)
+        out = bytearray(n)
+        out_mv = memoryview(out)
+
+        pos = 0
+        while pos < n:
+            start_block, skip = divmod(self.offset, self.block_size)
+            take = min(n - pos, self.ctr_chunk_blocks*self.block_size - skip)
+            n_blocks = (skip + take + self.block_size - 1) // self.block_size
+            keystream = ctr_keystream_blocks(self.aes, self.nonce,
+                                             start_block, n_blocks)
+            bitwise_xor(data[pos:pos+take],
+                        memoryview(keystream)[skip:skip+take],
+                        out=out_mv[pos:pos+take])
+            pos += take
+            self.offset += take
+
+        return(bytes(out))
+
+
+class CTRKeystream:
+    """
+    Random-access AES-CTR keystream (same layout as AESEncrypt(..., 'CTR')).
+
+    ks[offset:offset+n] returns n bytes of keystream starting at byte
+    offset.  Keystream is generated lazily in pages of page_blocks blocks
+    and kept in an LRU cache of at most cache_bytes, so repeatedly editing
+    or decrypting the same region (Set 3 / Set 4 CTR challenges) doesn't
+    re-run AES.  Requests bigger than the cache bypass it.
+    """
+
+    block_size = 16
 
+    def __init__(self, key, nonce=None, cache_bytes=2**24, page_blocks=256):
+
+        if nonce is None or (len(nonce) == 16 and list(nonce) == [0]*16):
+            nonce = [0]*8
+        if len(nonce) != 8:
             raise(ValueError('Nonce must be 8 bytes for CTR mode'))
 
-        nonce = IV
-        PT_Blocks = [plaintext[ii:ii+blockSize] for ii in
-                     range(0, len(plaintext), blockSize)]
+        self.aes = AES.new(bytes(key), AES.MODE_ECB)
+        self.nonce = bytes(nonce)
+        self.page_blocks = page_blocks
+        self.page_size = page_blocks * self.block_size
+        self.max_pages = max(1, cache_bytes // self.page_size)
+        self.pages = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _page(self, page_idx):
+
+        page = self.pages.get(page_idx)
+        if page is not None:
+            self.hits += 1
+            self.pages.move_to_end(page_idx)
+            return(page)
+
+        self.misses += 1
+        page = ctr_keystream_blocks(self.aes, self.nonce,
+                                    page_idx*self.page_blocks,
+                                    self.page_blocks)
+        self.pages[page_idx] = page
+        if len(self.pages) > self.max_pages:
+            self.pages.popitem(last=False)
+
+        return(page)
+
+    def keystream(self, offset, n):
+        """Returns n bytes of keystream starting at byte offset"""
+
+        if offset < 0 or n < 0:
+            raise(ValueError('Offset and length must be non-negative'))
+        if n == 0:
+            return(b'')
+
+        first_page = offset // self.page_size
+        last_page = (offset + n - 1) // self.page_size
+
+        if last_page - first_page + 1 > self.max_pages:
+            # Wouldn't fit in the cache anyway; generate directly.
+            start_block, skip = divmod(offset, self.block_size)
+            out = bytearray(n)
+            pos = 0
+            chunk_blocks = AESCipher.ctr_chunk_blocks
+            while pos < n:
+                n_blocks = min(chunk_blocks,
+                               (skip + n - pos + self.block_size - 1) //
+                               self.block_size)
+                ks = ctr_keystream_blocks(self.aes, self.nonce, start_block,
+                                          n_blocks)
+                take = min(n - pos, len(ks) - skip)
+                out[pos:pos+take] = ks[skip:skip+take]
+                pos += take
+                start_block += n_blocks
+                skip = 0
+            return(bytes(out))
+
+        start = offset - first_page*self.page_size
+        ks = b''.join(self._page(p) for p in range(first_page, last_page+1))
+
+        return(ks[start:start+n])
+
+    def __getitem__(self, idx):
+
+        if isinstance(idx, slice):
+            if idx.step not in (None, 1) or idx.start is None or \
+               idx.stop is None:
+                raise(ValueError('Keystream slices need a start and stop '
+                                 'and no step'))
+            return(self.keystream(idx.start, max(0, idx.stop - idx.start)))
+
+        return(self.keystream(idx, 1)[0])
+
+    def seek_edit(self, ciphertext, offset, newtext):
+        """
+        Set 4, Challenge 25: re-encrypts ciphertext with the plaintext at
+        offset replaced by newtext.  Only the keystream under newtext is
+        generated.  A bytearray ciphertext is edited in place (and
+        returned); anything else gets a new bytes object.
+        """
+
+        if offset > len(ciphertext):
+            raise(ValueError('Offset is past the end of the ciphertext'))
+
+        segment = bitwise_xor(newtext, self.keystream(offset, len(newtext)))
+
+        if isinstance(ciphertext, bytearray):
+            ciphertext[offset:offset+len(segment)] = segment
+            return(ciphertext)
+
+        return(bytes(ciphertext[:offset]) + segment +
+               bytes(ciphertext[offset+len(segment):]))
 
-        for blk_idx, block in enumerate(PT_Blocks):
 
-            AES_input = bytes(nonce) + int.to_bytes(blk_idx, 8, 'little')
-            block_KEY = aes.encrypt(AES_input)
-            ciphertext += bitwise_xor(block_KEY[0:len(block)], block)
+def AESEncrypt(plaintext, key, mode='ECB', IV=[0]*16, pad=True):
 
-    else:
+    if not(mode == 'CTR') and (pad==True):
+        if not(valid_PKCS7_pad(plaintext)) or ((len(plaintext) % 16) != 0):
+            plaintext = PKCS7_pad(plaintext, 16)
 
-        assert(f'Mode {mode} is not supported yet!')
+    if mode in ('ECB', 'CBC'):
 
-    return(ciphertext)
+        cipher = AESCipher(key, mode, IV)
 
+    elif mode == 'CTR':
 
-def AESDecrypt(ciphertext, key, mode='ECB', IV=[0]*16):
+        if (len(IV) == 16) and (IV == [0]*16):
+            # If all zeros nonce or none was passed in, set it to 8 x 0's
+            IV = [0]*8
 
-    blockSize = 16
-    plaintext = b''
+        elif len(IV) != 8:
 
-    aes = AES.new(key, AES.MODE_ECB)
+            raise(ValueError('Nonce must be 8 bytes for CTR mode'))
 
-    if mode == 'ECB':
+        cipher = AESCipher(key, mode, IV)
 
-        return(aes.decrypt(ciphertext))
+    else:
 
-    elif mode == 'CBC':
+        assert(f'Mode {mode} is not supported yet!')
+        return(b'')
 
-        CT_Blocks = [ciphertext[ii:ii+blockSize] for ii in
-                     range(0, len(ciphertext), blockSize)]
+    return(cipher.update(plaintext) + cipher.finalize())
 
-        for block in CT_Blocks:
 
-            AES_output = aes.decrypt(block)
-            plaintext += bitwise_xor(AES_output, IV)
-            IV = block
+def AESDecrypt(ciphertext, key, mode='ECB', IV=[0]*16):
+
+    if mode in ('ECB', 'CBC'):
+
+        cipher = AESCipher(key, mode, IV, decrypt=True)
+        plaintext = cipher.update(ciphertext) + cipher.finalize()
 
     elif mode == 'CTR':
 
@@ -251,10 +1388,59 @@ def AESDecrypt(ciphertext, key, mode='ECB', IV=[0]*16):
     else:
 
         assert(f'Mode {mode} is not supported yet!')
+        plaintext = b''
 
     return(plaintext)
 
 
+def run_aes_benchmark(n_bytes=2**28):
+    """
+    Checks AESEncrypt / AESDecrypt / AESCipher against pycryptodome's own
+    modes (and the per-block CTR layout) and prints throughput per mode.
+    """
+
+    key = os.urandom(16)
+    iv = os.urandom(16)
+    nonce = os.urandom(8)
+    aes = AES.new(key, AES.MODE_ECB)
+
+    for size in [0, 1, 15, 16, 17, 100, 1000]:
+        pt = os.urandom(size)
+        ct = AESEncrypt(PKCS7_pad(pt), key, 'CBC', iv, pad=False)
+        assert(ct == AES.new(key, AES.MODE_CBC, iv=iv).encrypt(
+            PKCS7_pad(pt)))
+        assert(AESDecrypt(ct, key, 'CBC', iv) == PKCS7_pad(pt))
+
+        ct = AESEncrypt(pt, key, 'CTR', nonce)
+        keystream = b''.join(aes.encrypt(nonce + ii.to_bytes(8, 'little'))
+                             for ii in range(size // 16 + 1))
+        assert(ct == bitwise_xor_ref(pt, keystream))
+
+        # Same bytes when fed through in odd sized pieces
+        for mode, mode_iv in [('ECB', None), ('CBC', iv), ('CTR', nonce)]:
+            for decrypt in [False, True]:
+                cipher = AESCipher(key, mode, mode_iv, decrypt, pad=True)
+                whole = cipher.update(ct) + cipher.finalize() \
+                    if mode == 'CTR' or len(ct) % 16 == 0 else None
+                if whole is None:
+                    continue
+                cipher = AESCipher(key, mode, mode_iv, decrypt, pad=True)
+                pieces = [cipher.update(ct[ii:ii+7])
+                          for ii in range(0, len(ct), 7)]
+                assert(b''.join(pieces) + cipher.finalize() == whole)
+
+    data = os.urandom(n_bytes)
+    for mode, mode_iv in [('ECB', [0]*16), ('CBC', iv), ('CTR', nonce)]:
+        t0 = time.perf_counter()
+        ct = AESEncrypt(data, key, mode, mode_iv)
+        t_enc = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        AESDecrypt(ct, key, mode, mode_iv)
+        t_dec = time.perf_counter() - t0
+        print(f'{mode}: encrypt {n_bytes/t_enc/1e9:.2f} GB/s, '
+              f'decrypt {n_bytes/t_dec/1e9:.2f} GB/s')
+
+
 def encryption_oracle(data):
     """
     Implements Set 2, Challenge 11 - Encryption Oracle
@@ -317,6 +1503,119 @@ def encryption_oracle_3(data, key, random_prefix):
     return(AESEncrypt(AES_input, key))
 
 
+class ECBByteAtATime:
+    """
+    Byte-at-a-time ECB decryption (Set 2, Challenges 12 and 14) against
+    oracle(data) = ECB(prefix || data || secret), e.g.
+    lambda d: encryption_oracle_3(d, key, prefix).
+
+    The block size, prefix length and secret length are worked out from
+    the oracle.  Then, for each secret byte, the 256 dictionary blocks are
+    sent in ONE oracle call with the alignment filler after them, so the
+    same response holds both the dictionary and the target block.  Each
+    response is cached (dictionaries by 15 byte context, target blocks by
+    position), so a byte never costs more than one call and repeated
+    contexts cost nothing.
+    """
+
+    def __init__(self, oracle, max_block_size=256):
+
+        self.oracle = oracle
+        self.max_block_size = max_block_size
+        self.calls = 0
+        self.dictionaries = {}
+        self.targets = {}
+
+    def _ask(self, data):
+
+        self.calls += 1
+        return(self.oracle(data))
+
+    def _blocks(self, ciphertext):
+
+        bs = self.block_size
+        return([ciphertext[ii:ii+bs] for ii in
+                range(0, len(ciphertext), bs)])
+
+    def detect(self):
+        """Finds block_size, prefix_len and secret_len"""
+
+        base_len = len(self._ask(b''))
+        for ii in range(1, self.max_block_size + 1):
+            new_len = len(self._ask(b'A' * ii))
+            if new_len > base_len:
+                self.block_size = new_len - base_len
+                break
+        else:
+            raise(ValueError('Could not find the block size'))
+        bs = self.block_size
+
+        # Two copies of a random block land in adjacent output blocks
+        # once the filler in front of them lines them up.  One byte short
+        # of that, they also match if the secret happens to start with the
+        # block's first byte -- so check any match with a second block.
+        def probe(fill):
+            return(detect_AES_ECB_adjacent(
+                self._ask(b'\x00'*fill + os.urandom(bs)*2), bs))
+
+        for fill in range(bs):
+            idx = probe(fill)
+            if idx >= 0 and probe(fill) == idx:
+                self.prefix_len = idx*bs - fill
+                break
+        else:
+            raise(ValueError('Oracle does not look like ECB'))
+
+        # The output grew at ii bytes of input: prefix + ii + secret filled
+        # the last block exactly, with a full block of padding after.
+        self.secret_len = base_len - ii - self.prefix_len
+
+        self.align_len = (-self.prefix_len) % bs
+        self.start_block = (self.prefix_len + self.align_len) // bs
+
+    def _query(self, pos, context):
+        """
+        One oracle call that yields the dictionary for context (if not
+        already cached) and the target blocks for every position with the
+        same alignment as pos.
+        """
+
+        bs = self.block_size
+        candidates = [] if context in self.dictionaries else range(256)
+        probes = b''.join(context + bytes([c]) for c in candidates)
+        fill = (bs - 1 - pos) % bs
+
+        blocks = self._blocks(self._ask(b'A'*self.align_len + probes +
+                                        b'A'*fill))
+
+        if candidates:
+            self.dictionaries[context] = {
+                blocks[self.start_block + c]: c for c in candidates}
+
+        secret_block = self.start_block + len(candidates)
+        for p in range(bs - 1 - fill, self.secret_len, bs):
+            self.targets[p] = blocks[secret_block + (fill + p) // bs]
+
+    def decrypt(self):
+        """Returns the secret the oracle appends to our input"""
+
+        if not hasattr(self, 'block_size'):
+            self.detect()
+        bs = self.block_size
+
+        known = b'A' * (bs - 1)
+        for pos in range(self.secret_len):
+            context = known[-(bs-1):]
+            if context not in self.dictionaries or pos not in self.targets:
+                self._query(pos, context)
+            byte = self.dictionaries[context].get(self.targets[pos])
+            if byte is None:
+                raise(ValueError(f'No dictionary match for byte {pos}'))
+            known += bytes([byte])
+
+        return(known[bs-1:])
+
+
 def profile_for(email_address):
     """
     For Challenge #13 (Set #2)
@@ -344,78 +1643,215 @@ def parse_structured_cookie(data):
 
 
 def compute_sha1_padding(data):
+    """Returns the padding SHA-1 would append to data"""
 
-    # Let's assume message / data is always complete bytes, no extra bits,
-    # so always append 0x80
-    msg_len = len(data)
+    return(sha1.sha1_padding(len(data)))
 
-    # Pad with 0’s until message is 64-bits less than some multiple of 512
-    # (64 in bytes)
-    n_zero_bytes = ( (56 - ( (msg_len % 64) + 1) ) % 64 )
 
-    padding = b'\x80' + b'\x00'*n_zero_bytes + (msg_len*8).to_bytes(8, 'big')
-    return(padding)
+def compute_md4_padding(data):
+    """Returns the padding MD4 would append to data"""
 
+    return(md4.md4_padding(len(data)))
 
-def compute_md4_padding(data):
 
-    # Let's assume message / data is always complete bytes, no extra bits,
-    # so always append 0x80
-    msg_len = len(data)
+class LengthExtender:
+    """
+    Length extension against a secret-prefix MAC, hash(key + message)
+    (Set 4, Challenges 29 and 30).  hash_class is sha1.SHA1 or md4.MD4, or
+    anything else with resume() and padding().
+
+    forge(key_length) returns the forged message (message + glue padding +
+    suffix) and its MAC for one guess at the key length.  The MAC only
+    depends on how many whole blocks key + message + glue fill, so it's
+    computed once per block count -- resumed from the known MAC, with just
+    the suffix compressed -- and shared by every key length that lands on
+    that count.  find() tries key lengths against a verifier.
+    """
+
+    def __init__(self, hash_class, message, mac, suffix):
 
-    # Pad with 0’s until message is 64-bits less than some multiple of 512
-    # (64 in bytes)
-    n_zero_bytes = ( (56 - ( (msg_len % 64) + 1) ) % 64 )
+        self.hash_class = hash_class
+        self.message = bytes(message)
+        self.mac = bytes(mac)
+        self.suffix = bytes(suffix)
+        self.macs = {}
 
-    padding = b'\x80' + b'\x00'*n_zero_bytes + \
-              (msg_len*8).to_bytes(8, 'little')
+    def forge(self, key_length):
 
-    return(padding)
+        glue = self.hash_class.padding(key_length + len(self.message))
+        prior_length = key_length + len(self.message) + len(glue)
 
+        mac = self.macs.get(prior_length)
+        if mac is None:
+            resumed = self.hash_class.resume(self.mac, prior_length)
+            mac = resumed.add(self.suffix).finish()
+            self.macs[prior_length] = mac
 
-def egcd(a, b):
+        return(self.message + glue + self.suffix, mac)
 
-    s, old_s = 0, 1
-    t, old_t = 1, 0
-    r, old_r = b, a
+    def find(self, verify, key_lengths=range(0, 129)):
+        """
+        Returns (key_length, forged message, MAC) for the first key length
+        where verify(message, MAC) is true, or None.
+        """
 
-    while r != 0:
+        for key_length in key_lengths:
+            message, mac = self.forge(key_length)
+            if verify(message, mac):
+                return((key_length, message, mac))
 
-        q = old_r // r
-        old_r, r = r, (old_r - q*r)
-        old_s, s = s, (old_s - q*s)
-        old_t, t = t, (old_t - q*t)
+        return(None)
 
-    return(old_r, old_s, old_t)
-    # return(old_r, t, s)
 
+def run_length_extension_tests(n_key_lengths=10000):
+    """
+    Forges SHA-1 and MD4 MACs with LengthExtender, checks them against the
+    real MAC, and times forging for n_key_lengths key length guesses.
+    """
+
+    message = b'comment1=cooking%20MCs;userdata=foo;' \
+              b'comment2=%20like%20a%20pound%20of%20bacon'
+    suffix = b';admin=true'
+
+    for hash_class in [sha1.SHA1, md4.MD4]:
+        key = os.urandom(randint(1, 100))
+
+        def verify(msg, mac):
+            return(hash_class(key + msg).finish() == mac)
+
+        mac = hash_class(key + message).finish()
+        found = LengthExtender(hash_class, message, mac, suffix).find(verify)
+        assert(found is not None and found[0] == len(key))
+        assert(found[1].endswith(suffix))
+
+        extender = LengthExtender(hash_class, message, mac, suffix)
+        t0 = time.perf_counter()
+        forged = [extender.forge(kk) for kk in range(n_key_lengths)]
+        dt = time.perf_counter() - t0
+        msg, mac = forged[len(key)]
+        assert(hash_class(key + msg).finish() == mac)
+
+        print(f'{hash_class.__name__}: {n_key_lengths} key lengths forged in '
+              f'{dt*1000:.1f} ms ({len(extender.macs)} suffix compressions)')
+
+
+class HMACKey:
+    """
+    HMAC with one key, for hash_class sha1.SHA1 or md4.MD4 (anything with
+    the hashlib-style copy() and many()).
+
+    The key's inner and outer padded blocks are compressed once, here, and
+    every MAC starts from copies of those two states -- two compressions a
+    message fewer than hashing the pads each time.  verify() compares in
+    constant time.  sign_many() signs equal-length messages together on
+    NumPy lanes (see sha1_many), in groups by length.
+    """
+
+    many_threshold = 32         # Smaller groups are signed one at a time
+
+    def __init__(self, key, hash_class=sha1.SHA1):
+
+        self.hash_class = hash_class
+        block_size = hash_class.block_size
+
+        key = bytes(key)
+        if len(key) > block_size:
+            key = hash_class(key).digest()
+        key = key + b'\x00' * (block_size - len(key))
+
+        self.inner = hash_class(bytes(k ^ 0x36 for k in key))
+        self.outer = hash_class(bytes(k ^ 0x5c for k in key))
+
+    def sign(self, message):
+
+        inner = self.inner.copy()
+        inner.update(message)
+        outer = self.outer.copy()
+        outer.update(inner.digest())
+
+        return(outer.digest())
+
+    def verify(self, message, mac):
+        """True if mac is message's MAC; the time taken doesn't depend on mac"""
+
+        return(hmac.compare_digest(self.sign(message), bytes(mac)))
+
+    def sign_many(self, messages):
+        """The MACs of a list of messages, in order"""
+
+        block_size = self.hash_class.block_size
+        by_length = collections.defaultdict(list)
+        for ii, message in enumerate(messages):
+            by_length[len(message)].append(ii)
+
+        macs = [None] * len(messages)
+        for indices in by_length.values():
+            if len(indices) < self.many_threshold:
+                for ii in indices:
+                    macs[ii] = self.sign(messages[ii])
+                continue
+
+            inner = self.hash_class.many([bytes(messages[ii]) for ii in indices],
+                                         self.inner.h, block_size)
+            outer = self.hash_class.many(inner, self.outer.h, block_size)
+            for ii, mac in zip(indices, outer):
+                macs[ii] = mac.tobytes()
+
+        return(macs)
+
+
+def run_hmac_tests(n_messages=4096, length=32):
+    """
+    Checks HMACKey against the hmac module for SHA-1 and MD4 (hmac driving
+    md4.MD4 itself, as hashlib may not have MD4), then times sign,
+    sign_many and the pads-every-time version on n_messages short messages.
+    """
 
-def invmod2(a, n):
+    for hash_class, digestmod in [(sha1.SHA1, 'sha1'), (md4.MD4, md4.MD4)]:
+        for key_len in [0, 7, 63, 64, 65, 200]:
+            key = os.urandom(key_len)
+            hk = HMACKey(key, hash_class)
+            messages = [os.urandom(n) for n in [0, 1, 55, 56, 64, 1000]] + \
+                [os.urandom(length) for _ in range(HMACKey.many_threshold)]
+            expected = [hmac.new(key, m, digestmod).digest() for m in messages]
 
-    t, newt = 0, 1
-    r, newr = n, a
+            assert([hk.sign(m) for m in messages] == expected)
+            assert(hk.sign_many(messages) == expected)
+            assert(hk.verify(messages[0], expected[0]))
+            assert(not hk.verify(messages[0], expected[1]))
 
-    while newr != 0:
+    print('HMACKey tests passed')
 
-        quotient = r // newr
-        t, newt = newt, t - quotient*newt
-        r, newr = newr, r - quotient*newr
+    for hash_class in [sha1.SHA1, md4.MD4]:
+        key = os.urandom(16)
+        hk = HMACKey(key, hash_class)
+        messages = [os.urandom(length) for _ in range(n_messages)]
+        ipad = bytes(b ^ 0x36 for b in key + bytes(48))
+        opad = bytes(b ^ 0x5c for b in key + bytes(48))
 
-    if r > 1:
-        return "a is not invertible"
-    if t < 0:
-        t += n
+        t0 = time.perf_counter()
+        for m in messages:
+            hash_class(opad + hash_class(ipad + m).digest()).digest()
+        t_pads = time.perf_counter() - t0
 
-    return t
+        t0 = time.perf_counter()
+        for m in messages:
+            hk.sign(m)
+        t_sign = time.perf_counter() - t0
 
-def invmod(a, m):
+        t0 = time.perf_counter()
+        hk.sign_many(messages)
+        t_many = time.perf_counter() - t0
 
-    g, x, y = egcd(a, m)
+        print(f'{hash_class.__name__} HMAC of {length} byte messages: '
+              f'pads each time {n_messages/t_pads:8.0f}/s, '
+              f'sign {n_messages/t_sign:8.0f}/s, '
+              f'sign_many {n_messages/t_many:8.0f}/s')
 
-    while x < 0:
-        x += m
 
-    return(x % m)
+egcd = number_theory.egcd
+invmod = number_theory.invmod
+invmod2 = number_theory.invmod
 
 
 def genRSA_keypair(keysize):
@@ -435,15 +1871,7 @@ def genRSA_keypair(keysize):
 
 def root(root, b):
 
-    if b < 2:
-        return b
-    a1 = root - 1
-    c = 1
-    d = (a1 * c + b // (c ** a1)) // root
-    e = (a1 * d + b // (d ** a1)) // root
-    while c not in (d, e):
-        c, d, e = d, e, (a1 * e + b // (e ** a1)) // root
-    return min(d, e)
+    return(number_theory.iroot(root, b))
 
 
 def gen_DSA_sig(x, m, p, q, g):
@@ -612,103 +2040,11 @@ def generate_expandable_message(k, initial_state, block_size):
 
 
 def MD4(data):
-    
+    """
+    MD4 digest of data (str or bytes), from the streaming engine in md4.py.
+    """
+
     if isinstance(data, str):
         data = data.encode()
-    
-    # Step 1:  Append padding bits.  Single 1-bit + 0-bits so that
-    #          length of message is congruent to 448 mod 512.
-    #          I'll assume we're always passed a string or bytes.
-    
-    data += b'\x80' # Hex 0x80 = 0b10000000
-    data_len = len(data) % 64
-    padding_len = (56 - data_len) % 64
-    data += b'\x00'*padding_len
-    
-    # Step 2:  Append length.  64-bit representation before padding.
-    
-    data += ((data_len-1)*8).to_bytes(8, 'little', signed=False)
-        
-    # Step 3:  Initialize MD Buffer.  
-    
-    A, B, C, D = 0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476
-    
-    MGK_1 = 0x5a827999
-    MGK_2 = 0x6ed9eba1
-    
-    # Step 4:  Process Message in blocks of 16 32-bit words (512 bits ea)
-    
-    # Define Auxilliary Functions:
-    
-    def lrot_32(n, d):
-        # Circular rotate.  Python only natively supports non-circular shift.
-        return ( (n << d) | (n >> (32 - d)) )
-    
-    def F(X, Y, Z):         
-        return (X & Y) | (~X & Z)
-    
-    def G(X, Y, Z):
-        return (X & Y) | (X & Z) | (Y & Z)
-    
-    def H(X, Y, Z):
-        return (X ^ Y ^ Z)
-    
-    def phi(j, a, b, c, d, m_k, s):                
-        if j == 0:            
-            x = lrot_32(((a + F(b, c, d) + m_k) % 2**32), s)        
-        elif j ==  1:            
-            x = lrot_32(((a + G(b, c, d) + m_k + MGK_1) % 2**32), s)            
-        elif j == 2:            
-            x = lrot_32(((a + H(b, c, d) + m_k + MGK_2) % 2**32), s)            
-        else:            
-            raise(ValueError('Invalid j value to phi()'))        
-        return(x)
-
-    # Convert the data into 32-bit words.
-    
-    M = []
-    N = (len(data) // 64)
-    for ii in range(0, len(data), 4):
-        word = int.from_bytes(data[ii:ii+4], byteorder='little', signed=False)
-        M.append(word)
-    
-    # Run the compression algorithm.  Loop for each block of 512 bits until
-    # full message is consumed.
-    
-    for kk in range(N//16 + 1):
-        
-        X = M[16*kk:16*(kk+1)]
-        AA, BB, CC, DD = A, B, C, D
-        
-        # Round 1
-        for ii in [0, 4, 8, 12]:
-            A = phi(0, A, B, C, D, X[ii], 3) 
-            D = phi(0, D, A, B, C, X[ii+1], 7) 
-            C = phi(0, C, D, A, B, X[ii+2], 11)  
-            B = phi(0, B, C, D, A, X[ii+3], 19)
-
-        # Round 2
-        for ii in [0, 1, 2, 3]:
-            A = phi(1, A, B, C, D, X[ii], 3) 
-            D = phi(1, D, A, B, C, X[ii+4], 5) 
-            C = phi(1, C, D, A, B, X[ii+8], 9)  
-            B = phi(1, B, C, D, A, X[ii+12], 13)
-        
-        # Round 3
-        for ii in [0, 2, 1, 3]:
-            A = phi(2, A, B, C, D, X[ii], 3) 
-            D = phi(2, D, A, B, C, X[(ii+8) % 16], 9) 
-            C = phi(2, C, D, A, B, X[(ii+4) % 16], 11)  
-            B = phi(2, B, C, D, A, X[(ii+12) % 16], 15)
-        
-        A = (A + AA) % 2**32
-        B = (B + BB) % 2**32
-        C = (C + CC) % 2**32
-        D = (D + DD) % 2**32
-    
-    digest = A.to_bytes(4, 'little') + \
-             B.to_bytes(4, 'little') + \
-             C.to_bytes(4, 'little') + \
-             D.to_bytes(4, 'little')
-   
-    return(digest)
\ No newline at end of file
+
+    return(md4.MD4(data).finish())
@@ -0,0 +1,486 @@
+"""
+Asyncio stand-in for the challenge 31/32 web servers.
+
+Same query interface as the web.py versions:
+
+    http://localhost:1234/?file=25.ipynb&signature=<hex HMAC-SHA1>
+
+answers '200' if signature is the HMAC of the file and '500' if not,
+comparing byte by byte with a delay per matching byte (insecure_compare).
+With delay_param on (challenge 32) the delay can also be given per request
+as &delay_time=0.005.  GET /metrics returns request rates and latency
+histograms as JSON.
+
+    python hmac_server.py [port] [--delay 0.05] [--jitter 0.0005]
+                          [--distribution normal] [--delay-param]
+                          [--precise]
+
+Each file's HMAC is cached until the file's mtime or size changes, and the
+key is a cryptopals.HMACKey (padded key blocks compressed once), so a cache
+miss only compresses the file's blocks.  Connections are kept alive and
+each response goes out in a single write.
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import socket
+import sys
+import time
+import urllib.parse
+
+import cryptopals as cp
+
+
+HMAC_KEY = b'ABADKEY'
+
+
+async def precise_sleep(seconds):
+    """
+    asyncio.sleep() wakes on the event loop's next poll after the deadline,
+    and the poll timeout is rounded up to a whole millisecond -- up to 1 ms
+    late.  This sleeps to within a millisecond of the deadline and then
+    yields to the loop until it has passed.  That spins the CPU for the
+    last millisecond, so only use it with a core to spare.
+    """
+
+    deadline = time.perf_counter() + seconds
+    if seconds > 0.001:
+        await asyncio.sleep(seconds - 0.001)
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(0)
+
+
+def matching_prefix(a, b):
+    """
+    How far insecure_compare(a, b) gets: the number of leading bytes that
+    match, or -1 if the lengths differ (rejected before any delay).
+    """
+
+    if len(a) != len(b):
+        return(-1)
+    for ii, (a_i, b_i) in enumerate(zip(a, b)):
+        if a_i != b_i:
+            return(ii)
+
+    return(len(a))
+
+
+class DelayModel:
+    """
+    The time insecure_compare spends on a guess: delay per matching byte,
+    plus jitter drawn from distribution ('none', 'uniform' on
+    [0, jitter), 'normal' with sd jitter, or 'exponential' with mean
+    jitter).  With per_byte the jitter is drawn for every matching byte,
+    otherwise once per request.  Negative totals are clipped to 0.
+    """
+
+    distributions = ('none', 'uniform', 'normal', 'exponential')
+
+    def __init__(self, delay=0.05, jitter=0.0, distribution='none',
+                 per_byte=False, seed=None):
+
+        if distribution not in self.distributions:
+            raise(ValueError(f'distribution must be one of '
+                             f'{self.distributions}'))
+
+        self.delay = delay
+        self.jitter = jitter
+        self.distribution = distribution
+        self.per_byte = per_byte
+        self.rng = random.Random(seed)
+
+    def _noise(self):
+
+        if self.distribution == 'none' or self.jitter == 0:
+            return(0.0)
+        if self.distribution == 'uniform':
+            return(self.rng.uniform(0, self.jitter))
+        if self.distribution == 'normal':
+            return(self.rng.gauss(0, self.jitter))
+
+        return(self.rng.expovariate(1 / self.jitter))
+
+    def __call__(self, matched, delay=None):
+
+        if delay is None:
+            delay = self.delay
+        if self.per_byte:
+            total = sum(delay + self._noise() for _ in range(matched))
+        else:
+            total = matched * delay + self._noise()
+
+        return(max(0.0, total))
+
+
+class FileHMACCache:
+    """
+    HMACs of the files under root, each cached until its mtime or size
+    changes.  Files are read the way the web.py servers read them (text
+    mode, so CRLF and CR line endings become LF).  Paths outside root are
+    refused.
+    """
+
+    def __init__(self, hmac, root='.'):
+        # hmac is a cryptopals.HMACKey
+
+        self.hmac = hmac
+        self.root = os.path.realpath(root)
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, file_name):
+
+        path = os.path.realpath(os.path.join(self.root, file_name))
+        if os.path.commonpath([path, self.root]) != self.root:
+            raise(PermissionError(file_name))
+
+        return(path)
+
+    def __call__(self, file_name):
+
+        path = self.path(file_name)
+        st = os.stat(path)
+        entry = self.cache.get(path)
+        if entry is not None and entry[:2] == (st.st_mtime_ns, st.st_size):
+            self.hits += 1
+            return(entry[2])
+
+        with open(path, 'rb') as f:
+            data = f.read().replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        mac = self.hmac.sign(data)
+        self.cache[path] = (st.st_mtime_ns, st.st_size, mac)
+        self.misses += 1
+
+        return(mac)
+
+
+class LatencyHistogram:
+    """Counts of latencies in power-of-two microsecond buckets"""
+
+    def __init__(self):
+
+        self.counts = collections.Counter()
+        self.total = 0.0
+        self.n = 0
+
+    def add(self, seconds):
+
+        self.counts[max(0, int(seconds * 1e6)).bit_length()] += 1
+        self.total += seconds
+        self.n += 1
+
+    def as_dict(self):
+        """{'<upper bound in us>': count}, plus the count and mean"""
+
+        buckets = {f'<{2**b}us': self.counts[b] for b in sorted(self.counts)}
+
+        return({'n': self.n, 'mean_us': 1e6 * self.total / max(1, self.n),
+                'buckets': buckets})
+
+
+class ServerMetrics:
+    """
+    Request counts by status, requests/sec over the last window seconds,
+    and histograms of the total latency and of the overhead (latency less
+    the deliberate comparison delay) -- the floor the timing rigs see.
+    """
+
+    def __init__(self, window=10):
+
+        self.window = window
+        self.start = time.monotonic()
+        self.requests = 0
+        self.status = collections.Counter()
+        self.per_second = collections.deque()     # [second, count]
+        self.latency = LatencyHistogram()
+        self.overhead = LatencyHistogram()
+
+    def record(self, status, latency, delay):
+
+        self.requests += 1
+        self.status[status] += 1
+        self.latency.add(latency)
+        self.overhead.add(latency - delay)
+
+        second = int(time.monotonic())
+        if self.per_second and self.per_second[-1][0] == second:
+            self.per_second[-1][1] += 1
+        else:
+            self.per_second.append([second, 1])
+            while self.per_second[0][0] <= second - self.window:
+                self.per_second.popleft()
+
+    def rate(self):
+
+        now = time.monotonic()
+        recent = sum(c for s, c in self.per_second if s > now - self.window)
+
+        return(recent / min(self.window, max(1e-9, now - self.start)))
+
+    def as_dict(self):
+
+        return({'requests': self.requests,
+                'uptime': time.monotonic() - self.start,
+                'rate': self.rate(),
+                'status': {str(k): v for k, v in self.status.items()},
+                'latency': self.latency.as_dict(),
+                'overhead': self.overhead.as_dict()})
+
+
+class HMACServer:
+    """
+    The challenge 31/32 server on asyncio.  Requests on one connection are
+    handled in turn; connections are handled concurrently, so a slow
+    comparison only holds up its own connection.  precise uses
+    precise_sleep() for the comparison delay.
+    """
+
+    def __init__(self, key=HMAC_KEY, delay_model=None, root='.',
+                 delay_param=False, precise=False, verbose=False):
+
+        self.hmac = cp.HMACKey(key)
+        self.files = FileHMACCache(self.hmac, root)
+        self.delay_model = delay_model or DelayModel()
+        self.delay_param = delay_param
+        self.precise = precise
+        self.verbose = verbose
+        self.metrics = ServerMetrics()
+        self.server = None
+
+    async def check(self, params):
+        """
+        Answers one query; returns (HTTP status, body, comparison delay).
+        """
+
+        try:
+            file_name = params['file'][0]
+            signature = bytes.fromhex(params['signature'][0])
+            delay = float(params['delay_time'][0]) \
+                if self.delay_param and 'delay_time' in params else None
+        except (KeyError, ValueError):
+            return(400, b'Bad Request', 0.0)
+
+        try:
+            mac = self.files(file_name)
+        except PermissionError:
+            return(403, b'Forbidden', 0.0)
+        except OSError:
+            return(404, b'Not Found', 0.0)
+
+        if self.verbose:
+            print(mac.hex())
+
+        matched = matching_prefix(mac, signature)
+        wait = self.delay_model(max(0, matched), delay)
+        if wait:
+            await (precise_sleep if self.precise else asyncio.sleep)(wait)
+
+        return(200, b'200' if matched == len(mac) else b'500', wait)
+
+    async def respond(self, method, target):
+
+        if method != 'GET':
+            return(405, b'Method Not Allowed', 0.0, 'text/plain')
+
+        parts = urllib.parse.urlsplit(target)
+        if parts.path == '/metrics':
+            metrics = self.metrics.as_dict()
+            metrics['cache'] = {'hits': self.files.hits,
+                                'misses': self.files.misses}
+            return(200, json.dumps(metrics).encode(), 0.0,
+                   'application/json')
+        if parts.path != '/':
+            return(404, b'Not Found', 0.0, 'text/plain')
+
+        status, body, wait = await self.check(
+            urllib.parse.parse_qs(parts.query))
+
+        return(status, body, wait, 'text/plain')
+
+    async def handle(self, reader, writer):
+
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                t0 = time.perf_counter()
+
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split()
+                except ValueError:
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip().lower()
+                if 'content-length' in headers:
+                    await reader.readexactly(int(headers['content-length']))
+
+                keep_alive = headers.get('connection') != 'close' and \
+                    (version == 'HTTP/1.1' or
+                     headers.get('connection') == 'keep-alive')
+
+                status, body, wait, content_type = await self.respond(
+                    method, target)
+
+                writer.write(
+                    f'HTTP/1.1 {status} {_REASONS.get(status, "")}\r\n'
+                    f'Content-Type: {content_type}\r\n'
+                    f'Content-Length: {len(body)}\r\n'
+                    f'Connection: {"keep-alive" if keep_alive else "close"}'
+                    f'\r\n\r\n'.encode() + body)
+                await writer.drain()
+                self.metrics.record(status, time.perf_counter() - t0, wait)
+
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=1234):
+
+        self.server = await asyncio.start_server(self.handle, host, port,
+                                                 backlog=1024)
+        return(self.server)
+
+    async def serve_forever(self, host='127.0.0.1', port=1234):
+
+        await self.start(host, port)
+        async with self.server:
+            await self.server.serve_forever()
+
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden',
+            404: 'Not Found', 405: 'Method Not Allowed'}
+
+
+def run_server(port=1234, host='127.0.0.1', **kwargs):
+    """Runs an HMACServer (kwargs as for HMACServer) until interrupted"""
+
+    server = HMACServer(**kwargs)
+    print(f'Serving HMAC checks on http://{host}:{port}/')
+    try:
+        asyncio.run(server.serve_forever(host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+def _free_port():
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return(sock.getsockname()[1])
+
+
+def run_hmac_server_tests(n_requests=20000, concurrency=64,
+                          file_name='challenge-data/6.txt'):
+    """
+    Starts a server (no delay) in another process, checks its answers
+    against the hmac module, and reports requests/sec and its latency floor
+    from /metrics.
+    """
+
+    import hashlib
+    import hmac
+    import multiprocessing as mp
+
+    import timing_attack
+
+    with open(file_name, 'rb') as f:
+        data = f.read().replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    mac = hmac.new(HMAC_KEY, data, hashlib.sha1).digest()
+
+    port = _free_port()
+    proc = mp.Process(target=run_server, args=(port,),
+                      kwargs={'delay_model': DelayModel(0.0)}, daemon=True)
+    proc.start()
+
+    async def client():
+
+        url = f'http://127.0.0.1:{port}/'
+        oracle = timing_attack.FileHMACOracle(url, file_name,
+                                              pool_size=concurrency)
+        for _ in range(100):
+            try:
+                await oracle(mac)
+                break
+            except OSError:
+                await asyncio.sleep(0.05)
+
+        assert((await oracle(mac))[0])
+        assert(not (await oracle(bytes(20)))[0])
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with semaphore:
+                return(await oracle(os.urandom(20)))
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(n_requests)))
+        dt = time.perf_counter() - t0
+
+        timer = timing_attack.HTTPTimer(url + 'metrics')
+        status, body, _ = await timer.get('')
+        await oracle.close()
+        await timer.close()
+
+        return(dt, json.loads(body))
+
+    try:
+        dt, metrics = asyncio.run(client())
+    finally:
+        proc.terminate()
+        proc.join()
+
+    print('HMAC server tests passed')
+    print(f'{n_requests} requests in {dt:.2f} s: {n_requests/dt:.0f}/s '
+          f'({concurrency} in flight)')
+    print(f"Server side: mean {metrics['overhead']['mean_us']:.0f} us, "
+          f"cache {metrics['cache']}")
+    for bucket, count in metrics['overhead']['buckets'].items():
+        print(f'{bucket:>10} {count:8d}')
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('port', nargs='?', type=int, default=1234)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--delay', type=float, default=0.05,
+                        help='seconds per matching byte')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--distribution', default='none',
+                        choices=DelayModel.distributions)
+    parser.add_argument('--per-byte', action='store_true',
+                        help='draw the jitter for every matching byte')
+    parser.add_argument('--delay-param', action='store_true',
+                        help='take delay_time from the query (challenge 32)')
+    parser.add_argument('--precise', action='store_true',
+                        help='sub-millisecond delays (spins a CPU)')
+    parser.add_argument('--root', default='.')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    delay_model = DelayModel(args.delay, args.jitter, args.distribution,
+                             args.per_byte)
+    run_server(args.port, args.host, delay_model=delay_model, root=args.root,
+               delay_param=args.delay_param, precise=args.precise,
+               verbose=args.verbose)
+
+
+if __name__ == '__main__':
+
+    main(sys.argv[1:])
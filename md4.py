@@ -4,7 +4,11 @@
 # Converted to Python3 by hand.
 
 import codecs
+import os
 import struct
+import time
+
+import numpy as np
 
 def leftrotate(i, n):
     return ((i << n) & 0xffffffff) | (i >> (32 - n))
@@ -18,61 +22,358 @@ def G(x, y, z):
 def H(x, y, z):
     return x ^ y ^ z
 
+def md4_padding(length):
+    return b'\x80' + b'\x00' * ((55 - length) % 64) + struct.pack("<Q", length * 8)
+
+MD4_IV = (0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476)
+
+# (word order, shifts, constant) for each of the three rounds
+MD4_ROUNDS = (
+    (tuple(range(16)), (3, 7, 11, 19), 0),
+    ((0, 4, 8, 12, 1, 5, 9, 13, 2, 6, 10, 14, 3, 7, 11, 15), (3, 5, 9, 13), 0x5a827999),
+    ((0, 8, 4, 12, 2, 10, 6, 14, 1, 9, 5, 13, 3, 11, 7, 15), (3, 9, 11, 15), 0x6ed9eba1),
+)
+
+def md4_compress(state, blocks):
+    """
+    Runs the MD4 compression function over blocks (a multiple of 64 bytes)
+    from state, four 32-bit words, and returns the new state as a tuple.
+    The 48 steps are written out in full (generated) with no per-step
+    function calls or history; see md4_trace() for the intermediate values.
+    """
+    h0, h1, h2, h3 = state
+
+    for (x0, x1, x2, x3, x4, x5, x6, x7, x8, x9, x10, x11, x12, x13, x14,
+         x15) in struct.iter_unpack('<16I', blocks):
+        a, b, c, d = h0, h1, h2, h3
+
+        # Round 1
+        t = (a + (d ^ (b & (c ^ d))) + x0) & 0xffffffff
+        a = ((t & 0x1fffffff) << 3) | (t >> 29)
+        t = (d + (c ^ (a & (b ^ c))) + x1) & 0xffffffff
+        d = ((t & 0x1ffffff) << 7) | (t >> 25)
+        t = (c + (b ^ (d & (a ^ b))) + x2) & 0xffffffff
+        c = ((t & 0x1fffff) << 11) | (t >> 21)
+        t = (b + (a ^ (c & (d ^ a))) + x3) & 0xffffffff
+        b = ((t & 0x1fff) << 19) | (t >> 13)
+        t = (a + (d ^ (b & (c ^ d))) + x4) & 0xffffffff
+        a = ((t & 0x1fffffff) << 3) | (t >> 29)
+        t = (d + (c ^ (a & (b ^ c))) + x5) & 0xffffffff
+        d = ((t & 0x1ffffff) << 7) | (t >> 25)
+        t = (c + (b ^ (d & (a ^ b))) + x6) & 0xffffffff
+        c = ((t & 0x1fffff) << 11) | (t >> 21)
+        t = (b + (a ^ (c & (d ^ a))) + x7) & 0xffffffff
+        b = ((t & 0x1fff) << 19) | (t >> 13)
+        t = (a + (d ^ (b & (c ^ d))) + x8) & 0xffffffff
+        a = ((t & 0x1fffffff) << 3) | (t >> 29)
+        t = (d + (c ^ (a & (b ^ c))) + x9) & 0xffffffff
+        d = ((t & 0x1ffffff) << 7) | (t >> 25)
+        t = (c + (b ^ (d & (a ^ b))) + x10) & 0xffffffff
+        c = ((t & 0x1fffff) << 11) | (t >> 21)
+        t = (b + (a ^ (c & (d ^ a))) + x11) & 0xffffffff
+        b = ((t & 0x1fff) << 19) | (t >> 13)
+        t = (a + (d ^ (b & (c ^ d))) + x12) & 0xffffffff
+        a = ((t & 0x1fffffff) << 3) | (t >> 29)
+        t = (d + (c ^ (a & (b ^ c))) + x13) & 0xffffffff
+        d = ((t & 0x1ffffff) << 7) | (t >> 25)
+        t = (c + (b ^ (d & (a ^ b))) + x14) & 0xffffffff
+        c = ((t & 0x1fffff) << 11) | (t >> 21)
+        t = (b + (a ^ (c & (d ^ a))) + x15) & 0xffffffff
+        b = ((t & 0x1fff) << 19) | (t >> 13)
+
+        # Round 2
+        t = (a + ((b & c) | (d & (b | c))) + x0 + 0x5a827999) & 0xffffffff
+        a = ((t & 0x1fffffff) << 3) | (t >> 29)
+        t = (d + ((a & b) | (c & (a | b))) + x4 + 0x5a827999) & 0xffffffff
+        d = ((t & 0x7ffffff) << 5) | (t >> 27)
+        t = (c + ((d & a) | (b & (d | a))) + x8 + 0x5a827999) & 0xffffffff
+        c = ((t & 0x7fffff) << 9) | (t >> 23)
+        t = (b + ((c & d) | (a & (c | d))) + x12 + 0x5a827999) & 0xffffffff
+        b = ((t & 0x7ffff) << 13) | (t >> 19)
+        t = (a + ((b & c) | (d & (b | c))) + x1 + 0x5a827999) & 0xffffffff
+        a = ((t & 0x1fffffff) << 3) | (t >> 29)
+        t = (d + ((a & b) | (c & (a | b))) + x5 + 0x5a827999) & 0xffffffff
+        d = ((t & 0x7ffffff) << 5) | (t >> 27)
+        t = (c + ((d & a) | (b & (d | a))) + x9 + 0x5a827999) & 0xffffffff
+        c = ((t & 0x7fffff) << 9) | (t >> 23)
+        t = (b + ((c & d) | (a & (c | d))) + x13 + 0x5a827999) & 0xffffffff
+        b = ((t & 0x7ffff) << 13) | (t >> 19)
+        t = (a + ((b & c) | (d & (b | c))) + x2 + 0x5a827999) & 0xffffffff
+        a = ((t & 0x1fffffff) << 3) | (t >> 29)
+        t = (d + ((a & b) | (c & (a | b))) + x6 + 0x5a827999) & 0xffffffff
+        d = ((t & 0x7ffffff) << 5) | (t >> 27)
+        t = (c + ((d & a) | (b & (d | a))) + x10 + 0x5a827999) & 0xffffffff
+        c = ((t & 0x7fffff) << 9) | (t >> 23)
+        t = (b + ((c & d) | (a & (c | d))) + x14 + 0x5a827999) & 0xffffffff
+        b = ((t & 0x7ffff) << 13) | (t >> 19)
+        t = (a + ((b & c) | (d & (b | c))) + x3 + 0x5a827999) & 0xffffffff
+        a = ((t & 0x1fffffff) << 3) | (t >> 29)
+        t = (d + ((a & b) | (c & (a | b))) + x7 + 0x5a827999) & 0xffffffff
+        d = ((t & 0x7ffffff) << 5) | (t >> 27)
+        t = (c + ((d & a) | (b & (d | a))) + x11 + 0x5a827999) & 0xffffffff
+        c = ((t & 0x7fffff) << 9) | (t >> 23)
+        t = (b + ((c & d) | (a & (c | d))) + x15 + 0x5a827999) & 0xffffffff
+        b = ((t & 0x7ffff) << 13) | (t >> 19)
+
+        # Round 3
+        t = (a + (b ^ c ^ d) + x0 + 0x6ed9eba1) & 0xffffffff
+        a = ((t & 0x1fffffff) << 3) | (t >> 29)
+        t = (d + (a ^ b ^ c) + x8 + 0x6ed9eba1) & 0xffffffff
+        d = ((t & 0x7fffff) << 9) | (t >> 23)
+        t = (c + (d ^ a ^ b) + x4 + 0x6ed9eba1) & 0xffffffff
+        c = ((t & 0x1fffff) << 11) | (t >> 21)
+        t = (b + (c ^ d ^ a) + x12 + 0x6ed9eba1) & 0xffffffff
+        b = ((t & 0x1ffff) << 15) | (t >> 17)
+        t = (a + (b ^ c ^ d) + x2 + 0x6ed9eba1) & 0xffffffff
+        a = ((t & 0x1fffffff) << 3) | (t >> 29)
+        t = (d + (a ^ b ^ c) + x10 + 0x6ed9eba1) & 0xffffffff
+        d = ((t & 0x7fffff) << 9) | (t >> 23)
+        t = (c + (d ^ a ^ b) + x6 + 0x6ed9eba1) & 0xffffffff
+        c = ((t & 0x1fffff) << 11) | (t >> 21)
+        t = (b + (c ^ d ^ a) + x14 + 0x6ed9eba1) & 0xffffffff
+        b = ((t & 0x1ffff) << 15) | (t >> 17)
+        t = (a + (b ^ c ^ d) + x1 + 0x6ed9eba1) & 0xffffffff
+        a = ((t & 0x1fffffff) << 3) | (t >> 29)
+        t = (d + (a ^ b ^ c) + x9 + 0x6ed9eba1) & 0xffffffff
+        d = ((t & 0x7fffff) << 9) | (t >> 23)
+        t = (c + (d ^ a ^ b) + x5 + 0x6ed9eba1) & 0xffffffff
+        c = ((t & 0x1fffff) << 11) | (t >> 21)
+        t = (b + (c ^ d ^ a) + x13 + 0x6ed9eba1) & 0xffffffff
+        b = ((t & 0x1ffff) << 15) | (t >> 17)
+        t = (a + (b ^ c ^ d) + x3 + 0x6ed9eba1) & 0xffffffff
+        a = ((t & 0x1fffffff) << 3) | (t >> 29)
+        t = (d + (a ^ b ^ c) + x11 + 0x6ed9eba1) & 0xffffffff
+        d = ((t & 0x7fffff) << 9) | (t >> 23)
+        t = (c + (d ^ a ^ b) + x7 + 0x6ed9eba1) & 0xffffffff
+        c = ((t & 0x1fffff) << 11) | (t >> 21)
+        t = (b + (c ^ d ^ a) + x15 + 0x6ed9eba1) & 0xffffffff
+        b = ((t & 0x1ffff) << 15) | (t >> 17)
+
+        h0 = (h0 + a) & 0xffffffff
+        h1 = (h1 + b) & 0xffffffff
+        h2 = (h2 + c) & 0xffffffff
+        h3 = (h3 + d) & 0xffffffff
+
+    return (h0, h1, h2, h3)
+
+
+def md4_trace(M, state=MD4_IV):
+    """
+    Trace mode, for Wang's attack: runs MD4 (no padding) over the list of
+    32-bit words M and returns lists A, B, C, D of every intermediate value.
+    For each block, A[0] is the chaining input, A[1]..A[12] the value after
+    each of a's 12 steps and A[13] the chaining output (and so on for the
+    next block).
+    """
+    a, b, c, d = state
+    A, B, C, D = [a], [b], [c], [d]
+
+    for kk in range(0, len(M) - 15, 16):
+        X = M[kk:kk+16]
+        for rnd, (order, (s0, s1, s2, s3), k) in enumerate(MD4_ROUNDS):
+            for ii in range(0, 16, 4):
+                x0, x1, x2, x3 = [X[w] + k for w in order[ii:ii+4]]
+                if rnd == 0:
+                    a = leftrotate((a + (d ^ (b & (c ^ d))) + x0) & 0xffffffff, s0)
+                    d = leftrotate((d + (c ^ (a & (b ^ c))) + x1) & 0xffffffff, s1)
+                    c = leftrotate((c + (b ^ (d & (a ^ b))) + x2) & 0xffffffff, s2)
+                    b = leftrotate((b + (a ^ (c & (d ^ a))) + x3) & 0xffffffff, s3)
+                elif rnd == 1:
+                    a = leftrotate((a + ((b & c) | (d & (b | c))) + x0) & 0xffffffff, s0)
+                    d = leftrotate((d + ((a & b) | (c & (a | b))) + x1) & 0xffffffff, s1)
+                    c = leftrotate((c + ((d & a) | (b & (d | a))) + x2) & 0xffffffff, s2)
+                    b = leftrotate((b + ((c & d) | (a & (c | d))) + x3) & 0xffffffff, s3)
+                else:
+                    a = leftrotate((a + (b ^ c ^ d) + x0) & 0xffffffff, s0)
+                    d = leftrotate((d + (a ^ b ^ c) + x1) & 0xffffffff, s1)
+                    c = leftrotate((c + (d ^ a ^ b) + x2) & 0xffffffff, s2)
+                    b = leftrotate((b + (c ^ d ^ a) + x3) & 0xffffffff, s3)
+                A.append(a)
+                B.append(b)
+                C.append(c)
+                D.append(d)
+
+        a = (a + A[-13]) & 0xffffffff
+        b = (b + B[-13]) & 0xffffffff
+        c = (c + C[-13]) & 0xffffffff
+        d = (d + D[-13]) & 0xffffffff
+        A.append(a)
+        B.append(b)
+        C.append(c)
+        D.append(d)
+
+    return A, B, C, D
+
 class MD4(object):
+    """
+    Streaming MD4 with the hashlib interface (update / digest / hexdigest /
+    copy) as well as add() / finish().  finish() returns the digest and
+    resets the object.
+    """
+    name = 'md4'
+    digest_size = 16
+    block_size = 64
+    padding = staticmethod(md4_padding)
+
     def __init__(self, data=b''):
-        self.remainder = data
+        self.h = list(MD4_IV)
+        self.remainder = b''
         self.count = 0
-        self.h = [
-                0x67452301,
-                0xefcdab89,
-                0x98badcfe,
-                0x10325476
-                ]
+        if data:
+            self.update(data)
+
+    @classmethod
+    def resume(cls, digest, prior_length):
+        """
+        An MD4 that carries on from digest, the hash of prior_length bytes
+        of already padded message (for length extension).
+        """
+        if prior_length % 64:
+            raise ValueError('prior_length must be a multiple of 64')
+        md = cls()
+        md.h = list(struct.unpack("<4I", digest))
+        md.count = prior_length // 64
+        return md
 
     def _add_chunk(self, chunk):
         self.count += 1
-        X = list( struct.unpack("<16I", chunk) + (None,) * (80-16) )
-        h = [x for x in self.h]
-        # Round 1
-        s = (3, 7, 11, 19)
-        for r in range(16):
-            i = (16-r)%4
-            k = r
-            h[i] = leftrotate( (h[i] + F(h[(i+1)%4], h[(i+2)%4], h[(i+3)%4]) + X[k]) % 2**32, s[r%4] )
-        # Round 2
-        s = (3, 5, 9, 13)
-        for r in range(16):
-            i = (16-r)%4
-            k = 4*(r%4) + r//4
-            h[i] = leftrotate( (h[i] + G(h[(i+1)%4], h[(i+2)%4], h[(i+3)%4]) + X[k] + 0x5a827999) % 2**32, s[r%4] )
-        # Round 3
-        s = (3, 9, 11, 15)
-        k = (0, 8, 4, 12, 2, 10, 6, 14, 1, 9, 5, 13, 3, 11, 7, 15) #wish I could function
-        for r in range(16):
-            i = (16-r)%4
-            h[i] = leftrotate( (h[i] + H(h[(i+1)%4], h[(i+2)%4], h[(i+3)%4]) + X[k[r]] + 0x6ed9eba1) % 2**32, s[r%4] )
+        self.h = list(md4_compress(self.h, chunk))
 
-        for i, v in enumerate(h):
-            self.h[i] = (v + self.h[i]) % 2**32
+    def update(self, data):
+        data = memoryview(data).cast('B')
+        if self.remainder:
+            need = 64 - len(self.remainder)
+            self.remainder += bytes(data[:need])
+            data = data[need:]
+            if len(self.remainder) < 64:
+                return
+            self._add_chunk(self.remainder)
+            self.remainder = b''
+
+        n = len(data) - len(data) % 64
+        if n:
+            self.h = list(md4_compress(self.h, data[:n]))
+            self.count += n // 64
+        self.remainder = bytes(data[n:])
 
     def add(self, data):
-        message = self.remainder + data
-        r = len(message) % 64
-        if r != 0:
-            self.remainder = message[-r:]
-        else:
-            self.remainder = b''
-        for chunk in range(0, len(message)-r, 64):
-            self._add_chunk( message[chunk:chunk+64] )
+        self.update(data)
         return self
 
-    def finish(self):
+    @staticmethod
+    def many(messages, state=None, prior_length=0):
+        """md4_many(), for code that's handed the hash class"""
+        return md4_many(messages, state, prior_length)
+
+    def copy(self):
+        md = MD4.__new__(MD4)
+        md.h = list(self.h)
+        md.remainder = self.remainder
+        md.count = self.count
+        return md
+
+    def digest(self):
         l = len(self.remainder) + 64 * self.count
-        self.add( b'\x80' + b'\x00' * ((55 - l) % 64) + struct.pack("<Q", l * 8) )
-        out = struct.pack("<4I", *self.h)
+        h = md4_compress(self.h, self.remainder + md4_padding(l))
+        return struct.pack("<4I", *h)
+
+    def hexdigest(self):
+        return self.digest().hex()
+
+    def finish(self):
+        out = self.digest()
         self.__init__()
         return out
 
+def _rotl_np(x, n):
+    return (x << np.uint32(n)) | (x >> np.uint32(32 - n))
+
+def md4_compress_many(state, blocks):
+    """
+    MD4 compression across N lanes: state is a (4, N) uint32 array and
+    blocks an (N, n_blocks, 16) uint32 array of little-endian words.
+    """
+    h = [x.copy() for x in state]
+    for block in range(blocks.shape[1]):
+        X = np.ascontiguousarray(blocks[:, block, :].T)
+        v = list(h)
+        for rnd, (order, s, k) in enumerate(MD4_ROUNDS):
+            k = np.uint32(k)
+            for r in range(16):
+                i = (16-r)%4
+                x, y, z = v[(i+1)%4], v[(i+2)%4], v[(i+3)%4]
+                if rnd == 0:
+                    f = z ^ (x & (y ^ z))
+                elif rnd == 1:
+                    f = (x & y) | (z & (x | y))
+                else:
+                    f = x ^ y ^ z
+                v[i] = _rotl_np(v[i] + f + X[order[r]] + k, s[r%4])
+        h = [a + b for a, b in zip(h, v)]
+    return np.array(h, dtype=np.uint32)
+
+def md4_many(messages, state=None, prior_length=0):
+    """
+    MD4 of many messages of the same length at once.  messages is a list of
+    bytes or an (N, length) uint8 array; returns an (N, 16) uint8 array of
+    digests.  state and prior_length carry on from a hash state after
+    prior_length bytes (as MD4.resume).
+    """
+    if prior_length % 64:
+        raise ValueError('prior_length must be a multiple of 64')
+    if state is None:
+        state = MD4_IV
+    if isinstance(messages, np.ndarray):
+        data = np.ascontiguousarray(messages, dtype=np.uint8)
+    else:
+        lengths = set(len(m) for m in messages)
+        if len(lengths) > 1:
+            raise ValueError('md4_many needs messages of equal length')
+        length = lengths.pop() if lengths else 0
+        data = np.frombuffer(b''.join(messages), dtype=np.uint8)
+        data = data.reshape(len(messages), length)
+
+    n_lanes, length = data.shape
+    padding = md4_padding(prior_length + length)
+    padded = np.empty((n_lanes, length + len(padding)), dtype=np.uint8)
+    padded[:, :length] = data
+    padded[:, length:] = np.frombuffer(padding, dtype=np.uint8)
+
+    blocks = padded.view('<u4').astype(np.uint32).reshape(n_lanes, -1, 16)
+    state = np.repeat(np.array(state, dtype=np.uint32)[:, None], n_lanes, axis=1)
+    h = md4_compress_many(state, blocks)
+    digests = np.ascontiguousarray(h.T, dtype='<u4')
+    return digests.view(np.uint8).reshape(n_lanes, 16)
+
+def run_md4_many_benchmark(length=32, max_lanes=2**14):
+    """
+    Checks md4_many against MD4, then times the two for growing batch sizes
+    and reports where md4_many starts to win.
+    """
+    for size in [0, 1, 55, 56, 64, 100]:
+        messages = [os.urandom(size) for _ in range(5)]
+        for message, digest in zip(messages, md4_many(messages)):
+            assert digest.tobytes() == MD4(message).finish()
+
+    crossover = None
+    n_lanes = 1
+    while n_lanes <= max_lanes:
+        messages = [os.urandom(length) for _ in range(n_lanes)]
+        t0 = time.perf_counter()
+        md4_many(messages)
+        t_many = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for message in messages:
+            MD4(message).finish()
+        t_one = time.perf_counter() - t0
+        if crossover is None and t_many < t_one:
+            crossover = n_lanes
+        print(f'{n_lanes:6d} messages: md4_many {n_lanes/t_many:10.0f}/s, '
+              f'MD4 {n_lanes/t_one:8.0f}/s')
+        n_lanes *= 2
+
+    print(f'md4_many is faster from {crossover} messages of {length} bytes')
+
 if __name__=="__main__":
     test = (
             (b'', "31d6cfe0d16ae931b73c59d7e0c089c0"),
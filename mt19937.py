@@ -5,6 +5,16 @@ Created on Thu Feb 27 18:10:04 2020
 @author: willc
 """
 
+import collections
+import itertools
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
 cW = 32
 cN = 624
 cM = 397
@@ -25,6 +35,9 @@ cMASK_LOWER_32 = (1 << cW) - 1   # 2**32 - 1
 cLOWER_MASK   = (1 << cR) - 1   # 2**31 - 1
 cUPPER_MASK   = (1 << cR)       # 2**31
 
+# Outputs tempered per chunk in random_raw(), to keep the temporaries small
+cTEMPER_CHUNK = cN * 1024
+
 def mt_reverse_temper(y):
 
     # Undo:  y ^= (y >> cL)
@@ -44,22 +57,108 @@ def mt_reverse_temper(y):
 
     return(y & cD)
 
+def mt_temper(y):
+    """
+    Tempers one state word, or a whole uint32 array of them at once.
+    """
+
+    y ^= ((y >> cU) & cD)
+    y ^= ((y << cS) & cB)
+    y ^= ((y << cT) & cC)
+    y ^= (y >> cL)
+
+    return(y & cMASK_LOWER_32)
+
+def mt_seed_state(seed):
+    """
+    The initial state for seed, as a uint32 array.
+    """
+
+    state = [seed] + [0] * (cN - 1)
+    for ii in range(1, cN):
+        tmp = cF * (state[ii-1] ^ (state[ii-1] >> (cW-2))) + ii
+        state[ii] = tmp & cMASK_LOWER_32
+
+    # Only the top bit of state[0] is used again, so masking it is safe
+    state[0] &= cMASK_LOWER_32
+
+    return(np.array(state, dtype=np.uint32))
+
+def _twist_mix(x, x_next):
+
+    y = (x & cUPPER_MASK) | (x_next & cLOWER_MASK)
+
+    return((y >> 1) ^ ((y & 1) * cA))
+
+def mt_twist(src, dst=None):
+    """
+    Twists the uint32 state src into dst (in place if dst is None or src).
+    src can also be a stack of states, shape (..., 624).
+
+    Word ii needs the new word ii + cM - cN, so the twist goes in slices of
+    cN - cM words that only read words already written: 0..226 from the old
+    state, 227..453 and 454..622 from the slice before, and 623 wraps round
+    to the new word 0.
+    """
+
+    if dst is None:
+        dst = src
+    k = cN - cM
+
+    dst[..., :k] = src[..., cM:] ^ _twist_mix(src[..., :k], src[..., 1:k+1])
+    dst[..., k:2*k] = dst[..., :k] ^ \
+        _twist_mix(src[..., k:2*k], src[..., k+1:2*k+1])
+    dst[..., 2*k:cN-1] = dst[..., k:cN-1-k] ^ \
+        _twist_mix(src[..., 2*k:cN-1], src[..., 2*k+1:cN])
+    dst[..., cN-1] = dst[..., cM-1] ^ _twist_mix(src[..., cN-1], dst[..., 0])
+
+    return(dst)
+
+def mt_twist_ref(state):
+    """
+    The original one-word-at-a-time twist, on a list, kept to check
+    mt_twist() against.
+    """
+
+    for ii in range(cN):
+
+        x = (state[ii] & cUPPER_MASK) + \
+            (state[(ii+1) % cN] & cLOWER_MASK)
+
+        xA = x >> 1
+
+        if (x % 2) != 0:
+
+            xA = xA ^ cA
+
+        state[ii] = state[(ii + cM) % cN] ^ xA
+
+    return(state)
+
 class mt19937:
 
     def __init__(self, seed):
 
         # initialize the MT state
-        self.state = [0] * cN
         self.seed = seed
-
+        self.state = mt_seed_state(seed)
         self.index = cN
-        self.state[0] = seed
 
-        for ii in range(1, cN):
+    @property
+    def state(self):
+        return(self._state)
+
+    @state.setter
+    def state(self, state):
+        # Accepts any sequence of 624 words (e.g. an untempered clone)
+        self._state = np.array(state, dtype=np.uint32)
+        self._outputs = None
 
-            #tmp = (cF * self.state[ii-1]) ^ ((self.state[ii-1] >> (cW-2)) + ii)
-            tmp = cF * (self.state[ii-1] ^ (self.state[ii-1] >> (cW-2))) + ii
-            self.state[ii] = tmp & cMASK_LOWER_32
+    def _tempered(self):
+        # Tempered outputs of the current state, as Python ints
+        if self._outputs is None:
+            self._outputs = mt_temper(self._state.copy()).tolist()
+        return(self._outputs)
 
     def extract_number(self):
 
@@ -71,30 +170,593 @@ class mt19937:
 
             self.twist()
 
-        y = self.state[self.index]
-        y ^= ((y >> cU) & cD)
-        y ^= ((y << cS) & cB)
-        y ^= ((y << cT) & cC)
-        y ^= (y >> cL)
-
+        tmp = self._tempered()[self.index]
         self.index += 1
 
-        tmp = y & cMASK_LOWER_32
         return(tmp)
 
     def twist(self):
 
-        for ii in range(cN):
-
-            x = (self.state[ii] & cUPPER_MASK) + \
-                (self.state[(ii+1) % cN] & cLOWER_MASK)
-
-            xA = x >> 1
-
-            if (x % 2) != 0:
-
-                xA = xA ^ cA
-
-            self.state[ii] = self.state[(ii + cM) % cN] ^ xA
-
+        mt_twist(self._state)
+        self._outputs = None
         self.index = 0
+
+    def random_raw(self, n):
+        """
+        The next n outputs as a uint32 array -- the same numbers n calls to
+        extract_number() would give.
+        """
+
+        if self.index > cN:
+            raise(ValueError('Not seeded'))
+
+        out = np.empty(n, dtype=np.uint32)
+        n_left = min(n, cN - self.index)
+        out[:n_left] = self._state[self.index:self.index+n_left]
+        self.index += n_left
+
+        # Twist whole blocks straight into the output, each from the last
+        pos = n_left
+        src = self._state
+        while n - pos >= cN:
+            src = mt_twist(src, out[pos:pos+cN])
+            pos += cN
+        if pos < n:
+            src = mt_twist(src, np.empty(cN, dtype=np.uint32))
+            out[pos:] = src[:n-pos]
+            self.index = n - pos
+        elif src is not self._state:
+            self.index = cN
+        if src is not self._state:
+            self.state = src
+
+        for ii in range(0, n, cTEMPER_CHUNK):
+            chunk = out[ii:ii+cTEMPER_CHUNK]
+            mt_temper(chunk)
+
+        return(out)
+
+    def getstate(self):
+        """
+        A snapshot of the generator: (state array, index).
+        """
+
+        return((self._state.copy(), self.index))
+
+    def setstate(self, snapshot):
+
+        state, index = snapshot
+        self.state = state
+        self.index = index
+
+def mt_seed_states(seeds):
+    """
+    The initial states for many seeds at once, as an (n_seeds, 624) uint32
+    array -- the seeding recurrence run down all the seeds together.
+    """
+
+    seeds = np.asarray(seeds, dtype=np.uint32)
+    states = np.empty((cN, len(seeds)), dtype=np.uint32)
+    states[0] = seeds
+    for ii in range(1, cN):
+        x = states[ii-1] >> (cW-2)
+        x ^= states[ii-1]
+        x *= cF
+        x += ii
+        states[ii] = x
+
+    return(np.ascontiguousarray(states.T))
+
+def mt_first_outputs(seeds, n_outputs=1):
+    """
+    The first n_outputs (at most 227) outputs of the generator for each
+    seed, as an (n_seeds, n_outputs) uint32 array.
+
+    Those only need state words 0..n_outputs and 397 onwards from the first
+    twist, so the seeding recurrence is run just that far and only those
+    words are kept.  Chunks of ~2**16 seeds are the fastest.
+    """
+
+    if not 0 < n_outputs <= cN - cM:
+        raise(ValueError(f'n_outputs must be 1..{cN - cM}'))
+
+    x = np.array(seeds, dtype=np.uint32)
+    low = [x]
+    high = []
+    for ii in range(1, cM + n_outputs):
+        y = x >> (cW-2)
+        y ^= x
+        y *= cF
+        y += ii
+        x = y
+        if ii <= n_outputs:
+            low.append(x)
+        if ii >= cM:
+            high.append(x)
+
+    outputs = [mt_temper(high[jj] ^ _twist_mix(low[jj], low[jj+1]))
+               for jj in range(n_outputs)]
+
+    return(np.stack(outputs, axis=-1))
+
+def _seed_range(start, stop):
+
+    return(np.arange(start, stop, dtype=np.int64).astype(np.uint32))
+
+def _find_seeds_chunk(start, stop, outputs):
+    # Seeds in start..stop-1 whose first outputs are outputs
+
+    seeds = _seed_range(start, stop)
+    first = mt_first_outputs(seeds, len(outputs))
+    match = np.all(first == np.asarray(outputs, dtype=np.uint32), axis=1)
+
+    return(seeds[match].tolist())
+
+def _first_output_chunk(start, stop):
+
+    return(mt_first_outputs(_seed_range(start, stop))[:, 0])
+
+def _map_seed_chunks(func, args, start, stop, chunk_size, n_workers):
+    """
+    Yields (chunk start, func(chunk start, chunk stop, *args)) over
+    start..stop in chunks, in order.  The chunks are spread over n_workers
+    processes, with only a couple per worker in flight at once.
+    n_workers=1 runs them in this process.
+    """
+
+    chunks = ((lo, min(lo + chunk_size, stop))
+              for lo in range(start, stop, chunk_size))
+
+    if n_workers == 1:
+        for lo, hi in chunks:
+            yield(lo, func(lo, hi, *args))
+        return
+
+    with ProcessPoolExecutor(n_workers) as pool:
+        pending = collections.deque()
+        for lo, hi in chunks:
+            pending.append((lo, pool.submit(func, lo, hi, *args)))
+            if len(pending) >= 2*n_workers:
+                lo, future = pending.popleft()
+                yield(lo, future.result())
+        while pending:
+            lo, future = pending.popleft()
+            yield(lo, future.result())
+
+def find_mt_seeds(outputs, start=0, stop=2**32, n_workers=None,
+                  chunk_size=2**16):
+    """
+    Finds every seed in start..stop-1 whose generator starts with outputs
+    (one or more observed numbers).  The range is split into chunks and
+    searched on n_workers processes (default: every core); the whole 2**32
+    is fine, just slow.
+
+    Returns (seeds, stats); stats has the number of seeds tried, elapsed
+    time and seeds per second.
+    """
+
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    outputs = list(outputs)
+
+    found = []
+    t0 = time.perf_counter()
+    for lo, seeds in _map_seed_chunks(_find_seeds_chunk, (outputs,), start,
+                                      stop, chunk_size, n_workers):
+        found += seeds
+    dt = time.perf_counter() - t0
+
+    stats = {'seeds': stop - start, 'seconds': dt,
+             'seeds_per_sec': (stop - start) / dt if dt else 0.0}
+
+    return(found, stats)
+
+class MTSeedIndex:
+    """
+    An on-disk table from the first output of the generator back to its
+    seed, for one range of seeds: an .npy file of (output, seed) records
+    sorted by output, memory mapped so lookups don't load it.  8 bytes per
+    seed, so 32 GB for the full 2**32 (and as much again in a temporary
+    file next to it while it's built).
+    """
+
+    dtype = np.dtype([('output', '<u4'), ('seed', '<u4')])
+
+    def __init__(self, file_name):
+
+        self.file_name = file_name
+        self.table = np.load(file_name, mmap_mode='r')
+        self.outputs = self.table['output']
+
+    @classmethod
+    def build(cls, file_name, start=0, stop=2**24, n_workers=None,
+              chunk_size=2**16, run_size=2**25):
+        """
+        Writes the index for seeds start..stop-1 to file_name and returns
+        it, with the build stats (as for find_mt_seeds) in .stats.
+
+        An external sort, so any range fits in memory: the records, packed
+        as output << 32 | seed, are sorted in runs of run_size and written
+        to a temporary file, then merged into file_name one range of
+        values at a time.  Peak memory is about 3 * 8 * run_size bytes
+        (768 MB by default).
+        """
+
+        if n_workers is None:
+            n_workers = os.cpu_count()
+        n_seeds = stop - start
+
+        t0 = time.perf_counter()
+        table = np.lib.format.open_memmap(file_name, mode='w+',
+                                          dtype=cls.dtype,
+                                          shape=(n_seeds,))
+        with tempfile.TemporaryFile(dir=os.path.dirname(
+                os.path.abspath(file_name))) as tmp:
+            runs = np.memmap(tmp, dtype=np.uint64, mode='w+',
+                             shape=(max(n_seeds, 1),))
+            bounds = []
+            buf = np.empty(min(run_size, n_seeds), dtype=np.uint64)
+            filled = 0
+
+            def flush_run():
+                lo = bounds[-1][1] if bounds else 0
+                run = buf[:filled]
+                run.sort()
+                runs[lo:lo+filled] = run
+                bounds.append((lo, lo + filled))
+
+            for lo, first in _map_seed_chunks(_first_output_chunk, (), start,
+                                              stop, chunk_size, n_workers):
+                keys = (first.astype(np.uint64) << np.uint64(32)) | \
+                    _seed_range(lo, lo + len(first)).astype(np.uint64)
+                while len(keys):
+                    n = min(len(keys), len(buf) - filled)
+                    buf[filled:filled+n] = keys[:n]
+                    filled += n
+                    keys = keys[n:]
+                    if filled == len(buf):
+                        flush_run()
+                        filled = 0
+            if filled:
+                flush_run()
+
+            # Split the key space into ranges of ~run_size / 2 records,
+            # from a sample of every run
+            n_ranges = 2 * len(bounds)
+            samples = [runs[lo:hi:max(1, (hi - lo) // 1024)]
+                       for lo, hi in bounds]
+            sample = np.sort(np.concatenate(samples or [buf[:0]]))
+            splits = sample[(np.arange(1, n_ranges) * len(sample)) //
+                            n_ranges]
+            cuts = [[lo] + (lo + np.searchsorted(runs[lo:hi], splits)).tolist()
+                    + [hi] for lo, hi in bounds]
+            del buf
+
+            out = 0
+            for ii in range(n_ranges):
+                part = np.concatenate([runs[c[ii]:c[ii+1]] for c in cuts])
+                part.sort()
+                table['output'][out:out+len(part)] = part >> np.uint64(32)
+                table['seed'][out:out+len(part)] = part
+                out += len(part)
+            del runs
+
+        table.flush()
+        del table
+        dt = time.perf_counter() - t0
+
+        index = cls(file_name)
+        index.stats = {'seeds': stop - start, 'seconds': dt,
+                       'seeds_per_sec': (stop - start) / dt if dt else 0.0}
+
+        return(index)
+
+    def lookup(self, output):
+        """All the seeds in the index whose first output is output"""
+
+        lo = np.searchsorted(self.outputs, output, side='left')
+        hi = np.searchsorted(self.outputs, output, side='right')
+
+        return(self.table['seed'][lo:hi].tolist())
+
+class MTCloner:
+    """
+    Clones an MT19937 from a stream of its outputs.
+
+    Any 624 consecutive outputs will do, aligned to a twist or not: the
+    twist is the same recurrence all the way along the output stream, so
+    the untempered window is a state that carries on from there.  Until
+    then outputs are untempered in batches into the window.  After that
+    every output is checked against the clone's prediction, a batch at a
+    time, so each word costs O(1).
+
+    A wrong prediction is taken to be a gap (outputs we didn't see): the
+    clone looks up to max_gap outputs ahead for the observed one and jumps
+    there.  If it isn't there either the stream has moved on (e.g. been
+    reseeded), so the window starts again from that output.  None in the
+    stream marks a known missed output.
+
+    stats counts the outputs observed, syncs, gaps, outputs skipped over
+    gaps and mispredictions that forced a resync.
+    """
+
+    def __init__(self, max_gap=cN, batch_size=cN):
+
+        self.max_gap = max_gap
+        self.batch_size = batch_size
+        self.window = []
+        self.clone = None
+        self.stats = {'observed': 0, 'syncs': 0, 'gaps': 0, 'skipped': 0,
+                      'resyncs': 0}
+
+    @property
+    def synced(self):
+        return(self.clone is not None)
+
+    def _fill(self, outputs):
+        # Untempers outputs into the window; the rest once it's full
+
+        n = min(len(outputs), cN - len(self.window))
+        words = mt_reverse_temper(np.array(outputs[:n], dtype=np.uint32))
+        self.window += words.tolist()
+        if len(self.window) == cN:
+            self.clone = mt19937(0)
+            self.clone.setstate((self.window, cN))
+            self.window = []
+            self.stats['syncs'] += 1
+
+        return(outputs[n:])
+
+    def _find_gap(self, observed):
+        # How many outputs were missed before observed, or None
+
+        snapshot = self.clone.getstate()
+        ahead = self.clone.random_raw(self.max_gap + 1)
+        self.clone.setstate(snapshot)
+        hits = np.flatnonzero(ahead == observed)
+
+        return(int(hits[0]) if len(hits) else None)
+
+    def _check(self, outputs):
+        # Checks outputs against the clone; returns any left after losing sync
+
+        while outputs:
+            snapshot = self.clone.getstate()
+            predicted = self.clone.random_raw(len(outputs))
+            wrong = np.flatnonzero(predicted != np.array(outputs,
+                                                         dtype=np.uint32))
+            if len(wrong) == 0:
+                return([])
+
+            jj = int(wrong[0])
+            self.clone.setstate(snapshot)
+            self.clone.random_raw(jj)
+            gap = self._find_gap(outputs[jj])
+            if gap is None:
+                self.clone = None
+                self.stats['resyncs'] += 1
+                return(outputs[jj:])
+
+            self.clone.random_raw(gap + 1)
+            self.stats['gaps'] += 1
+            self.stats['skipped'] += gap
+            outputs = outputs[jj+1:]
+
+        return([])
+
+    def feed(self, outputs):
+        """
+        Takes in a list of observed outputs (None for a missed one).  Returns
+        True if the clone (re)synced along the way.
+        """
+
+        self.stats['observed'] += len(outputs)
+        syncs = self.stats['syncs']
+
+        start = 0
+        while start <= len(outputs):
+            try:
+                end = outputs.index(None, start)
+            except ValueError:
+                end = len(outputs)
+
+            run = list(outputs[start:end])
+            while run:
+                run = self._check(run) if self.synced else self._fill(run)
+
+            if end < len(outputs):
+                if self.synced:
+                    self.clone.random_raw(1)
+                else:
+                    self.window = []
+            start = end + 1
+
+        return(self.stats['syncs'] > syncs)
+
+    def clones(self, outputs):
+        """
+        Reads outputs from any iterable (a socket, a file, another
+        generator) and yields a copy of the clone -- positioned just after
+        the last output read -- every time it (re)syncs.  While unsynced it
+        reads only as many as the window still needs, so the first clone
+        comes out straight after the 624th output.
+        """
+
+        outputs = iter(outputs)
+        while True:
+            n = self.batch_size if self.synced else cN - len(self.window)
+            batch = list(itertools.islice(outputs, n))
+            if not batch:
+                return
+            if self.feed(batch) and self.synced:
+                clone = mt19937(0)
+                clone.setstate(self.clone.getstate())
+                yield(clone)
+
+def run_mt19937_tests(n_outputs=10**8):
+    """
+    Checks the vectorised twist and random_raw() against the original loop
+    and Python's own MT19937 (the random module), then times random_raw().
+    """
+
+    for seed in [0, 1, 5489, 2**32 - 1, 123456789]:
+
+        ref = mt_seed_state(seed).tolist()
+        state = mt_seed_state(seed)
+        for ii in range(3):
+            assert(mt_twist(state).tolist() == mt_twist_ref(ref))
+
+        py_rng = random.Random()
+        py_rng.setstate((3, tuple(mt_seed_state(seed).tolist()) + (cN,), None))
+        expected = [py_rng.getrandbits(32) for _ in range(4000)]
+
+        rng = mt19937(seed)
+        assert([rng.extract_number() for _ in range(4000)] == expected)
+
+        # Any mix of single and bulk calls gives the same stream
+        rng = mt19937(seed)
+        got = []
+        for n in [1, 0, 623, 624, 5, 1250, 497]:
+            got += rng.random_raw(n).tolist()
+            got.append(rng.extract_number())
+        assert(got == expected[:len(got)])
+
+        snapshot = rng.getstate()
+        after = [rng.extract_number() for _ in range(1000)]
+        rng.setstate(snapshot)
+        assert(rng.random_raw(1000).tolist() == after)
+
+    # Cloning as in challenge 23: untemper 624 outputs, assign the state
+    rng = mt19937(42)
+    outputs = rng.random_raw(cN).tolist()
+    clone = mt19937(0)
+    clone.state = [mt_reverse_temper(y) for y in outputs]
+    assert(clone.random_raw(2000).tolist() == rng.random_raw(2000).tolist())
+
+    print('mt19937 tests passed')
+
+    rng = mt19937(5489)
+    t0 = time.perf_counter()
+    for _ in range(10**5):
+        rng.extract_number()
+    dt_one = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    rng.random_raw(n_outputs)
+    dt_raw = time.perf_counter() - t0
+
+    print(f'extract_number: {10**5/dt_one:12.0f}/s')
+    print(f'random_raw:     {n_outputs/dt_raw:12.0f}/s ({n_outputs} outputs in {dt_raw:.2f} s)')
+
+def run_mt_seed_tests(n_seeds=2**24, n_workers=None):
+    """
+    Checks the vectorised seeding against mt19937(), recovers a time seed
+    and a 16 bit seed (challenges 22 and 24), and reports seeds/sec for
+    find_mt_seeds and MTSeedIndex.build over n_seeds seeds.
+    """
+
+    seeds = [0, 1, 5489, 2**31, 2**32 - 1] + \
+        [random.getrandbits(32) for _ in range(20)]
+    states = mt_seed_states(seeds)
+    first = mt_first_outputs(seeds, 5)
+    for seed, state, outs in zip(seeds, states, first):
+        rng = mt19937(seed)
+        assert(state.tolist() == rng.state.tolist())
+        assert(outs.tolist() == rng.random_raw(5).tolist())
+    twisted = mt_twist(states.copy())
+    assert(mt_temper(twisted[:, :5]).tolist() == first.tolist())
+
+    now = int(time.time())
+    seed = now - random.randint(40, 1000)
+    out = mt19937(seed).extract_number()
+    found, _ = find_mt_seeds([out], now - 2000, now, n_workers=1)
+    assert(seed in found)
+
+    seed = random.randint(0, 2**16 - 1)
+    found, _ = find_mt_seeds(mt19937(seed).random_raw(2), 0, 2**16,
+                             n_workers=1)
+    assert(found == [seed])
+
+    print('mt19937 seed recovery tests passed')
+
+    for workers in sorted({1, n_workers or os.cpu_count()}):
+        seed = random.randint(0, n_seeds - 1)
+        found, stats = find_mt_seeds([mt19937(seed).extract_number()], 0,
+                                     n_seeds, n_workers=workers)
+        assert(seed in found)
+        print(f"find_mt_seeds, {workers} workers: "
+              f"{stats['seeds_per_sec']:10.0f} seeds/s "
+              f"(full 2**32 in ~{2**32 / stats['seeds_per_sec']:.0f} s)")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index = MTSeedIndex.build(os.path.join(tmp_dir, 'mt_seeds.npy'), 0,
+                                  n_seeds, n_workers)
+        seed = random.randint(0, n_seeds - 1)
+        assert(seed in index.lookup(mt19937(seed).extract_number()))
+        print(f"MTSeedIndex.build: {index.stats['seeds_per_sec']:10.0f} "
+              f"seeds/s")
+
+        # Many small runs must merge to the same table as one big one
+        small = MTSeedIndex.build(os.path.join(tmp_dir, 'small_runs.npy'),
+                                  1000, 1000 + 2**18, 1, run_size=10**4)
+        one = MTSeedIndex.build(os.path.join(tmp_dir, 'one_run.npy'),
+                                1000, 1000 + 2**18, 1)
+        assert(np.array_equal(small.table, one.table))
+        assert(np.all(np.diff(one.outputs.astype(np.int64)) >= 0))
+        assert(sorted(one.table['seed'].tolist()) ==
+               list(range(1000, 1000 + 2**18)))
+        del index, small, one
+
+def run_mt_cloner_tests(n_outputs=10**6):
+    """
+    Clones a stream joined part way through, with dropped and missing
+    outputs and a reseed half way, then times MTCloner per output word.
+    """
+
+    def stream():
+        rng = mt19937(random.getrandbits(32))
+        rng.random_raw(1000)                # not aligned to a twist
+        for ii in range(5000):
+            y = rng.extract_number()
+            if ii in (2000, 2500, 2501, 3000):
+                continue                    # dropped without a trace
+            yield(None if ii in (1500, 4000) else y)
+        rng.setstate(mt19937(random.getrandbits(32)).getstate())
+        for ii in range(2000):
+            yield(rng.extract_number())
+        yield(rng)
+
+    items = list(stream())
+    source = items.pop()
+    cloner = MTCloner()
+    clones = list(cloner.clones(items))
+    assert(len(clones) == 2)
+    assert(cloner.stats['gaps'] == 3 and cloner.stats['skipped'] == 4)
+    assert(cloner.stats['resyncs'] == 1)
+    assert(clones[-1].random_raw(2000 - cN).tolist() == items[cN-2000:])
+    assert(cloner.clone.random_raw(5000).tolist() ==
+           source.random_raw(5000).tolist())
+
+    # The first clone comes out as soon as it has 624 outputs
+    rng = mt19937(7)
+    rng.random_raw(100)
+    observed = rng.random_raw(cN).tolist()
+    clone = next(MTCloner().clones(observed + [None] * 5))
+    assert(clone.random_raw(10).tolist() == rng.random_raw(10).tolist())
+
+    print('MTCloner tests passed')
+
+    rng = mt19937(5489)
+    outputs = rng.random_raw(n_outputs).tolist()
+    cloner = MTCloner(batch_size=4096)
+    t0 = time.perf_counter()
+    for _ in cloner.clones(outputs):
+        pass
+    dt = time.perf_counter() - t0
+    print(f'MTCloner: {n_outputs/dt:10.0f} outputs/s')
+
+if __name__ == '__main__':
+
+    run_mt19937_tests()
+    run_mt_seed_tests()
+    run_mt_cloner_tests()
@@ -1,5 +1,10 @@
 # import hashlib
 #import cryptopals as cp
+import random
+import struct
+import time
+
+import md4
 
 MGK_1 = 0x5a827999
 MGK_2 = 0x6ed9eba1
@@ -124,10 +129,11 @@ def apply_corrections(var1, var2, corrections):
 
 def MD4_get_words(data, endianness='little'):
     
-    M = []
-    for ii in range(0, len(data), 4):
-        word = int.from_bytes(data[ii:ii+4], byteorder=endianness, signed=False)
-        M.append(word)
+    n = len(data) // 4
+    order = '<' if endianness == 'little' else '>'
+    M = list(struct.unpack(f'{order}{n}I', data[:4*n]))
+    if len(data) % 4:
+        M.append(int.from_bytes(data[4*n:], byteorder=endianness, signed=False))
         
     return(M)
 
@@ -192,134 +198,25 @@ def ABCD_to_M(A,B,C,D):
     return(M)
 
 def MD4_get_IVs(M):
-
-    
-    # Step 4:  Process Message in blocks of 16 32-bit words (512 bits ea)
-    
-    # Run the compression algorithm.  Loop for each block of 512 bits until
-    # full message is consumed.
-    
-    W = [ [0,  1,  2,  3,  4,  5,  6,  7,  8,  9, 10, 11, 12, 13, 14, 15], 
-          [0,  4,  8, 12,  1,  5,  9, 13,  2,  6, 10, 14,  3,  7, 11, 15],
-          [0,  8,  4, 12,  2, 10,  6, 14,  1,  9,  5, 13,  3, 11,  7, 15] ]   
-    
-    S = [ [3, 7, 11, 19],
-          [3, 5,  9, 13],
-          [3, 9, 11, 15]]    
-
-    A, B, C, D = [0x67452301], [0xefcdab89], [0x98badcfe], [0x10325476]
+    """
+    Returns the A, B, C, D histories for the message words M -- the trace
+    mode of the MD4 engine in md4.py.
+    """
+    return(md4.md4_trace(M))
     
-    N = len(M)//16
-
-    for kk in range(N):
-        
-        AA, BB, CC, DD = A[-1], B[-1], C[-1], D[-1]
-        X = M[16*kk:16*(kk+1)]
-        
-        for jj in range(3):        
-            for ii in range(4):
-                A.append(phi(jj, A[-1], B[-1], C[-1], D[-1], X[W[jj][4*ii+0]], S[jj][0]))
-                D.append(phi(jj, D[-1], A[-1], B[-1], C[-1], X[W[jj][4*ii+1]], S[jj][1]))
-                C.append(phi(jj, C[-1], D[-1], A[-1], B[-1], X[W[jj][4*ii+2]], S[jj][2]))
-                B.append(phi(jj, B[-1], C[-1], D[-1], A[-1], X[W[jj][4*ii+3]], S[jj][3]))
-     
-        A.append((A[-1] + AA) % 2**32)
-        B.append((B[-1] + BB) % 2**32)
-        C.append((C[-1] + CC) % 2**32)
-        D.append((D[-1] + DD) % 2**32)
-
-    return(A, B, C, D)
-
-def MD4_get_IVs_UR(M):
-    
-    N = len(M) // 16
-    L = 13*N+1
-    A,B,C,D = [0]*L, [0]*L, [0]*L, [0]*L
-    MGK_1, MKG_2 = 0x5a827999, 0x6ed9eba1
-
-    A[0] = 0x67452301 
-    D[0] = 0x10325476
-    C[0] = 0x98badcfe
-    B[0] = 0xefcdab89
-    
-    # Round 0, j=0, i = [0:3]
-    A[1] = lrot_32( (A[0] + F(B[0], C[0], D[0]) + M[0]) % 2**32, 3)
-    D[1] = lrot_32( (D[0] + F(A[1], B[0], C[0]) + M[1]) % 2**32, 7)
-    C[1] = lrot_32( (C[0] + F(D[1], A[1], B[0]) + M[2]) % 2**32, 11)
-    B[1] = lrot_32( (B[0] + F(C[1], D[1], A[1]) + M[3]) % 2**32, 19)
-    
-    A[2] = lrot_32( (A[1] + F(B[1], C[1], D[1]) + M[4]) % 2**32, 3)
-    D[2] = lrot_32( (D[1] + F(A[2], B[1], C[1]) + M[5]) % 2**32, 7)
-    C[2] = lrot_32( (C[1] + F(D[2], A[2], B[1]) + M[6]) % 2**32, 11)
-    B[2] = lrot_32( (B[1] + F(C[2], D[2], A[2]) + M[7]) % 2**32, 19) 
-    
-    A[3] = lrot_32( (A[2] + F(B[2], C[2], D[2]) + M[8]) % 2**32, 3)
-    D[3] = lrot_32( (D[2] + F(A[3], B[2], C[2]) + M[9]) % 2**32, 7)
-    C[3] = lrot_32( (C[2] + F(D[3], A[3], B[2]) + M[10]) % 2**32, 11)
-    B[3] = lrot_32( (B[2] + F(C[3], D[3], A[3]) + M[11]) % 2**32, 19)
-    
-    A[4] = lrot_32( (A[3] + F(B[3], C[3], D[3]) + M[12]) % 2**32, 3)
-    D[4] = lrot_32( (D[3] + F(A[4], B[3], C[3]) + M[13]) % 2**32, 7)
-    C[4] = lrot_32( (C[3] + F(D[4], A[4], B[3]) + M[14]) % 2**32, 11)
-    B[4] = lrot_32( (B[3] + F(C[4], D[4], A[4]) + M[15]) % 2**32, 19)    
-    
-    # j = 1
-    # phi = lrot_32(((a + G(b, c, d) + w + MGK_1) % 2**32), s)  
-    A[5] = lrot_32( (A[4] + G(B[4], C[4], D[4]) + M[0] + MGK_1) % 2**32, 3)
-    D[5] = lrot_32( (D[4] + G(A[5], B[4], C[4]) + M[4] + MGK_1) % 2**32, 5)
-    C[5] = lrot_32( (C[4] + G(D[5], A[5], B[4]) + M[8] + MGK_1) % 2**32, 9)
-    B[5] = lrot_32( (B[4] + G(C[5], D[5], A[5]) + M[12] + MGK_1) % 2**32, 13)
-   
-    A[6] = lrot_32( (A[5] + G(B[5], C[5], D[5]) + M[1] + MGK_1) % 2**32, 3)
-    D[6] = lrot_32( (D[5] + G(A[6], B[5], C[5]) + M[5] + MGK_1) % 2**32, 5)
-    C[6] = lrot_32( (C[5] + G(D[6], A[6], B[5]) + M[9] + MGK_1) % 2**32, 9)
-    B[6] = lrot_32( (B[5] + G(C[6], D[6], A[6]) + M[13] + MGK_1) % 2**32, 13) 
-    
-    A[7] = lrot_32( (A[6] + G(B[6], C[6], D[6]) + M[2] + MGK_1) % 2**32, 3)
-    D[7] = lrot_32( (D[6] + G(A[7], B[6], C[6]) + M[6] + MGK_1) % 2**32, 5)
-    C[7] = lrot_32( (C[6] + G(D[7], A[7], B[6]) + M[10] + MGK_1) % 2**32, 9)
-    B[7] = lrot_32( (B[6] + G(C[7], D[7], A[7]) + M[14] + MGK_1) % 2**32, 13)
-    
-    A[8] = lrot_32( (A[7] + G(B[7], C[7], D[7]) + M[3] + MGK_1) % 2**32, 3)
-    D[8] = lrot_32( (D[7] + G(A[8], B[7], C[7]) + M[7] + MGK_1) % 2**32, 5)
-    C[8] = lrot_32( (C[7] + G(D[8], A[8], B[7]) + M[11] + MGK_1) % 2**32, 9)
-    B[8] = lrot_32( (B[7] + G(C[8], D[8], A[8]) + M[15] + MGK_1) % 2**32, 13)      
-    
-    # j = 2
-    # phi = lrot_32(((a + H(b, c, d) + w + MGK_2) % 2**32), s)  
-    A[9] = lrot_32( (A[8] + H(B[8], C[8], D[8]) + M[0] + MGK_2) % 2**32, 3)
-    D[9] = lrot_32( (D[8] + H(A[9], B[8], C[8]) + M[8] + MGK_2) % 2**32, 9)
-    C[9] = lrot_32( (C[8] + H(D[9], A[9], B[8]) + M[4] + MGK_2) % 2**32, 11)
-    B[9] = lrot_32( (B[8] + H(C[9], D[9], A[9]) + M[12] + MGK_2) % 2**32, 15)
-   
-    A[10] = lrot_32( (A[9] + H(B[9], C[9], D[9]) + M[2] + MGK_1) % 2**32, 3)
-    D[10] = lrot_32( (D[9] + H(A[10], B[9], C[9]) + M[10] + MGK_1) % 2**32, 9)
-    C[10] = lrot_32( (C[9] + H(D[10], A[10], B[9]) + M[6] + MGK_1) % 2**32, 11)
-    B[10] = lrot_32( (B[9] + H(C[10], D[10], A[10]) + M[14] + MGK_1) % 2**32, 15) 
-    
-    A[11] = lrot_32( (A[10] + H(B[10], C[10], D[10]) + M[1] + MGK_1) % 2**32, 3)
-    D[11] = lrot_32( (D[10] + H(A[11], B[10], C[10]) + M[9] + MGK_1) % 2**32, 9)
-    C[11] = lrot_32( (C[10] + H(D[11], A[11], B[10]) + M[5] + MGK_1) % 2**32, 11)
-    B[11] = lrot_32( (B[10] + H(C[11], D[11], A[11]) + M[13] + MGK_1) % 2**32, 15)
-    
-    A[12] = lrot_32( (A[11] + H(B[11], C[11], D[11]) + M[3] + MGK_1) % 2**32, 3)
-    D[12] = lrot_32( (D[11] + H(A[12], B[11], C[11]) + M[11] + MGK_1) % 2**32, 9)
-    C[12] = lrot_32( (C[11] + H(D[12], A[12], B[11]) + M[7] + MGK_1) % 2**32, 11)
-    B[12] = lrot_32( (B[11] + H(C[12], D[12], A[12]) + M[15] + MGK_1) % 2**32, 15) 
-    
-    A[13] = (A[12] + A[0]) % 2**32
-    D[13] = (D[12] + D[0]) % 2**32
-    C[13] = (C[12] + C[0]) % 2**32
-    B[13] = (B[12] + B[0]) % 2**32
-    
-def MD4(data, do_padding = True, endianness = 'little'):
+def MD4(data, do_padding = True, endianness = 'little', trace = False):
     
     """ 
-    Modified my MD4 implementation to better track with the notation used
-    in Wang's paper -- and to keep intermediate results for all loop iterations
-    within a round.  Could also modify to retain intermediates across rounds if
-    needed.
+    MD4 of data, with the word order / no-padding options used to match the
+    examples in Wang's paper.  Hashing runs on the unrolled engine in md4.py;
+    with trace=True it returns (digest, (A, B, C, D)) instead, the
+    intermediate values from MD4_get_IVs.
     """
+    if do_padding and endianness == 'little' and not trace:
+        if isinstance(data, str):
+            data = data.encode()
+        return(md4.MD4(data).finish())
+    
     if do_padding:
         M = MD4_get_words(MD4_pad_data(data), endianness)
     else:
@@ -327,16 +224,352 @@ def MD4(data, do_padding = True, endianness = 'little'):
             data += b'\x00'*(64-len(data))
         M = MD4_get_words(data, endianness)
         
-    A, B, C, D = MD4_get_IVs(M)           
-    #pdb.set_trace()
-    digest = A[-1].to_bytes(4, endianness) + \
-             B[-1].to_bytes(4, endianness) + \
-             C[-1].to_bytes(4, endianness) + \
-             D[-1].to_bytes(4, endianness)
-   
+    M = M[:len(M) - len(M) % 16]
+    if trace:
+        A, B, C, D = MD4_get_IVs(M)
+        h = (A[-1], B[-1], C[-1], D[-1])
+    else:
+        h = md4.md4_compress(md4.MD4_IV, struct.pack(f'<{len(M)}I', *M))
+
+    digest = b''.join(x.to_bytes(4, endianness) for x in h)
+    
+    if trace:
+        return(digest, (A, B, C, D))
     return(digest)
 
 
+def compile_Wang_Rules(rules=Wang_Rules):
+    """
+    Turns each row of Wang_Rules into three bit masks: the bits that must be
+    0 or 1 (fixed), the value those bits must have (ones) and the bits that
+    must equal the previous step's value (eq).
+    """
+    masks = []
+    for row in rules:
+        fixed = sum(1 << n for n, r in enumerate(row) if r in '01')
+        ones = sum(1 << n for n, r in enumerate(row) if r == '1')
+        eq = sum(1 << n for n, r in enumerate(row) if r == '=')
+        masks.append((fixed, ones, eq))
+    return(masks)
+
+Wang_Masks = compile_Wang_Rules()
+
+# Table 1 corrections for a5 (equal bits are against c4) and d5
+Wang_A5_Masks = compile_Wang_Rules(['..................=......10.1..1'])[0]
+Wang_D5_Masks_a5 = compile_Wang_Rules(['..................=.............'])[0]
+Wang_D5_Masks_b4 = compile_Wang_Rules(['.........................==.=..='])[0]
+
+def apply_masks(x, prev, masks):
+    """Forces step value x to meet one step's conditions"""
+    fixed, ones, eq = masks
+    return((x & ~(fixed | eq)) | ones | (prev & eq))
+
+def meets_masks(x, prev, masks):
+    fixed, ones, eq = masks
+    return(((x ^ ones) & fixed) | ((x ^ prev) & eq) == 0)
+
+STEP_F = (
+    lambda x, y, z: z ^ (x & (y ^ z)),
+    lambda x, y, z: (x & y) | (z & (x | y)),
+    lambda x, y, z: x ^ y ^ z)
+
+STEP_K = (0, MGK_1, MGK_2)
+
+class WangTrace:
+    """
+    Incremental MD4 trace of one 16-word block M, for Wang's modifications.
+    
+    Step values are kept in Wang's order, Q = [a0, d0, c0, b0, a1, d1, c1,
+    b1, a2, ...], so step i (0-47) is Q[i+4] and depends on Q[i], Q[i+1],
+    Q[i+2], Q[i+3] and one message word.  Steps are computed lazily, and
+    changing a word only throws away the steps from its first use onwards.
+    """
+    
+    def __init__(self, M, IV=md4.MD4_IV):
+        a, b, c, d = IV
+        self.M = [x % 2**32 for x in M[:16]]
+        self.Q = [a, d, c, b] + [0]*48
+        self.valid = 0      # Steps 0..valid-1 are up to date
+    
+    def _compute(self, upto):
+        Q, M = self.Q, self.M
+        for i in range(self.valid, upto):
+            b, c, d = Q[i+3], Q[i+2], Q[i+1]
+            if i < 16:
+                x = Q[i] + (d ^ (b & (c ^ d))) + M[i]
+                s = S[0][i % 4]
+            elif i < 32:
+                x = Q[i] + ((b & c) | (d & (b | c))) + M[W[1][i - 16]] + MGK_1
+                s = S[1][i % 4]
+            else:
+                x = Q[i] + (b ^ c ^ d) + M[W[2][i - 32]] + MGK_2
+                s = S[2][i % 4]
+            x &= 0xffffffff
+            Q[i+4] = ((x << s) & 0xffffffff) | (x >> (32 - s))
+        self.valid = max(self.valid, upto)
+    
+    def step(self, i):
+        """Value after step i"""
+        if i >= self.valid:
+            self._compute(i + 1)
+        return(self.Q[i+4])
+    
+    def ABCD(self):
+        """A, B, C, D histories, indexed as in MD4_get_IVs (without the final add)"""
+        self._compute(48)
+        Q = self.Q
+        return(Q[0::4], Q[3::4], Q[2::4], Q[1::4])
+    
+    def word_for(self, i, value):
+        """The message word that makes step i come out as value"""
+        if i > self.valid:
+            self._compute(i)
+        Q = self.Q
+        j = i // 16
+        return((rrot_32(value, S[j][i % 4]) - Q[i] - STEP_F[j](Q[i+3], Q[i+2], Q[i+1]) - STEP_K[j]) % 2**32)
+    
+    def set_word(self, k, value):
+        self.M[k] = value % 2**32
+        self.valid = min(self.valid, k)
+    
+    def set_step(self, i, value):
+        """
+        Sets round 1 step i to value by changing word i (steps after i will
+        be recomputed from the new value).
+        """
+        self.M[i] = self.word_for(i, value)
+        self.Q[i+4] = value
+        self.valid = i + 1
+        
+    def first_failure(self, masks=Wang_Masks):
+        """
+        Returns the first step whose conditions (from compiled Wang_Rules)
+        don't hold, or None if they all do.
+        """
+        Q = self.Q
+        for i, step_masks in enumerate(masks):
+            if i >= self.valid:
+                self._compute(i + 1)
+            if not meets_masks(Q[i+4], Q[i+3], step_masks):
+                return(i)
+        return(None)
+    
+    def flip(self, i, bit):
+        """
+        Flips one bit of round 1 step i (i < 12) and changes the next four
+        words so the next four steps keep their values.  Beyond those only
+        round 2 and 3 steps see the change.
+        """
+        pinned = [self.step(j) for j in range(i+1, i+5)]
+        self.set_step(i, self.Q[i+4] ^ (1 << bit))
+        for j, value in enumerate(pinned, i+1):
+            self.set_step(j, value)
+        
+    def data(self, endianness='little'):
+        return(MD4_get_data(list(self.M), endianness))
+
+# Round 2 and 3 conditions (Table 6 of Wang's paper), by step number in
+# WangTrace order (16 = a5, 17 = d5, ..., 35 = b9, 36 = a10).  Same layout
+# as Wang_Rules, plus '!' for "differs from the previous step" and '<' for
+# "equals the step before that".
+#
+#                   Bit #'ing
+#                   00000000001111111111222222222233
+#                   01234567890123456789012345678901
+Wang_Rules_2 = {16: '..................<......10.1..1',     # a5
+                17: '..................=......<<.<..<',     # d5
+                18: '.........................==.==.=',     # c5
+                19: '............................=1.0',     # b5
+                20: '............................1..1',     # a6
+                21: '............................<...',     # d6
+                22: '............................=!.!',     # c6
+                35: '...............................1',     # b9
+                36: '...............................1'}    # a10
+
+def compile_Wang_Rules_2(rules=Wang_Rules_2):
+    """
+    Compiles Wang_Rules_2 into (step, fixed, ones, eq, ne, eq2) masks, in
+    step order.
+    """
+    masks = []
+    for step in sorted(rules):
+        row = rules[step]
+        bits = lambda chars: sum(1 << n for n, r in enumerate(row) if r in chars)
+        masks.append((step, bits('01'), bits('1'), bits('='), bits('!'), bits('<')))
+    return(masks)
+
+Wang_Masks_2 = compile_Wang_Rules_2()
+Wang_Masks_2_by_step = {m[0]: m for m in Wang_Masks_2}
+
+def Wang_free_bits(step):
+    """
+    Bits of round 1 step that no condition looks at -- in its own row or
+    as the previous value in the next row -- so they're free to flip.
+    """
+    fixed, ones, eq = Wang_Masks[step]
+    busy = fixed | eq
+    if step + 1 < len(Wang_Masks):
+        busy |= Wang_Masks[step+1][2]
+    return(~busy & 0xffffffff)
+
+Wang_Free = [Wang_free_bits(step) for step in range(16)]
+
+def Wang_failed_bits(T, masks):
+    """Bits of a round 2 / 3 step that break its conditions"""
+    step, fixed, ones, eq, ne, eq2 = masks
+    x = T.step(step)
+    Q = T.Q
+    return(((x ^ ones) & fixed) | ((x ^ Q[step+3]) & eq) | ((x ^ Q[step+3] ^ ne) & ne) |
+           ((x ^ Q[step+2]) & eq2))
+
+def Wang_fix_step(T, step, protected, passes=4):
+    """
+    Multi-message modification for one round 2 step.  The step's message
+    word m is produced by round 1 step m, so a bad bit i can be moved by
+    
+      - flipping bit (i - s2 + s1) of round 1 step m, which moves m by 
+        2**(i - s2) once rotated (s1, s2 = the two shifts), or
+      - flipping bit (i - s2) of whichever of the two steps before it that 
+        F() currently selects, which moves m by 2**(i - s2) directly,
+    
+    and then pinning the next four round 1 steps (see WangTrace.flip).
+    Only free bits are flipped, and a route is skipped if it would change a
+    word in protected (the words of round 2 steps already fixed).  Carries
+    can spill into the next bit, so this makes a few passes.
+    """
+    masks = Wang_Masks_2_by_step[step]
+    word = W[1][step - 16]
+    s1, s2 = S[0][word % 4], S[1][step % 4]
+    
+    for _ in range(passes):
+        bad = Wang_failed_bits(T, masks)
+        if bad == 0:
+            return(True)
+        for i in range(32):
+            if not (bad >> i) & 1:
+                continue
+            routes = [(word, (i - s2 + s1) % 32)]
+            if word >= 3:
+                k = (i - s2) % 32
+                routes.append((word - 2 if (T.step(word - 1) >> k) & 1 else word - 3, k))
+            for flip_step, k in routes:
+                touched = range(flip_step, flip_step + 5)
+                if flip_step + 4 < 16 and (Wang_Free[flip_step] >> k) & 1 and \
+                   not any(w in protected for w in touched):
+                    T.flip(flip_step, k)
+                    break
+    
+    return(Wang_failed_bits(T, masks) == 0)
+
+# Round 2 steps corrected by Wang_fix_round2 (a5, d5, c5, b5).  The rest are
+# left to chance -- moving them would undo these.
+Wang_Fixed_Steps = [16, 17, 18, 19]
+
+def Wang_fix_round2(T):
+    """
+    Applies the round 1 single step modifications and then the round 2
+    corrections to a WangTrace.
+    """
+    for i in range(16):
+        T.set_step(i, apply_masks(T.step(i), T.Q[i+3], Wang_Masks[i]))
+    
+    protected = set()
+    for step in Wang_Fixed_Steps:
+        Wang_fix_step(T, step, protected)
+        protected.add(W[1][step - 16])
+    
+    return(T)
+
+class WangStats:
+    """
+    Per-stage counts and times for the collision search: how many candidates
+    reached and passed each stage, the pass rate, and candidates/sec.
+    """
+    
+    def __init__(self):
+        self.stages = ['modify'] + [f'step {m[0]}' for m in Wang_Masks_2] + ['collision']
+        self.reached = dict.fromkeys(self.stages, 0)
+        self.passed = dict.fromkeys(self.stages, 0)
+        self.seconds = dict.fromkeys(self.stages, 0.0)
+        
+    def report(self):
+        
+        names = dict(zip([16, 17, 18, 19, 20, 21, 22, 35, 36], 
+                         ['a5', 'd5', 'c5', 'b5', 'a6', 'd6', 'c6', 'b9', 'a10']))
+        print(f"{'stage':>12} {'reached':>10} {'passed':>10} {'p':>8} {'per sec':>10}")
+        for stage in self.stages:
+            reached, passed = self.reached[stage], self.passed[stage]
+            label = stage
+            if stage.startswith('step'):
+                label = f"{names.get(int(stage[5:]), '')} ({stage})"
+            p = passed / reached if reached else 0.0
+            rate = reached / self.seconds[stage] if self.seconds[stage] else 0.0
+            print(f'{label:>12} {reached:10d} {passed:10d} {p:8.4f} {rate:10.0f}')
+        
+def Wang_attempt(data, stats=None):
+    """
+    One try at a collision from 64 bytes of data: modify it for the round 1
+    and 2 conditions, reject it as soon as a remaining condition fails
+    (cheapest, i.e. earliest step, first), and only then hash both messages.
+    Returns (M, M') on a collision, otherwise None.
+    """
+    if stats is None:
+        stats = WangStats()
+    
+    t0 = time.perf_counter()
+    T = Wang_fix_round2(WangTrace(MD4_get_words(data)))
+    t1 = time.perf_counter()
+    stats.reached['modify'] += 1
+    stats.passed['modify'] += 1
+    stats.seconds['modify'] += t1 - t0
+    
+    for masks in Wang_Masks_2:
+        stage = f'step {masks[0]}'
+        stats.reached[stage] += 1
+        ok = Wang_failed_bits(T, masks) == 0
+        t2 = time.perf_counter()
+        stats.seconds[stage] += t2 - t1
+        t1 = t2
+        if not ok:
+            return(None)
+        stats.passed[stage] += 1
+    
+    stats.reached['collision'] += 1
+    new_data = T.data()
+    new_data_ = Wang_Msg_Differential(new_data)
+    collided = md4.MD4(new_data).finish() == md4.MD4(new_data_).finish()
+    stats.seconds['collision'] += time.perf_counter() - t1
+    if not collided:
+        return(None)
+    stats.passed['collision'] += 1
+    
+    return(new_data, new_data_)
+
+def run_Wang_search(max_tries=2**24, report=True, seed=None):
+    """
+    Single core collision search with the round 2 corrections.  Prints the
+    per-stage success rates and speeds and returns (M, M', attempts).
+    """
+    rng = random.Random(seed)
+    stats = WangStats()
+    t0 = time.perf_counter()
+    
+    found = None
+    for ctr in range(1, max_tries + 1):
+        found = Wang_attempt(rng.randbytes(64), stats)
+        if found is not None:
+            break
+    dt = time.perf_counter() - t0
+    
+    if report:
+        stats.report()
+        print(f'{ctr} attempts in {dt:.1f} s ({ctr/dt:.0f}/s)')
+        
+    if found is None:
+        return(None)
+    return(found[0], found[1], ctr)
+
+
 def Wang_Msg_Differential(data, endianness='little'):
     
     M = MD4_get_words(data, endianness)
@@ -349,102 +582,12 @@ def Wang_Msg_Differential(data, endianness='little'):
 
 def check_conditions(A,B,C,D):
     
-    assert(bitget(A[1], 6) == bitget(B[0], 6))
-    assert(bitget(D[1], 6) == 0)
-    assert(bitget(D[1], 7) == bitget(A[1], 7))
-    assert(bitget(D[1], 10) == bitget(A[1], 10))
-    assert(bitget(C[1], 6) == 1)
-    assert(bitget(C[1], 7) == 1)
-    assert(bitget(C[1], 10) == 0)
-    assert(bitget(C[1], 25) == bitget(D[1], 25))
-    assert(bitget(B[1], 6) == 1)
-    assert(bitget(B[1], 7) == 0)
-    assert(bitget(B[1], 10) == 0)
-    assert(bitget(B[1], 25) == 0)
-    assert(bitget(A[2], 7) == 1)
-    assert(bitget(A[2], 10) == 1)
-    assert(bitget(A[2], 13) == bitget(B[1], 13))
-    assert(bitget(A[2], 25) == 0)
-    assert(bitget(D[2], 13) == 0)
-    assert(bitget(D[2], 18) == bitget(A[2], 18))
-    assert(bitget(D[2], 19) == bitget(A[2], 19))
-    assert(bitget(D[2], 20) == bitget(A[2], 20))
-    assert(bitget(D[2], 21) == bitget(A[2], 21))
-    assert(bitget(D[2], 25) == 1)
-    assert(bitget(C[2], 12) == bitget(D[2], 12))
-    assert(bitget(C[2], 13) == 0)
-    assert(bitget(C[2], 14) == bitget(D[2], 14))
-    assert(bitget(C[2], 18) == 0)
-    assert(bitget(C[2], 19) == 0)
-    assert(bitget(C[2], 20) == 1)
-    assert(bitget(C[2], 21) == 0)
-    assert(bitget(B[2], 12) == 1)
-    assert(bitget(B[2], 13) == 1)
-    assert(bitget(B[2], 14) == 0)
-    assert(bitget(B[2], 16) == bitget(C[2], 16))
-    assert(bitget(B[2], 18) == 0)
-    assert(bitget(B[2], 19) == 0)
-    assert(bitget(B[2], 20) == 0)
-    assert(bitget(B[2], 21) == 0)
-    assert(bitget(A[3], 12) == 1)
-    assert(bitget(A[3], 13) == 1)
-    assert(bitget(A[3], 14) == 1)
-    assert(bitget(A[3], 16) == 0)
-    assert(bitget(A[3], 18) == 0)
-    assert(bitget(A[3], 19) == 0)
-    assert(bitget(A[3], 20) == 0)
-    assert(bitget(A[3], 21) == 1)
-    assert(bitget(A[3], 22) == bitget(B[2], 22))
-    assert(bitget(A[3], 25) == bitget(B[2], 25))
-    assert(bitget(D[3], 12) == 1)
-    assert(bitget(D[3], 13) == 1)
-    assert(bitget(D[3], 14) == 1)
-    assert(bitget(D[3], 16) == 0)
-    assert(bitget(D[3], 19) == 0)
-    assert(bitget(D[3], 20) == 1)
-    assert(bitget(D[3], 21) == 1)
-    assert(bitget(D[3], 22) == 0)
-    assert(bitget(D[3], 25) == 1)
-    assert(bitget(D[3], 29) == bitget(A[3], 29))
-    assert(bitget(C[3], 16) == 1)
-    assert(bitget(C[3], 19) == 0)
-    assert(bitget(C[3], 20) == 0)
-    assert(bitget(C[3], 21) == 0)
-    assert(bitget(C[3], 22) == 0)
-    assert(bitget(C[3], 25) == 0)
-    assert(bitget(C[3], 29) == 1)
-    assert(bitget(C[3], 31) == bitget(D[3], 31))
-    assert(bitget(B[3], 19) == 0)
-    assert(bitget(B[3], 20) == 1)
-    assert(bitget(B[3], 21) == 1)
-    assert(bitget(B[3], 22) == bitget(C[3], 22))
-    assert(bitget(B[3], 25) == 1)
-    assert(bitget(B[3], 29) == 0)
-    assert(bitget(B[3], 31) == 0)
-    assert(bitget(A[4], 22) == 0)
-    assert(bitget(A[4], 25) == 0)
-    assert(bitget(A[4], 26) == bitget(B[3], 26))
-    assert(bitget(A[4], 28) == bitget(B[3], 28))
-    assert(bitget(A[4], 29) == 1)
-    assert(bitget(A[4], 31) == 0)
-    assert(bitget(D[4], 22) == 0)
-    assert(bitget(D[4], 25) == 0)
-    assert(bitget(D[4], 26) == 1)
-    assert(bitget(D[4], 28) == 1)
-    assert(bitget(D[4], 29) == 0)
-    assert(bitget(D[4], 31) == 1)
-    assert(bitget(C[4], 18) == bitget(D[4], 18))
-    assert(bitget(C[4], 22) == 1)
-    assert(bitget(C[4], 25) == 1)
-    assert(bitget(C[4], 26) == 0)
-    assert(bitget(C[4], 28) == 0)
-    assert(bitget(C[4], 29) == 0)
-    assert(bitget(B[4], 18) == 0)
-    assert(bitget(B[4], 25) == 1)
-    assert(bitget(B[4], 26) == 1)
-    assert(bitget(B[4], 28) == 1)
-    assert(bitget(B[4], 29) == 0)
-    assert(bitget(B[4], 31) == bitget(C[4], 31))
+    # Round 1 conditions, one mask check per step (see compile_Wang_Rules)
+    Q = [A[0], D[0], C[0], B[0]]
+    for ii in range(1, 5):
+        Q += [A[ii], D[ii], C[ii], B[ii]]
+    for i, masks in enumerate(Wang_Masks):
+        assert(meets_masks(Q[i+4], Q[i+3], masks))
     
     
 def Wang_SSM(data, do_padding = False, endianness='little'):
@@ -579,104 +722,76 @@ def Wang_SSM(data, do_padding = False, endianness='little'):
 def Wang_SSM_New(data, do_padding = False, endianness='little'):
     
     """ 
-    Implements the single step modification from Wang's paper.
+    Implements the single step modification from Wang's paper: compute each
+    round 1 step, force it to meet its conditions, and back out the
+    message word that produces it.
     """    
     
-    if do_padding:        
-        M = MD4_get_words(MD4_pad_data(data), endianness)        
-    else:        
+    if do_padding:
+        M = MD4_get_words(MD4_pad_data(data), endianness)
+    else:
         if len(data) < 64:
-            data += b'\x00'*(64-len(data))            
-        M = MD4_get_words(data, endianness) 
+            data += b'\x00'*(64-len(data))
+        M = MD4_get_words(data, endianness)
 
-    A, B, C, D = MD4_get_IVs(M)
+    T = WangTrace(M)
+    for i in range(16):
+        T.set_step(i, apply_masks(T.step(i), T.Q[i+3], Wang_Masks[i]))
     
-    jj = 0 # Constant...we're just doing the 1st round corrections.
-    for ii in range(4):
-        
-        corrections = Wang_Rules[4*ii]
-        A[ii+1] = phi(jj, A[ii], B[ii], C[ii], D[ii], M[W[jj][4*ii+0]], S[jj][0])
-        A[ii+1] = apply_corrections(A[ii+1], B[ii], corrections)
-        M[W[jj][4*ii+0]] = un_phi(jj, A[ii], B[ii], C[ii], D[ii], A[ii+1], S[jj][0])
-        
-        corrections = Wang_Rules[4*ii+1]
-        D[ii+1] = phi(jj, D[ii], A[ii+1], B[ii], C[ii], M[W[jj][4*ii+1]], S[jj][1])
-        D[ii+1] = apply_corrections(D[ii+1], A[ii+1], corrections)
-        M[W[jj][4*ii+1]] = un_phi(jj, D[ii], A[ii+1], B[ii], C[ii], D[ii+1], S[jj][1])
-        
-        corrections = Wang_Rules[4*ii+2]      
-        C[ii+1] = phi(jj, C[ii], D[ii+1], A[ii+1], B[ii], M[W[jj][4*ii+2]], S[jj][2])
-        C[ii+1] = apply_corrections(C[ii+1], D[ii+1], corrections)
-        M[W[jj][4*ii+2]] = un_phi(jj, C[ii], D[ii+1], A[ii+1], B[ii], C[ii+1], S[jj][2])
-        
-        corrections = Wang_Rules[4*ii+3]
-        B[ii+1] = phi(jj, B[ii], C[ii+1],   D[ii+1],   A[ii+1],   M[W[jj][4*ii+3]], S[jj][3])
-        B[ii+1] = apply_corrections(B[ii+1], C[ii+1], corrections)
-        M[W[jj][4*ii+3]] = un_phi(jj, B[ii], C[ii+1],   D[ii+1],   A[ii+1], B[ii+1], S[jj][3])
-    
-    new_data = MD4_get_data(M, endianness)
-    
-    return(new_data)
+    return(T.data(endianness))
 
 def Wang_fixA5(data, do_padding=True, endianness='little'):
     
     """ 
-    Implement Table 1 changes modify M for A[5] corrections.
+    Implement Table 1 changes modify M for A[5] corrections: move m0 by
+    2**(kk-3) to flip bit kk of a1, then keep d1, c1, b1, a2 as they were
+    through m1..m4.
     """
     if do_padding:
-        M = MD4_get_words(MD4_pad_data(data, endianness))
+        M = MD4_get_words(MD4_pad_data(data), endianness)
     else:
         if len(data) < 64:
             data += b'\x00'*(64-len(data))
-        M = MD4_get_words(data, endianness) 
+        M = MD4_get_words(data, endianness)
         
+    T = WangTrace(M)
     for kk in [18, 25, 26, 28, 31]:
-
-        A, B, C, D = MD4_get_IVs(M)  
+        
+        a5 = T.step(16)
         
         # Assume bits match...
         direction = 0
         
         if kk==18:
-            direction = bitget(C[4], 18) - bitget(A[5], 18) 
+            direction = bitget(T.step(14), 18) - bitget(a5, 18) 
         elif kk == 25:
-            if bitget(A[5], 25) == 0:
+            if bitget(a5, 25) == 0:
                 direction = 1
         elif kk == 26:
-            if bitget(A[5], 26) == 1:
+            if bitget(a5, 26) == 1:
                 direction = -1
         elif kk == 28:
-            if bitget(A[5], 28) == 0:
+            if bitget(a5, 28) == 0:
                 direction = 1
         elif kk == 31:
-            if bitget(A[5], 31) == 0:
+            if bitget(a5, 31) == 0:
                 direction = 1
 
-        # Now back out the modified M
-        if direction == 1:
-            
-            A[1] = bitset(A[1], kk, 1)
-            M[0] = (M[0] + 2**(kk+1-4)) % 2**32
-            M[1] = rrot_32(D[1],  7) - D[0] - F(A[1], B[0], C[0]) % 2**32
-            M[2] = rrot_32(C[1], 11) - C[0] - F(D[1], A[1], B[0]) % 2**32
-            M[3] = rrot_32(B[1], 19) - B[0] - F(C[1], D[1], A[1]) % 2**32
-            M[4] = rrot_32(A[2],  3) - A[1] - F(B[1], C[1], D[1]) % 2**32
-        elif direction == -1:
-            A[1] = bitset(A[1], kk, 0)
-            M[0] = (M[0] - 2**(kk+1-4)) % 2**32
-            M[1] = rrot_32(D[1],  7) - D[0] - F(A[1], B[0], C[0]) % 2**32
-            M[2] = rrot_32(C[1], 11) - C[0] - F(D[1], A[1], B[0]) % 2**32
-            M[3] = rrot_32(B[1], 19) - B[0] - F(C[1], D[1], A[1]) % 2**32
-            M[4] = rrot_32(A[2],  3) - A[1] - F(B[1], C[1], D[1]) % 2**32
+        if direction != 0:
+            pinned = [T.step(i) for i in range(1, 5)]
+            a1 = bitset(T.step(0), kk, 1 if direction == 1 else 0)
+            T.set_word(0, T.M[0] + direction * 2**(kk+1-4))
+            # m1..m4 are backed out from the a1 we wanted, which m0 only
+            # gives if there's no carry -- so recompute from scratch after
+            T.step(0)
+            T.Q[4] = a1
+            for i, value in enumerate(pinned, 1):
+                T.set_step(i, value)
+            T.valid = 0
         
     # Check constraints...a5;19 = c4;19, a5;26 = 1, a5;27 = 0, a5;29 = 1, a5;32 = 1
-    A,B,C,D = MD4_get_IVs(M)
-    assert(bitget(A[5], 18) == bitget(C[4], 18))
-    assert(bitget(A[5], 25) == 1)
-    assert(bitget(A[5], 26) == 0)
-    assert(bitget(A[5], 28) == 1)    
-    assert(bitget(A[5], 31) == 1)
-    return(MD4_get_data(M, endianness))
+    assert(meets_masks(T.step(16), T.step(14), Wang_A5_Masks))
+    return(T.data(endianness))
 
 def Wang_fixA5_2(data, do_padding=True, endianness='little'):
     
@@ -684,96 +799,70 @@ def Wang_fixA5_2(data, do_padding=True, endianness='little'):
     Implement Table 1 changes modify M for A[5] corrections.
     """
     if do_padding:
-        M = MD4_get_words(MD4_pad_data(data, endianness))
+        M = MD4_get_words(MD4_pad_data(data), endianness)
     else:
         if len(data) < 64:
             data += b'\x00'*(64-len(data))
-        M = MD4_get_words(data, endianness) 
+        M = MD4_get_words(data, endianness)
         
-    A, B, C, D = MD4_get_IVs(M)  
-    
-    #print(A[0:6],B[0:6],C[0:6],D[0:6],'\n')    
+    T = WangTrace(M)
     
-    A[5] = bitset(A[5], 18, bitget(C[4], 18))
-    A[5] = bitset(A[5], 25, 1)
-    A[5] = bitset(A[5], 26, 0)
-    A[5] = bitset(A[5], 28, 1)
-    A[5] = bitset(A[5], 31, 1)
+    # a5;19 = c4;19, a5;26 = 1, a5;27 = 0, a5;29 = 1, a5;32 = 1
+    a5 = apply_masks(T.step(16), T.step(14), Wang_A5_Masks)
     
-    M[0] = (rrot_32(A[5], 3) - A[4] - G(B[4], C[4], D[4]) - MGK_1) % 2**32
+    # m0 gives the new a5 (and a new a1).  All message words prior to the 
+    # calculation of A[5] contribute to A[5], so adjust m1..m4 to keep 
+    # d1, c1, b1, a2 the same.
+    pinned = [T.step(i) for i in range(1, 5)]
+    T.set_word(0, T.word_for(16, a5))
+    for i, value in enumerate(pinned, 1):
+        T.set_step(i, value)
     
-    A[1] = lrot_32( (A[0] + F(B[0], C[0], D[0]) + M[0]) % 2**32, 3)
-    
-    # Modify M to be consistent with new A[5]...all message bytes prior to 
-    # calculation of A[5] contribute to A[5], and may need to be adjusted
-    M[1] = rrot_32(D[1],  7) - D[0] - F(A[1], B[0], C[0]) % 2**32
-    M[2] = rrot_32(C[1], 11) - C[0] - F(D[1], A[1], B[0]) % 2**32
-    M[3] = rrot_32(B[1], 19) - B[0] - F(C[1], D[1], A[1]) % 2**32
-    M[4] = rrot_32(A[2],  3) - A[1] - F(B[1], C[1], D[1]) % 2**32
-        
-    # Check constraints...a5;19 = c4;19, a5;26 = 1, a5;27 = 0, a5;29 = 1, 
-    # a5;32 = 1
-    A,B,C,D = MD4_get_IVs(M)
-    #print(A[0:6],B[0:6],C[0:6],D[0:6],'\n')
-    #assert(bitget(A[5], 18) == bitget(C[4], 18))
-    #assert(bitget(A[5], 25) == 1)
-    #assert(bitget(A[5], 26) == 0)
-    #assert(bitget(A[5], 28) == 1)    
-    #assert(bitget(A[5], 31) == 1)
-    
-    return(MD4_get_data(M, endianness))
+    return(T.data(endianness))
 
 def Wang_fixD5(data, do_padding=True, endianness='little'):
     
     #d5;19 = a5;19,   d5;26 = b4;26,   d5;27 = b4;27,   d5;29 = b4;29,   d5;32 = b4;32
     
     if do_padding:
-        M = MD4_get_words(MD4_pad_data(data, endianness))
+        M = MD4_get_words(MD4_pad_data(data), endianness)
     else:
         if len(data) < 64:
             data += b'\x00'*(64-len(data))
-        M = MD4_get_words(data, endianness) 
+        M = MD4_get_words(data, endianness)
         
-    A, B, C, D = MD4_get_IVs(M)
-    #print(A[0:6],B[0:6],C[0:6],D[0:6],'\n')
-    
-    D[5] = bitset(D[5], 18, bitget(A[5], 18))
-    D[5] = bitset(D[5], 25, bitget(B[4], 25))
-    D[5] = bitset(D[5], 26, bitget(B[4], 26))
-    D[5] = bitset(D[5], 28, bitget(B[4], 28))
-    D[5] = bitset(D[5], 31, bitget(B[4], 31))
-    D[5] = D[5] % 2**32
-    
-    #     D[5] = lrot_32( (D[4] + G(A[5], B[4], C[4]) + M[4] + MGK_1) % 2**32, 5)
-    M[4] = (rrot_32(D[5], 5) - D[4] - G(A[5], B[4], C[4]) - MGK_1) % 2**32
-    A[2] = lrot_32( (A[1] + F(B[1], C[1], D[1]) + M[4]) % 2**32, 3) % 2**32
-    
-    M[5] = rrot_32(D[2],  7) - D[1] - F(A[2], B[1], C[1]) % 2**32
-    M[6] = rrot_32(C[2], 11) - C[1] - F(D[2], A[2], B[1]) % 2**32
-    M[7] = rrot_32(B[2], 19) - B[1] - F(C[2], D[2], A[2]) % 2**32
-    M[8] = rrot_32(A[3],  3) - A[2] - F(B[2], C[2], D[2]) % 2**32
-    
-    A,B,C,D = MD4_get_IVs(M)
-    #print(A[0:6],B[0:6],C[0:6],D[0:6])
-    
-    assert(bitget(D[5], 18) == bitget(A[5], 18))
-    assert(bitget(D[5], 25) == bitget(B[4], 25))
-    assert(bitget(D[5], 26) == bitget(B[4], 26))
-    assert(bitget(D[5], 28) == bitget(B[4], 28))
-    assert(bitget(D[5], 31) == bitget(B[4], 31))
+    T = WangTrace(M)
+    a5, b4 = T.step(16), T.step(15)
+    d5 = apply_masks(T.step(17), a5, Wang_D5_Masks_a5)
+    d5 = apply_masks(d5, b4, Wang_D5_Masks_b4)
+    
+    # m4 gives the new d5 (and a new a2); m5..m8 keep d2, c2, b2, a3
+    pinned = [T.step(i) for i in range(5, 9)]
+    T.set_word(4, T.word_for(17, d5))
+    for i, value in enumerate(pinned, 5):
+        T.set_step(i, value)
+    
+    assert(meets_masks(T.step(17), a5, Wang_D5_Masks_a5))
+    assert(meets_masks(T.step(17), b4, Wang_D5_Masks_b4))
 
-    return(MD4_get_data(M, endianness))
+    return(T.data(endianness))
     
 def run_RFC_tests():
     
-    assert(MD4('').hex() == '31d6cfe0d16ae931b73c59d7e0c089c0')
-    assert(MD4('a').hex() == 'bde52cb31de33e46245e05fbdbd6fb24')
-    assert(MD4('abc').hex() == 'a448017aaf21d8525fc10ae87aa6729d')
-    assert(MD4('message digest').hex() == 'd9130a8164549fe818874806e1c7014b')
-    assert(MD4('abcdefghijklmnopqrstuvwxyz').hex() == 'd79e1c308aa5bbcdeea8ed63df412da9')
-    assert(MD4('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789').hex() == '043f8582f241db351ce627e153e7f0e4')
-    assert(MD4('12345678901234567890123456789012345678901234567890123456789012345678901234567890').hex() == \
-      'e33b4ddc9c38f2199c3e7b164fcc0536')
+    tests = [('', '31d6cfe0d16ae931b73c59d7e0c089c0'),
+             ('a', 'bde52cb31de33e46245e05fbdbd6fb24'),
+             ('abc', 'a448017aaf21d8525fc10ae87aa6729d'),
+             ('message digest', 'd9130a8164549fe818874806e1c7014b'),
+             ('abcdefghijklmnopqrstuvwxyz', 'd79e1c308aa5bbcdeea8ed63df412da9'),
+             ('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789', '043f8582f241db351ce627e153e7f0e4'),
+             ('12345678901234567890123456789012345678901234567890123456789012345678901234567890', 
+              'e33b4ddc9c38f2199c3e7b164fcc0536')]
+    
+    # Fast and trace modes, plus the streaming engine itself
+    for msg, digest in tests:
+        assert(MD4(msg).hex() == digest)
+        assert(MD4(msg, trace=True)[0].hex() == digest)
+        assert(md4.MD4(msg.encode()).hexdigest() == digest)
 
     print('If you can see this, all the tests passed.')    
     
@@ -821,6 +910,12 @@ def run_Wang_examples():
     assert(MD4(M_2_be, False, 'big') == H_2_np)
     assert(MD4(M_2_c_be, False, 'big') == H_2_np)
     
+    # ...and again in trace mode
+    for M, H in [(M_1, H_1), (M_1_c, H_1), (M_2, H_2), (M_2_c, H_2)]:
+        assert(MD4(M, trace=True)[0] == H)
+    for M, H in [(M_1_be, H_1_np), (M_1_c_be, H_1_np), (M_2_be, H_2_np), (M_2_c_be, H_2_np)]:
+        assert(MD4(M, False, 'big', trace=True)[0] == H)
+    
     print('Wang Table 3 Tests passed')
     
     return(True)
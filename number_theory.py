@@ -0,0 +1,267 @@
+"""
+Modular arithmetic for the RSA and DSA challenges: modular inverses (one at
+a time or in a batch), integer k-th roots and the Chinese remainder theorem,
+with the e=3 broadcast attack built from the last two.
+
+Everything works on plain Python ints of any size and raises ValueError
+rather than returning a wrong answer: a value with no inverse, moduli that
+aren't pairwise coprime, a broadcast whose CRT result isn't a perfect cube.
+"""
+
+import math
+import random
+import sys
+import time
+
+
+def egcd(a, b):
+    """(g, x, y) with a*x + b*y == g == gcd(a, b)"""
+
+    old_r, r = a, b
+    old_s, s = 1, 0
+    old_t, t = 0, 1
+
+    while r:
+        q = old_r // r
+        old_r, r = r, old_r - q*r
+        old_s, s = s, old_s - q*s
+        old_t, t = t, old_t - q*t
+
+    return(old_r, old_s, old_t)
+
+
+def invmod(a, m):
+    """a**-1 mod m, in [0, m); ValueError if gcd(a, m) != 1"""
+
+    if sys.version_info >= (3, 8):
+        try:
+            return(pow(a, -1, m))
+        except ValueError:
+            raise(ValueError(f'{a} is not invertible mod {m}')) from None
+
+    g, x, _ = egcd(a % m, m)
+    if g != 1:
+        raise(ValueError(f'{a} is not invertible mod {m}'))
+
+    return(x % m)
+
+
+def invmod_many(values, m):
+    """
+    The inverses mod m of all of values, for the price of one invmod and
+    three multiplications each (Montgomery's trick): invert the product of
+    them all, then peel the values back off it one at a time.
+    """
+
+    values = [v % m for v in values]
+    if not values:
+        return([])
+
+    prefix = [1] * len(values)
+    acc = 1
+    for ii, v in enumerate(values):
+        prefix[ii] = acc
+        acc = acc * v % m
+
+    try:
+        inv = invmod(acc, m)
+    except ValueError:
+        # Name the culprit rather than the product
+        bad = next(v for v in values if math.gcd(v, m) != 1)
+        raise(ValueError(f'{bad} is not invertible mod {m}')) from None
+
+    inverses = [0] * len(values)
+    for ii in range(len(values) - 1, -1, -1):
+        inverses[ii] = inv * prefix[ii] % m
+        inv = inv * values[ii] % m
+
+    return(inverses)
+
+
+def iroot(k, n):
+    """
+    floor(n ** (1/k)) for an int n >= 0, by Newton's method.
+
+    The first guess is 2**(log2(n) / k), nudged up a little: math.log2
+    takes ints of any size, and the guess is split into a float part and a
+    shift so it never overflows, whatever n and k.  It's good to ~30 bits,
+    so only a few iterations are left at any size.  One Newton step from
+    anywhere lands on or above the root; from there the iterates fall to
+    it.
+    """
+
+    if k < 1:
+        raise(ValueError(f'k must be a positive integer, not {k}'))
+    if n < 0:
+        raise(ValueError(f'No real root of negative {n}'))
+    if n < 2 or k == 1:
+        return(n)
+
+    e = math.log2(n) / k
+    shift = max(0, int(e) - 60)
+    x = int(2.0 ** (e - shift)) << shift
+    x += (x >> 30) + 1
+
+    k1 = k - 1
+    x = (k1*x + n // x**k1) // k
+    while True:
+        y = (k1*x + n // x**k1) // k
+        if y >= x:
+            return(x)
+        x = y
+
+
+def is_kth_power(n, k):
+    """(root, exact): iroot(k, n) and whether root**k == n"""
+
+    r = iroot(k, n)
+
+    return(r, r**k == n)
+
+
+def crt(residues, moduli):
+    """
+    (x, M): the x in [0, M) with x == r (mod m) for every (r, m) pair,
+    where M is the product of the moduli.  The moduli must be pairwise
+    coprime.
+    """
+
+    if len(residues) != len(moduli):
+        raise(ValueError(f'{len(residues)} residues but {len(moduli)} moduli'))
+
+    M = math.prod(moduli)
+    x = 0
+    for r, m in zip(residues, moduli):
+        Mi = M // m
+        try:
+            x += r * Mi * invmod(Mi, m)
+        except ValueError:
+            raise(ValueError(f'Modulus {m} shares a factor with the '
+                             f'others')) from None
+
+    return(x % M, M)
+
+
+def rsa_broadcast(ciphertexts, moduli, e=3):
+    """
+    The plaintext behind e encryptions of one message under e public keys
+    with exponent e (challenge 40): CRT the ciphertexts together, which
+    gives m**e exactly (it's smaller than the product of the moduli), then
+    take the e-th root.
+    """
+
+    c, _ = crt(ciphertexts, moduli)
+    m, exact = is_kth_power(c, e)
+    if not exact:
+        raise(ValueError(f'CRT result is not a perfect power of {e}'))
+
+    return(m)
+
+
+def _timed(f, *args, repeat=1):
+
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        f(*args)
+
+    return((time.perf_counter() - t0) / repeat)
+
+
+def run_number_theory_tests():
+
+    rng = random.Random(0)
+
+    assert(invmod(3, 7) == 5)
+    assert(invmod(-3, 7) == 2)
+    for a, m in ((6, 9), (0, 5), (4, 1 << 20)):
+        try:
+            invmod(a, m)
+            assert(False)
+        except ValueError:
+            pass
+
+    for bits in (64, 1024, 4096):
+        m = rng.getrandbits(bits) | 1
+        xs = [x for x in (rng.randrange(1, m) for _ in range(100))
+              if math.gcd(x, m) == 1]
+        assert(invmod_many(xs, m) == [invmod(x, m) for x in xs])
+        g, x, y = egcd(xs[0], m)
+        assert(g == 1 and xs[0]*x + m*y == 1)
+    try:
+        invmod_many([3, 5, 6], 9)
+        assert(False)
+    except ValueError as err:
+        assert(str(err).startswith('3 '))
+
+    for n in list(range(200)) + [2**64 - 1, 2**64, 2**64 + 1, 10**100]:
+        for k in (1, 2, 3, 5, 17):
+            r = iroot(k, n)
+            assert(r**k <= n < (r + 1)**k)
+    for bits in (2048, 4096, 8192):
+        r = rng.getrandbits(bits // 3)
+        for n in (r**3 - 1, r**3, r**3 + 1):
+            x = iroot(3, n)
+            assert(x**3 <= n < (x + 1)**3)
+        assert(is_kth_power(r**3, 3) == (r, True))
+    # k and n too big for a float guess from n's top bits
+    for k, n in ((1100, 2**2200), (1100, 3**1100 - 1), (5000, 7**5000 + 1),
+                 (961, 2**1023 - 1), (2, 2**100000 - 1), (3, 3**60000)):
+        r = iroot(k, n)
+        assert(r**k <= n < (r + 1)**k)
+
+    assert(crt([2, 3, 2], [3, 5, 7]) == (23, 105))
+    try:
+        crt([1, 2], [6, 9])
+        assert(False)
+    except ValueError:
+        pass
+
+    # e=3 broadcast, with moduli of coprime random odd ints as stand-ins
+    msg = int.from_bytes(b'e=3 broadcast attack', 'big')
+    moduli = []
+    while len(moduli) < 3:
+        n = rng.getrandbits(1024) | (1 << 1023) | 1
+        if all(math.gcd(n, other) == 1 for other in moduli):
+            moduli.append(n)
+    assert(rsa_broadcast([pow(msg, 3, n) for n in moduli], moduli) == msg)
+
+    print('Number theory tests passed')
+
+
+def run_number_theory_benchmarks(sizes=(2048, 4096, 8192), n_values=256):
+    """
+    Per-call times at each modulus size: invmod by pow() and by extended
+    Euclid, invmod_many per value, a cube root of a 3*bits number (the e=3
+    case) and a CRT of three residues.
+    """
+
+    rng = random.Random(1)
+    print(f"{'bits':>5} {'invmod':>9} {'egcd':>9} {'many/val':>9} "
+          f"{'cube root':>10} {'crt x3':>9}   (microseconds)")
+
+    for bits in sizes:
+        m = rng.getrandbits(bits) | (1 << (bits - 1)) | 1
+        xs = [x for x in (rng.randrange(1, m) for _ in range(n_values))
+              if math.gcd(x, m) == 1]
+        moduli = []
+        while len(moduli) < 3:
+            n = rng.getrandbits(bits) | (1 << (bits - 1)) | 1
+            if all(math.gcd(n, other) == 1 for other in moduli):
+                moduli.append(n)
+        cube = rng.getrandbits(bits)**3
+
+        t_pow = _timed(lambda: [invmod(x, m) for x in xs]) / len(xs)
+        t_egcd = _timed(lambda: [egcd(x, m)[1] % m for x in xs]) / len(xs)
+        t_many = _timed(invmod_many, xs, m) / len(xs)
+        t_root = _timed(iroot, 3, cube, repeat=20)
+        t_crt = _timed(crt, [x % n for x, n in zip(xs, moduli)], moduli,
+                       repeat=20)
+
+        print(f"{bits:5d} {t_pow*1e6:9.0f} {t_egcd*1e6:9.0f} "
+              f"{t_many*1e6:9.1f} {t_root*1e6:10.0f} {t_crt*1e6:9.0f}")
+
+
+if __name__ == '__main__':
+
+    run_number_theory_tests()
+    run_number_theory_benchmarks()
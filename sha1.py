@@ -1,145 +1,718 @@
+import hashlib
+import os
 import struct
+import time
+
+import numpy as np
 
 
 def leftrotate(i, n):
     return ((i << n) & 0xffffffff) | (i >> (32 - n))
 
 
+SHA1_IV = (0x67452301, 0xEFCDAB89, 0x98BADCFE, 0x10325476, 0xC3D2E1F0)
+SHA1_K_NP = np.array([0x5A827999, 0x6ED9EBA1, 0x8F1BBCDC, 0xCA62C1D6],
+                     dtype=np.uint32)
+
+
+def sha1_compress(state, blocks):
+    """
+    Runs the SHA-1 compression function over blocks (a multiple of 64
+    bytes) starting from state, a sequence of five 32-bit words, and
+    returns the new state as a tuple.
+
+    The 80 rounds are written out in full (generated, not hand typed):
+    there is no per-round branch, the working variables change roles
+    instead of being shuffled, and the rotations are written so results
+    stay within 32 bits without a % 2**32.
+    """
+
+    h0, h1, h2, h3, h4 = state
+
+    for (w0, w1, w2, w3, w4, w5, w6, w7, w8, w9, w10, w11, w12, w13, w14,
+         w15) in struct.iter_unpack('>16I', blocks):
+
+        t = w13 ^ w8 ^ w2 ^ w0
+        w16 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w14 ^ w9 ^ w3 ^ w1
+        w17 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w15 ^ w10 ^ w4 ^ w2
+        w18 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w16 ^ w11 ^ w5 ^ w3
+        w19 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w17 ^ w12 ^ w6 ^ w4
+        w20 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w18 ^ w13 ^ w7 ^ w5
+        w21 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w19 ^ w14 ^ w8 ^ w6
+        w22 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w20 ^ w15 ^ w9 ^ w7
+        w23 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w21 ^ w16 ^ w10 ^ w8
+        w24 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w22 ^ w17 ^ w11 ^ w9
+        w25 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w23 ^ w18 ^ w12 ^ w10
+        w26 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w24 ^ w19 ^ w13 ^ w11
+        w27 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w25 ^ w20 ^ w14 ^ w12
+        w28 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w26 ^ w21 ^ w15 ^ w13
+        w29 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w27 ^ w22 ^ w16 ^ w14
+        w30 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w28 ^ w23 ^ w17 ^ w15
+        w31 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w29 ^ w24 ^ w18 ^ w16
+        w32 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w30 ^ w25 ^ w19 ^ w17
+        w33 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w31 ^ w26 ^ w20 ^ w18
+        w34 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w32 ^ w27 ^ w21 ^ w19
+        w35 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w33 ^ w28 ^ w22 ^ w20
+        w36 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w34 ^ w29 ^ w23 ^ w21
+        w37 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w35 ^ w30 ^ w24 ^ w22
+        w38 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w36 ^ w31 ^ w25 ^ w23
+        w39 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w37 ^ w32 ^ w26 ^ w24
+        w40 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w38 ^ w33 ^ w27 ^ w25
+        w41 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w39 ^ w34 ^ w28 ^ w26
+        w42 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w40 ^ w35 ^ w29 ^ w27
+        w43 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w41 ^ w36 ^ w30 ^ w28
+        w44 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w42 ^ w37 ^ w31 ^ w29
+        w45 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w43 ^ w38 ^ w32 ^ w30
+        w46 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w44 ^ w39 ^ w33 ^ w31
+        w47 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w45 ^ w40 ^ w34 ^ w32
+        w48 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w46 ^ w41 ^ w35 ^ w33
+        w49 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w47 ^ w42 ^ w36 ^ w34
+        w50 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w48 ^ w43 ^ w37 ^ w35
+        w51 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w49 ^ w44 ^ w38 ^ w36
+        w52 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w50 ^ w45 ^ w39 ^ w37
+        w53 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w51 ^ w46 ^ w40 ^ w38
+        w54 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w52 ^ w47 ^ w41 ^ w39
+        w55 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w53 ^ w48 ^ w42 ^ w40
+        w56 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w54 ^ w49 ^ w43 ^ w41
+        w57 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w55 ^ w50 ^ w44 ^ w42
+        w58 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w56 ^ w51 ^ w45 ^ w43
+        w59 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w57 ^ w52 ^ w46 ^ w44
+        w60 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w58 ^ w53 ^ w47 ^ w45
+        w61 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w59 ^ w54 ^ w48 ^ w46
+        w62 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w60 ^ w55 ^ w49 ^ w47
+        w63 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w61 ^ w56 ^ w50 ^ w48
+        w64 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w62 ^ w57 ^ w51 ^ w49
+        w65 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w63 ^ w58 ^ w52 ^ w50
+        w66 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w64 ^ w59 ^ w53 ^ w51
+        w67 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w65 ^ w60 ^ w54 ^ w52
+        w68 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w66 ^ w61 ^ w55 ^ w53
+        w69 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w67 ^ w62 ^ w56 ^ w54
+        w70 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w68 ^ w63 ^ w57 ^ w55
+        w71 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w69 ^ w64 ^ w58 ^ w56
+        w72 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w70 ^ w65 ^ w59 ^ w57
+        w73 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w71 ^ w66 ^ w60 ^ w58
+        w74 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w72 ^ w67 ^ w61 ^ w59
+        w75 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w73 ^ w68 ^ w62 ^ w60
+        w76 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w74 ^ w69 ^ w63 ^ w61
+        w77 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w75 ^ w70 ^ w64 ^ w62
+        w78 = ((t & 0x7fffffff) << 1) | (t >> 31)
+        t = w76 ^ w71 ^ w65 ^ w63
+        w79 = ((t & 0x7fffffff) << 1) | (t >> 31)
+
+        a, b, c, d, e = h0, h1, h2, h3, h4
+
+        # Rounds 0-19
+        e = (((a << 5) | (a >> 27)) + (d ^ (b & (c ^ d))) + e + w0 +
+             0x5A827999) & 0xffffffff
+        b = (b >> 2) | ((b & 3) << 30)
+        d = (((e << 5) | (e >> 27)) + (c ^ (a & (b ^ c))) + d + w1 +
+             0x5A827999) & 0xffffffff
+        a = (a >> 2) | ((a & 3) << 30)
+        c = (((d << 5) | (d >> 27)) + (b ^ (e & (a ^ b))) + c + w2 +
+             0x5A827999) & 0xffffffff
+        e = (e >> 2) | ((e & 3) << 30)
+        b = (((c << 5) | (c >> 27)) + (a ^ (d & (e ^ a))) + b + w3 +
+             0x5A827999) & 0xffffffff
+        d = (d >> 2) | ((d & 3) << 30)
+        a = (((b << 5) | (b >> 27)) + (e ^ (c & (d ^ e))) + a + w4 +
+             0x5A827999) & 0xffffffff
+        c = (c >> 2) | ((c & 3) << 30)
+        e = (((a << 5) | (a >> 27)) + (d ^ (b & (c ^ d))) + e + w5 +
+             0x5A827999) & 0xffffffff
+        b = (b >> 2) | ((b & 3) << 30)
+        d = (((e << 5) | (e >> 27)) + (c ^ (a & (b ^ c))) + d + w6 +
+             0x5A827999) & 0xffffffff
+        a = (a >> 2) | ((a & 3) << 30)
+        c = (((d << 5) | (d >> 27)) + (b ^ (e & (a ^ b))) + c + w7 +
+             0x5A827999) & 0xffffffff
+        e = (e >> 2) | ((e & 3) << 30)
+        b = (((c << 5) | (c >> 27)) + (a ^ (d & (e ^ a))) + b + w8 +
+             0x5A827999) & 0xffffffff
+        d = (d >> 2) | ((d & 3) << 30)
+        a = (((b << 5) | (b >> 27)) + (e ^ (c & (d ^ e))) + a + w9 +
+             0x5A827999) & 0xffffffff
+        c = (c >> 2) | ((c & 3) << 30)
+        e = (((a << 5) | (a >> 27)) + (d ^ (b & (c ^ d))) + e + w10 +
+             0x5A827999) & 0xffffffff
+        b = (b >> 2) | ((b & 3) << 30)
+        d = (((e << 5) | (e >> 27)) + (c ^ (a & (b ^ c))) + d + w11 +
+             0x5A827999) & 0xffffffff
+        a = (a >> 2) | ((a & 3) << 30)
+        c = (((d << 5) | (d >> 27)) + (b ^ (e & (a ^ b))) + c + w12 +
+             0x5A827999) & 0xffffffff
+        e = (e >> 2) | ((e & 3) << 30)
+        b = (((c << 5) | (c >> 27)) + (a ^ (d & (e ^ a))) + b + w13 +
+             0x5A827999) & 0xffffffff
+        d = (d >> 2) | ((d & 3) << 30)
+        a = (((b << 5) | (b >> 27)) + (e ^ (c & (d ^ e))) + a + w14 +
+             0x5A827999) & 0xffffffff
+        c = (c >> 2) | ((c & 3) << 30)
+        e = (((a << 5) | (a >> 27)) + (d ^ (b & (c ^ d))) + e + w15 +
+             0x5A827999) & 0xffffffff
+        b = (b >> 2) | ((b & 3) << 30)
+        d = (((e << 5) | (e >> 27)) + (c ^ (a & (b ^ c))) + d + w16 +
+             0x5A827999) & 0xffffffff
+        a = (a >> 2) | ((a & 3) << 30)
+        c = (((d << 5) | (d >> 27)) + (b ^ (e & (a ^ b))) + c + w17 +
+             0x5A827999) & 0xffffffff
+        e = (e >> 2) | ((e & 3) << 30)
+        b = (((c << 5) | (c >> 27)) + (a ^ (d & (e ^ a))) + b + w18 +
+             0x5A827999) & 0xffffffff
+        d = (d >> 2) | ((d & 3) << 30)
+        a = (((b << 5) | (b >> 27)) + (e ^ (c & (d ^ e))) + a + w19 +
+             0x5A827999) & 0xffffffff
+        c = (c >> 2) | ((c & 3) << 30)
+
+        # Rounds 20-39
+        e = (((a << 5) | (a >> 27)) + (b ^ c ^ d) + e + w20 +
+             0x6ED9EBA1) & 0xffffffff
+        b = (b >> 2) | ((b & 3) << 30)
+        d = (((e << 5) | (e >> 27)) + (a ^ b ^ c) + d + w21 +
+             0x6ED9EBA1) & 0xffffffff
+        a = (a >> 2) | ((a & 3) << 30)
+        c = (((d << 5) | (d >> 27)) + (e ^ a ^ b) + c + w22 +
+             0x6ED9EBA1) & 0xffffffff
+        e = (e >> 2) | ((e & 3) << 30)
+        b = (((c << 5) | (c >> 27)) + (d ^ e ^ a) + b + w23 +
+             0x6ED9EBA1) & 0xffffffff
+        d = (d >> 2) | ((d & 3) << 30)
+        a = (((b << 5) | (b >> 27)) + (c ^ d ^ e) + a + w24 +
+             0x6ED9EBA1) & 0xffffffff
+        c = (c >> 2) | ((c & 3) << 30)
+        e = (((a << 5) | (a >> 27)) + (b ^ c ^ d) + e + w25 +
+             0x6ED9EBA1) & 0xffffffff
+        b = (b >> 2) | ((b & 3) << 30)
+        d = (((e << 5) | (e >> 27)) + (a ^ b ^ c) + d + w26 +
+             0x6ED9EBA1) & 0xffffffff
+        a = (a >> 2) | ((a & 3) << 30)
+        c = (((d << 5) | (d >> 27)) + (e ^ a ^ b) + c + w27 +
+             0x6ED9EBA1) & 0xffffffff
+        e = (e >> 2) | ((e & 3) << 30)
+        b = (((c << 5) | (c >> 27)) + (d ^ e ^ a) + b + w28 +
+             0x6ED9EBA1) & 0xffffffff
+        d = (d >> 2) | ((d & 3) << 30)
+        a = (((b << 5) | (b >> 27)) + (c ^ d ^ e) + a + w29 +
+             0x6ED9EBA1) & 0xffffffff
+        c = (c >> 2) | ((c & 3) << 30)
+        e = (((a << 5) | (a >> 27)) + (b ^ c ^ d) + e + w30 +
+             0x6ED9EBA1) & 0xffffffff
+        b = (b >> 2) | ((b & 3) << 30)
+        d = (((e << 5) | (e >> 27)) + (a ^ b ^ c) + d + w31 +
+             0x6ED9EBA1) & 0xffffffff
+        a = (a >> 2) | ((a & 3) << 30)
+        c = (((d << 5) | (d >> 27)) + (e ^ a ^ b) + c + w32 +
+             0x6ED9EBA1) & 0xffffffff
+        e = (e >> 2) | ((e & 3) << 30)
+        b = (((c << 5) | (c >> 27)) + (d ^ e ^ a) + b + w33 +
+             0x6ED9EBA1) & 0xffffffff
+        d = (d >> 2) | ((d & 3) << 30)
+        a = (((b << 5) | (b >> 27)) + (c ^ d ^ e) + a + w34 +
+             0x6ED9EBA1) & 0xffffffff
+        c = (c >> 2) | ((c & 3) << 30)
+        e = (((a << 5) | (a >> 27)) + (b ^ c ^ d) + e + w35 +
+             0x6ED9EBA1) & 0xffffffff
+        b = (b >> 2) | ((b & 3) << 30)
+        d = (((e << 5) | (e >> 27)) + (a ^ b ^ c) + d + w36 +
+             0x6ED9EBA1) & 0xffffffff
+        a = (a >> 2) | ((a & 3) << 30)
+        c = (((d << 5) | (d >> 27)) + (e ^ a ^ b) + c + w37 +
+             0x6ED9EBA1) & 0xffffffff
+        e = (e >> 2) | ((e & 3) << 30)
+        b = (((c << 5) | (c >> 27)) + (d ^ e ^ a) + b + w38 +
+             0x6ED9EBA1) & 0xffffffff
+        d = (d >> 2) | ((d & 3) << 30)
+        a = (((b << 5) | (b >> 27)) + (c ^ d ^ e) + a + w39 +
+             0x6ED9EBA1) & 0xffffffff
+        c = (c >> 2) | ((c & 3) << 30)
+
+        # Rounds 40-59
+        e = (((a << 5) | (a >> 27)) + ((b & c) | (d & (b | c))) + e + w40 +
+             0x8F1BBCDC) & 0xffffffff
+        b = (b >> 2) | ((b & 3) << 30)
+        d = (((e << 5) | (e >> 27)) + ((a & b) | (c & (a | b))) + d + w41 +
+             0x8F1BBCDC) & 0xffffffff
+        a = (a >> 2) | ((a & 3) << 30)
+        c = (((d << 5) | (d >> 27)) + ((e & a) | (b & (e | a))) + c + w42 +
+             0x8F1BBCDC) & 0xffffffff
+        e = (e >> 2) | ((e & 3) << 30)
+        b = (((c << 5) | (c >> 27)) + ((d & e) | (a & (d | e))) + b + w43 +
+             0x8F1BBCDC) & 0xffffffff
+        d = (d >> 2) | ((d & 3) << 30)
+        a = (((b << 5) | (b >> 27)) + ((c & d) | (e & (c | d))) + a + w44 +
+             0x8F1BBCDC) & 0xffffffff
+        c = (c >> 2) | ((c & 3) << 30)
+        e = (((a << 5) | (a >> 27)) + ((b & c) | (d & (b | c))) + e + w45 +
+             0x8F1BBCDC) & 0xffffffff
+        b = (b >> 2) | ((b & 3) << 30)
+        d = (((e << 5) | (e >> 27)) + ((a & b) | (c & (a | b))) + d + w46 +
+             0x8F1BBCDC) & 0xffffffff
+        a = (a >> 2) | ((a & 3) << 30)
+        c = (((d << 5) | (d >> 27)) + ((e & a) | (b & (e | a))) + c + w47 +
+             0x8F1BBCDC) & 0xffffffff
+        e = (e >> 2) | ((e & 3) << 30)
+        b = (((c << 5) | (c >> 27)) + ((d & e) | (a & (d | e))) + b + w48 +
+             0x8F1BBCDC) & 0xffffffff
+        d = (d >> 2) | ((d & 3) << 30)
+        a = (((b << 5) | (b >> 27)) + ((c & d) | (e & (c | d))) + a + w49 +
+             0x8F1BBCDC) & 0xffffffff
+        c = (c >> 2) | ((c & 3) << 30)
+        e = (((a << 5) | (a >> 27)) + ((b & c) | (d & (b | c))) + e + w50 +
+             0x8F1BBCDC) & 0xffffffff
+        b = (b >> 2) | ((b & 3) << 30)
+        d = (((e << 5) | (e >> 27)) + ((a & b) | (c & (a | b))) + d + w51 +
+             0x8F1BBCDC) & 0xffffffff
+        a = (a >> 2) | ((a & 3) << 30)
+        c = (((d << 5) | (d >> 27)) + ((e & a) | (b & (e | a))) + c + w52 +
+             0x8F1BBCDC) & 0xffffffff
+        e = (e >> 2) | ((e & 3) << 30)
+        b = (((c << 5) | (c >> 27)) + ((d & e) | (a & (d | e))) + b + w53 +
+             0x8F1BBCDC) & 0xffffffff
+        d = (d >> 2) | ((d & 3) << 30)
+        a = (((b << 5) | (b >> 27)) + ((c & d) | (e & (c | d))) + a + w54 +
+             0x8F1BBCDC) & 0xffffffff
+        c = (c >> 2) | ((c & 3) << 30)
+        e = (((a << 5) | (a >> 27)) + ((b & c) | (d & (b | c))) + e + w55 +
+             0x8F1BBCDC) & 0xffffffff
+        b = (b >> 2) | ((b & 3) << 30)
+        d = (((e << 5) | (e >> 27)) + ((a & b) | (c & (a | b))) + d + w56 +
+             0x8F1BBCDC) & 0xffffffff
+        a = (a >> 2) | ((a & 3) << 30)
+        c = (((d << 5) | (d >> 27)) + ((e & a) | (b & (e | a))) + c + w57 +
+             0x8F1BBCDC) & 0xffffffff
+        e = (e >> 2) | ((e & 3) << 30)
+        b = (((c << 5) | (c >> 27)) + ((d & e) | (a & (d | e))) + b + w58 +
+             0x8F1BBCDC) & 0xffffffff
+        d = (d >> 2) | ((d & 3) << 30)
+        a = (((b << 5) | (b >> 27)) + ((c & d) | (e & (c | d))) + a + w59 +
+             0x8F1BBCDC) & 0xffffffff
+        c = (c >> 2) | ((c & 3) << 30)
+
+        # Rounds 60-79
+        e = (((a << 5) | (a >> 27)) + (b ^ c ^ d) + e + w60 +
+             0xCA62C1D6) & 0xffffffff
+        b = (b >> 2) | ((b & 3) << 30)
+        d = (((e << 5) | (e >> 27)) + (a ^ b ^ c) + d + w61 +
+             0xCA62C1D6) & 0xffffffff
+        a = (a >> 2) | ((a & 3) << 30)
+        c = (((d << 5) | (d >> 27)) + (e ^ a ^ b) + c + w62 +
+             0xCA62C1D6) & 0xffffffff
+        e = (e >> 2) | ((e & 3) << 30)
+        b = (((c << 5) | (c >> 27)) + (d ^ e ^ a) + b + w63 +
+             0xCA62C1D6) & 0xffffffff
+        d = (d >> 2) | ((d & 3) << 30)
+        a = (((b << 5) | (b >> 27)) + (c ^ d ^ e) + a + w64 +
+             0xCA62C1D6) & 0xffffffff
+        c = (c >> 2) | ((c & 3) << 30)
+        e = (((a << 5) | (a >> 27)) + (b ^ c ^ d) + e + w65 +
+             0xCA62C1D6) & 0xffffffff
+        b = (b >> 2) | ((b & 3) << 30)
+        d = (((e << 5) | (e >> 27)) + (a ^ b ^ c) + d + w66 +
+             0xCA62C1D6) & 0xffffffff
+        a = (a >> 2) | ((a & 3) << 30)
+        c = (((d << 5) | (d >> 27)) + (e ^ a ^ b) + c + w67 +
+             0xCA62C1D6) & 0xffffffff
+        e = (e >> 2) | ((e & 3) << 30)
+        b = (((c << 5) | (c >> 27)) + (d ^ e ^ a) + b + w68 +
+             0xCA62C1D6) & 0xffffffff
+        d = (d >> 2) | ((d & 3) << 30)
+        a = (((b << 5) | (b >> 27)) + (c ^ d ^ e) + a + w69 +
+             0xCA62C1D6) & 0xffffffff
+        c = (c >> 2) | ((c & 3) << 30)
+        e = (((a << 5) | (a >> 27)) + (b ^ c ^ d) + e + w70 +
+             0xCA62C1D6) & 0xffffffff
+        b = (b >> 2) | ((b & 3) << 30)
+        d = (((e << 5) | (e >> 27)) + (a ^ b ^ c) + d + w71 +
+             0xCA62C1D6) & 0xffffffff
+        a = (a >> 2) | ((a & 3) << 30)
+        c = (((d << 5) | (d >> 27)) + (e ^ a ^ b) + c + w72 +
+             0xCA62C1D6) & 0xffffffff
+        e = (e >> 2) | ((e & 3) << 30)
+        b = (((c << 5) | (c >> 27)) + (d ^ e ^ a) + b + w73 +
+             0xCA62C1D6) & 0xffffffff
+        d = (d >> 2) | ((d & 3) << 30)
+        a = (((b << 5) | (b >> 27)) + (c ^ d ^ e) + a + w74 +
+             0xCA62C1D6) & 0xffffffff
+        c = (c >> 2) | ((c & 3) << 30)
+        e = (((a << 5) | (a >> 27)) + (b ^ c ^ d) + e + w75 +
+             0xCA62C1D6) & 0xffffffff
+        b = (b >> 2) | ((b & 3) << 30)
+        d = (((e << 5) | (e >> 27)) + (a ^ b ^ c) + d + w76 +
+             0xCA62C1D6) & 0xffffffff
+        a = (a >> 2) | ((a & 3) << 30)
+        c = (((d << 5) | (d >> 27)) + (e ^ a ^ b) + c + w77 +
+             0xCA62C1D6) & 0xffffffff
+        e = (e >> 2) | ((e & 3) << 30)
+        b = (((c << 5) | (c >> 27)) + (d ^ e ^ a) + b + w78 +
+             0xCA62C1D6) & 0xffffffff
+        d = (d >> 2) | ((d & 3) << 30)
+        a = (((b << 5) | (b >> 27)) + (c ^ d ^ e) + a + w79 +
+             0xCA62C1D6) & 0xffffffff
+        c = (c >> 2) | ((c & 3) << 30)
+
+        h0 = (h0 + a) & 0xffffffff
+        h1 = (h1 + b) & 0xffffffff
+        h2 = (h2 + c) & 0xffffffff
+        h3 = (h3 + d) & 0xffffffff
+        h4 = (h4 + e) & 0xffffffff
+
+    return((h0, h1, h2, h3, h4))
+
+
+def sha1_compress_ref(state, chunk):
+    """
+    The original, loop-per-round SHA-1 compression of one 64 byte chunk.
+    Kept as a reference for run_sha1_tests().
+    """
+
+    w = list(struct.unpack(">16I", chunk) + (None,) * (80-16))
+    for i in range(16, 80):
+        n = w[i-3] ^ w[i-8] ^ w[i-14] ^ w[i-16]
+        w[i] = leftrotate(n, 1)
+    a, b, c, d, e = state
+    for i in range(80):
+        f = None
+        k = None
+        if i < 20:
+            f = (b & c) ^ (~b & d)
+            k = 0x5A827999
+        elif i < 40:
+            f = b ^ c ^ d
+            k = 0x6ED9EBA1
+        elif i < 60:
+            f = (b & c) ^ (b & d) ^ (c & d)
+            k = 0x8F1BBCDC
+        else:
+            f = b ^ c ^ d
+            k = 0xCA62C1D6
+
+        temp = (leftrotate(a, 5) + f + e + k + w[i]) % 2**32
+        e = d
+        d = c
+        c = leftrotate(b, 30)
+        b = a
+        a = temp
+
+    return(tuple((x + y) % 2**32 for x, y in zip(state, (a, b, c, d, e))))
+
+
+def sha1_padding(length):
+    """Returns the padding SHA-1 appends to a message of length bytes"""
+
+    return(b'\x80' + b'\x00' * ((55 - length) % 64) +
+           struct.pack(">Q", length * 8))
+
+
 class SHA1:
+    """
+    SHA-1 with the same interface as hashlib.sha1 (update / digest /
+    hexdigest / copy), plus the older add() / finish() calls used in the
+    notebooks.  finish() returns the digest and resets the object.
+    """
+
+    name = 'sha1'
+    digest_size = 20
+    block_size = 64
+    padding = staticmethod(sha1_padding)
+
     def __init__(self, data=b''):
-        self.h = [
-                0x67452301,
-                0xEFCDAB89,
-                0x98BADCFE,
-                0x10325476,
-                0xC3D2E1F0
-                ]
-        self.remainder = data
+        self.h = list(SHA1_IV)
+        self.remainder = b''
         self.count = 0
+        if data:
+            self.update(data)
+
+    @classmethod
+    def resume(cls, digest, prior_length):
+        """
+        A SHA1 that carries on from digest, the hash of prior_length bytes
+        of already padded message.  Whatever is added next is hashed as if
+        it followed those bytes -- the length extension attack.
+        """
+
+        if prior_length % 64:
+            raise(ValueError('prior_length must be a multiple of 64'))
+
+        other = cls()
+        other.h = list(struct.unpack(">5I", digest))
+        other.count = prior_length // 64
+        return other
 
     def _add_chunk(self, chunk):
         self.count += 1
-        w = list(struct.unpack(">16I", chunk) + (None,) * (80-16))
-        for i in range(16, 80):
-            n = w[i-3] ^ w[i-8] ^ w[i-14] ^ w[i-16]
-            w[i] = leftrotate(n, 1)
-        a, b, c, d, e = self.h
-        for i in range(80):
-            f = None
-            k = None
-            if i < 20:
-                f = (b & c) ^ (~b & d)
-                k = 0x5A827999
-            elif i < 40:
-                f = b ^ c ^ d
-                k = 0x6ED9EBA1
-            elif i < 60:
-                f = (b & c) ^ (b & d) ^ (c & d)
-                k = 0x8F1BBCDC
-            else:
-                f = b ^ c ^ d
-                k = 0xCA62C1D6
+        self.h = list(sha1_compress(self.h, chunk))
 
-            temp = (leftrotate(a, 5) + f + e + k + w[i]) % 2**32
-            e = d
-            d = c
-            c = leftrotate(b, 30)
-            b = a
-            a = temp
-        self.h[0] = (self.h[0] + a) % 2**32
-        self.h[1] = (self.h[1] + b) % 2**32
-        self.h[2] = (self.h[2] + c) % 2**32
-        self.h[3] = (self.h[3] + d) % 2**32
-        self.h[4] = (self.h[4] + e) % 2**32
+    def update(self, data):
+        data = memoryview(data).cast('B')
 
-    def add(self, data):
-        message = self.remainder + data
-        r = len(message) % 64
-        if r != 0:
-            self.remainder = message[-r:]
-        else:
+        if self.remainder:
+            need = 64 - len(self.remainder)
+            self.remainder += bytes(data[:need])
+            data = data[need:]
+            if len(self.remainder) < 64:
+                return
+            self._add_chunk(self.remainder)
             self.remainder = b''
-        for chunk in range(0, len(message)-r, 64):
-            self._add_chunk(message[chunk:chunk+64])
+
+        n = len(data) - len(data) % 64
+        if n:
+            self.h = list(sha1_compress(self.h, data[:n]))
+            self.count += n // 64
+        self.remainder = bytes(data[n:])
+
+    def add(self, data):
+        self.update(data)
         return self
 
-    def finish(self):
+    @staticmethod
+    def many(messages, state=None, prior_length=0):
+        """sha1_many(), for code that's handed the hash class"""
+        return sha1_many(messages, state, prior_length)
+
+    def copy(self):
+        other = SHA1.__new__(SHA1)
+        other.h = list(self.h)
+        other.remainder = self.remainder
+        other.count = self.count
+        return other
+
+    def digest(self):
         l = len(self.remainder) + 64 * self.count
-        self.add(b'\x80' + b'\x00' * ((55 - l) % 64) +
-                 struct.pack(">Q", l * 8))
-        h = tuple(x for x in self.h)
-        self.__init__()
+        h = sha1_compress(self.h, self.remainder + sha1_padding(l))
         return struct.pack(">5I", *h)
 
+    def hexdigest(self):
+        return self.digest().hex()
 
-class class__evil_SHA1:
+    def finish(self):
+        digest = self.digest()
+        self.__init__()
+        return digest
 
-    def __init__(self, data, sha_state, prev_len):
 
-        self.prev_len = prev_len
+def _rotl(x, n):
+    return (x << np.uint32(n)) | (x >> np.uint32(32 - n))
 
-        a = int.from_bytes(sha_state[0:4], 'big')
-        b = int.from_bytes(sha_state[4:8], 'big')
-        c = int.from_bytes(sha_state[8:12], 'big')
-        d = int.from_bytes(sha_state[12:16], 'big')
-        e = int.from_bytes(sha_state[16:20], 'big')
 
-        self.h = [a, b, c, d, e]
-        self.remainder = data
-        self.count = 0
+def sha1_compress_many(state, blocks):
+    """
+    Vector version of sha1_compress: state is a (5, N) uint32 array and
+    blocks an (N, n_blocks, 16) uint32 array of message words.  Each round
+    is a handful of NumPy operations across all N lanes at once.
+    """
 
-    def _add_chunk(self, chunk):
-        self.count += 1
-        w = list(struct.unpack(">16I", chunk) + (None,) * (80-16))
+    h = [x.copy() for x in state]
+    n_lanes = blocks.shape[0]
+    w = np.empty((80, n_lanes), dtype=np.uint32)
+
+    for block in range(blocks.shape[1]):
+        w[:16] = blocks[:, block, :].T
         for i in range(16, 80):
-            n = w[i-3] ^ w[i-8] ^ w[i-14] ^ w[i-16]
-            w[i] = leftrotate(n, 1)
-        a, b, c, d, e = self.h
+            w[i] = _rotl(w[i-3] ^ w[i-8] ^ w[i-14] ^ w[i-16], 1)
+
+        a, b, c, d, e = h
         for i in range(80):
-            f = None
-            k = None
             if i < 20:
-                f = (b & c) ^ (~b & d)
-                k = 0x5A827999
+                f = d ^ (b & (c ^ d))
             elif i < 40:
                 f = b ^ c ^ d
-                k = 0x6ED9EBA1
             elif i < 60:
-                f = (b & c) ^ (b & d) ^ (c & d)
-                k = 0x8F1BBCDC
+                f = (b & c) | (d & (b | c))
             else:
                 f = b ^ c ^ d
-                k = 0xCA62C1D6
 
-            temp = (leftrotate(a, 5) + f + e + k + w[i]) % 2**32
+            temp = _rotl(a, 5) + f + e + SHA1_K_NP[i // 20] + w[i]
             e = d
             d = c
-            c = leftrotate(b, 30)
+            c = _rotl(b, 30)
             b = a
             a = temp
 
-        self.h[0] = (self.h[0] + a) % 2**32
-        self.h[1] = (self.h[1] + b) % 2**32
-        self.h[2] = (self.h[2] + c) % 2**32
-        self.h[3] = (self.h[3] + d) % 2**32
-        self.h[4] = (self.h[4] + e) % 2**32
+        h = [x + y for x, y in zip(h, (a, b, c, d, e))]
 
-    def add(self, data):
-        message = self.remainder + data
-        print(f"Msg: {message}")
-        r = len(message) % 64
-        if r != 0:
-            self.remainder = message[-r:]
-        else:
-            self.remainder = b''
-        for chunk in range(0, len(message)-r, 64):
-            self._add_chunk(message[chunk:chunk+64])
-        return self
+    return(np.array(h, dtype=np.uint32))
 
-    def finish(self):
-        l = self.prev_len + len(self.remainder) + 64 * self.count
-        self.add(b'\x80' + b'\x00' * ((55 - l) % 64) +
-                 struct.pack(">Q", l * 8))
-        h = tuple(x for x in self.h)
-        # self.__init__(self.data, self.sha_state)
-        return struct.pack(">5I", *h)
+
+def sha1_many(messages, state=None, prior_length=0):
+    """
+    SHA-1 of many messages of the same length at once.  messages is a list
+    of bytes or an (N, length) uint8 array; returns an (N, 20) uint8 array
+    of digests.  Worth it from a few dozen messages up, see
+    run_sha1_many_benchmark().
+
+    Like SHA1.resume, state and prior_length carry on from a hash state
+    after prior_length bytes (a multiple of 64) instead of starting afresh.
+    """
+
+    if prior_length % 64:
+        raise(ValueError('prior_length must be a multiple of 64'))
+    if state is None:
+        state = SHA1_IV
+
+    if isinstance(messages, np.ndarray):
+        data = np.ascontiguousarray(messages, dtype=np.uint8)
+    else:
+        lengths = set(len(m) for m in messages)
+        if len(lengths) > 1:
+            raise(ValueError('sha1_many needs messages of equal length'))
+        length = lengths.pop() if lengths else 0
+        data = np.frombuffer(b''.join(messages), dtype=np.uint8)
+        data = data.reshape(len(messages), length)
+
+    n_lanes, length = data.shape
+    padding = np.frombuffer(sha1_padding(prior_length + length),
+                            dtype=np.uint8)
+    padded = np.empty((n_lanes, length + len(padding)), dtype=np.uint8)
+    padded[:, :length] = data
+    padded[:, length:] = padding
+
+    blocks = padded.view('>u4').astype(np.uint32).reshape(n_lanes, -1, 16)
+    state = np.repeat(np.array(state, dtype=np.uint32)[:, None], n_lanes,
+                      axis=1)
+    h = sha1_compress_many(state, blocks)
+
+    digests = np.ascontiguousarray(h.T, dtype='>u4')
+    return(digests.view(np.uint8).reshape(n_lanes, 20))
+
+
+def run_sha1_tests(n_bytes=2**20):
+    """
+    Checks SHA1 against hashlib.sha1 (and the reference compression) and
+    prints the speedup of sha1_compress over sha1_compress_ref.
+    """
+
+    for size in [0, 1, 55, 56, 63, 64, 65, 119, 120, 128, 1000]:
+        data = os.urandom(size)
+        expected = hashlib.sha1(data).digest()
+        assert(SHA1(data).finish() == expected)
+        assert(SHA1(data).hexdigest() == expected.hex())
+
+        # Fed through in odd sized pieces, and copied part way
+        h = SHA1()
+        for ii in range(0, size, 7):
+            h.update(data[ii:ii+7])
+            if ii == 21:
+                h2 = h.copy()
+                h2.update(b'extra')
+        assert(h.digest() == expected)
+        assert(h.digest() == expected)
+        if size > 21:
+            assert(h2.digest() == hashlib.sha1(data[:28] + b'extra').digest())
+
+    # Length extension: resume from a digest and add a suffix
+    data = os.urandom(100)
+    glued = data + sha1_padding(len(data))
+    resumed = SHA1.resume(hashlib.sha1(data).digest(), len(glued))
+    assert(resumed.add(b'suffix').finish() ==
+           hashlib.sha1(glued + b'suffix').digest())
+
+    block = os.urandom(64)
+    assert(sha1_compress(SHA1_IV, block) == sha1_compress_ref(SHA1_IV, block))
+
+    data = os.urandom(n_bytes)
+    t0 = time.perf_counter()
+    state = SHA1_IV
+    for ii in range(0, n_bytes // 16, 64):
+        state = sha1_compress_ref(state, data[ii:ii+64])
+    t_ref = (time.perf_counter() - t0) * 16
+    t0 = time.perf_counter()
+    SHA1(data).digest()
+    t_fast = time.perf_counter() - t0
+
+    print(f'SHA1: {n_bytes/t_fast/1e6:.2f} MB/s, '
+          f'{t_ref/t_fast:.1f}x faster than the reference')
+    print('If you can see this, all the tests passed.')
+
+
+def run_sha1_many_benchmark(length=32, max_lanes=2**14):
+    """
+    Checks sha1_many against hashlib.sha1, then times it against one
+    SHA1(m).finish() per message for growing batch sizes and reports where
+    the batch version starts to win.
+    """
+
+    for size in [0, 1, 55, 56, 64, 100]:
+        messages = [os.urandom(size) for _ in range(5)]
+        digests = sha1_many(messages)
+        for message, digest in zip(messages, digests):
+            assert(digest.tobytes() == hashlib.sha1(message).digest())
+
+    crossover = None
+    n_lanes = 1
+    while n_lanes <= max_lanes:
+        messages = [os.urandom(length) for _ in range(n_lanes)]
+        t0 = time.perf_counter()
+        sha1_many(messages)
+        t_many = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for message in messages:
+            SHA1(message).finish()
+        t_one = time.perf_counter() - t0
+        if crossover is None and t_many < t_one:
+            crossover = n_lanes
+        print(f'{n_lanes:6d} messages: sha1_many {n_lanes/t_many:10.0f}/s, '
+              f'SHA1 {n_lanes/t_one:8.0f}/s')
+        n_lanes *= 2
+
+    print(f'sha1_many is faster from {crossover} messages of {length} bytes')
@@ -3,67 +3,252 @@
 Created on Wed Apr 29 08:43:54 2020
 
 @author: cobb
+
+Search for MD4 collisions with Wang's message modifications.  Each worker
+process draws random messages from its own RNG stream, makes them "weak"
+and checks the differential pair for a collision.  Progress (attempt counts
+and every worker's RNG state) is checkpointed to a JSON file, so a run can
+be stopped and picked up again exactly where it left off.
+
+    python test_md4.py [checkpoint file] [number of workers]
 """
-import hashlib
-import my_md4 as md4
-from Crypto.Random import random
+import json
+import multiprocessing as mp
+import os
+import queue
+import sys
+import time
 
-md4.run_RFC_tests()
-md4.run_Wang_examples()
+import numpy as np
 
-# Try to find an MD4 collision on random inputs -- probability is 2**-25 using 
-# just the round 1 changes.
+import md4 as md4_engine
+import my_md4 as md4
+
+# Try to find an MD4 collision on random inputs -- probability is 2**-25 using
+# just the round 1 changes, and roughly 2**-12 with the round 2 corrections
+# (a5, d5, c5 and b5) plus the early abort on the rest.
 
 do_padding = False
-ctr = 0
 max_tries = 2**27
+round2 = True
 fixA5 = True
 fixD5 = True
-    
-print(f"Searching for MD4 Collisions.  Max Attempts = {max_tries}")
-#display(progress)
 
-collision_found = False
-while not(collision_found) and ctr < max_tries:
 
-    original_msg = random.Random.get_random_bytes(64)
-    msg = original_msg
-    
+def wang_attempt(original_msg):
+    """
+    Makes original_msg "weak", applies the differential and returns
+    (M, M', collided).
+    """
+
+    if round2:
+        found = md4.Wang_attempt(original_msg)
+        if found is None:
+            return(None, None, False)
+        return(found[0], found[1], True)
+
     # First, do corrections to make the message "weak"
-    msg = md4.Wang_SSM_New(msg, do_padding)
+    msg = md4.Wang_SSM_New(original_msg, do_padding)
     if fixA5:
-        msg = md4.Wang_fixA5_2(msg, do_padding)    
-    
+        msg = md4.Wang_fixA5_2(msg, do_padding)
     if fixD5:
         msg = md4.Wang_fixD5(msg, do_padding)
-    
+
     # Then, apply the differential
-    msg_ = md4.Wang_Msg_Differential(msg) 
-    
+    msg_ = md4.Wang_Msg_Differential(msg)
+
     # Check for a collision between the two messages.
-    a = hashlib.new('md4', msg_).digest()
-    b = hashlib.new('md4', msg).digest()
-    #if md4.MD4(msg_, do_padding) == md4.MD4(msg, do_padding):
-    if a==b:
-        collision_found = True
-        
-    ctr += 1
-    if ctr % 2**12 == 0:
-        print('.', end='')
-        
-    if ctr % 2**16 == 0:
-        print()
-        print(ctr)
-        
-if ctr == max_tries:
-    print('Boooo')
-else:
-    print('*************************************************')
-    print('Collision found!')
-    print()
-    print(f'Original Message = {original_msg.hex()}')
-    print(f'M = {msg.hex()}')
-    print(f'M = {msg_.hex()}')
-    print(f'Hash = {md4.MD4(msg).hex()}')
-    print(f'Number of Attempts:  {ctr}')
+    a = md4_engine.MD4(msg_).finish()
+    b = md4_engine.MD4(msg).finish()
+
+    return(msg, msg_, a == b)
+
+
+def search_worker(worker_id, rng_state, attempts, batch_size, counters, stop,
+                  results):
+    """
+    Runs attempts until stop is set, checking it before every attempt so
+    all the workers stop as soon as one finds a collision.  After every
+    batch the attempt count goes into counters[worker_id] and (count, RNG
+    state) onto results for the checkpoint.  A collision goes onto results
+    and sets stop.
+    """
+
+    rng = np.random.Generator(np.random.PCG64())
+    rng.bit_generator.state = rng_state
+
+    try:
+        while not stop.is_set():
+            for ii in range(batch_size):
+                if stop.is_set():
+                    break
+                original_msg = rng.bytes(64)
+                msg, msg_, collided = wang_attempt(original_msg)
+                attempts += 1
+                if collided:
+                    counters[worker_id] = attempts
+                    results.put(('found', worker_id, attempts,
+                                 original_msg, msg, msg_))
+                    stop.set()
+                    return
+            counters[worker_id] = attempts
+            results.put(('state', worker_id, attempts,
+                         rng.bit_generator.state))
+    except KeyboardInterrupt:
+        pass
+
+
+def new_checkpoint(n_workers, seed=None):
+    """A fresh search: one independent PCG64 stream per worker"""
+
+    seed_seq = np.random.SeedSequence(seed)
+    workers = [{'attempts': 0,
+                'rng_state': np.random.PCG64(child).state}
+               for child in seed_seq.spawn(n_workers)]
+
+    return({'seed': seed_seq.entropy, 'elapsed': 0.0, 'found': None,
+            'workers': workers})
+
+
+def load_checkpoint(file_name):
+
+    if file_name is None or not os.path.exists(file_name):
+        return(None)
+    with open(file_name) as f:
+        return(json.load(f))
+
+
+def save_checkpoint(file_name, checkpoint):
+    """Writes the checkpoint atomically, so a crash can't leave half a file"""
 
+    if file_name is None:
+        return
+    tmp_name = file_name + '.tmp'
+    with open(tmp_name, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_name, file_name)
+
+
+def run_search(checkpoint_file='md4_search.json', n_workers=None,
+               max_tries=max_tries, batch_size=256, report_every=10.0,
+               seed=None):
+    """
+    Runs (or resumes) the collision search on n_workers processes (default:
+    every core).  A resumed search keeps the worker count it was started
+    with.  Prints attempts/sec per worker and in total every report_every
+    seconds, checkpointing at the same time.  Returns the checkpoint; its
+    'found' entry holds the colliding messages, if any.
+    """
+
+    checkpoint = load_checkpoint(checkpoint_file)
+    if checkpoint is None:
+        checkpoint = new_checkpoint(n_workers or os.cpu_count(), seed)
+    elif checkpoint['found'] is None:
+        print(f"Resuming from {checkpoint_file}: "
+              f"{sum(w['attempts'] for w in checkpoint['workers'])} attempts")
+
+    if checkpoint['found'] is not None:
+        return(checkpoint)
+
+    workers = checkpoint['workers']
+    n_workers = len(workers)
+    start_attempts = [w['attempts'] for w in workers]
+    counters = mp.Array('q', start_attempts, lock=False)
+    stop = mp.Event()
+    results = mp.Queue()
+
+    procs = [mp.Process(target=search_worker,
+                        args=(ii, w['rng_state'], w['attempts'], batch_size,
+                              counters, stop, results), daemon=True)
+             for ii, w in enumerate(workers)]
+
+    print(f"Searching for MD4 Collisions on {n_workers} workers.  "
+          f"Max Attempts = {max_tries}")
+
+    t_start = time.perf_counter()
+    elapsed_before = checkpoint['elapsed']
+    last_report = t_start
+    last_counts = list(start_attempts)
+
+    def handle(item):
+        if item[0] == 'state':
+            _, ii, attempts, rng_state = item
+            workers[ii] = {'attempts': attempts, 'rng_state': rng_state}
+        else:
+            _, ii, attempts, original_msg, msg, msg_ = item
+            workers[ii]['attempts'] = attempts
+            checkpoint['found'] = {'worker': ii, 'original': original_msg.hex(),
+                                   'M': msg.hex(), 'M_': msg_.hex()}
+
+    for proc in procs:
+        proc.start()
+
+    try:
+        while not stop.is_set():
+            try:
+                handle(results.get(timeout=0.5))
+            except queue.Empty:
+                pass
+
+            if sum(counters) >= max_tries:
+                stop.set()
+
+            now = time.perf_counter()
+            if now - last_report >= report_every:
+                counts = list(counters)
+                rates = [(c - l) / (now - last_report)
+                         for c, l in zip(counts, last_counts)]
+                total = sum(counts)
+                print(f"{total} attempts, {sum(rates):.0f}/s total "
+                      f"(per worker: {', '.join(f'{r:.0f}' for r in rates)}), "
+                      f"{(total - sum(start_attempts)) / (now - t_start):.0f}/s "
+                      f"this run")
+                last_report, last_counts = now, counts
+                checkpoint['elapsed'] = elapsed_before + now - t_start
+                save_checkpoint(checkpoint_file, checkpoint)
+
+    except KeyboardInterrupt:
+        print('Interrupted -- saving checkpoint')
+        stop.set()
+
+    # Collect the last reports while the workers wind down
+    while any(proc.is_alive() for proc in procs) or not results.empty():
+        try:
+            handle(results.get(timeout=0.1))
+        except queue.Empty:
+            pass
+    for proc in procs:
+        proc.join()
+
+    checkpoint['elapsed'] = elapsed_before + time.perf_counter() - t_start
+    save_checkpoint(checkpoint_file, checkpoint)
+
+    return(checkpoint)
+
+
+if __name__ == '__main__':
+
+    md4.run_RFC_tests()
+    md4.run_Wang_examples()
+
+    checkpoint_file = sys.argv[1] if len(sys.argv) > 1 else 'md4_search.json'
+    n_workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    checkpoint = run_search(checkpoint_file, n_workers)
+    found = checkpoint['found']
+    ctr = sum(w['attempts'] for w in checkpoint['workers'])
+
+    if found is None:
+        print('Boooo')
+        print(f'Number of Attempts:  {ctr}')
+    else:
+        msg = bytes.fromhex(found['M'])
+        print('*************************************************')
+        print('Collision found!')
+        print()
+        print(f"Original Message = {found['original']}")
+        print(f"M = {found['M']}")
+        print(f"M = {found['M_']}")
+        print(f'Hash = {md4.MD4(msg).hex()}')
+        print(f'Number of Attempts:  {ctr}')
+        print(f"Time:  {checkpoint['elapsed']:.0f} s")
@@ -0,0 +1,446 @@
+"""
+HMAC timing attack (Set 4, Challenges 31 and 32) as an asyncio engine.
+
+Point TimingAttack at an oracle -- a coroutine function taking a signature
+and returning (valid, seconds taken) -- and it recovers the signature a
+byte at a time from how long the server takes to reject each guess.
+FileHMACOracle is such an oracle for the challenge web servers
+(/?file=...&signature=...), over a pool of keep-alive connections.  Every
+sample is kept in a timing_stats.SampleBuffer for the SNR report.
+"""
+
+import asyncio
+import gc
+import math
+import random
+import time
+import urllib.parse
+
+import numpy as np
+
+import timing_stats
+
+
+class HTTPTimer:
+    """
+    A pool of up to pool_size keep-alive HTTP/1.1 connections to one host,
+    timing each GET with perf_counter_ns from sending the request to the
+    first line of the response -- connection setup and reading the rest of
+    the response stay out of the sample.  warm_up() opens the whole pool
+    ahead of time.
+    """
+
+    def __init__(self, url, pool_size=64, timeout=10):
+
+        parts = urllib.parse.urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = parts.path or '/'
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.pool = None
+        self.loop = None
+
+    async def _read_response(self, reader):
+
+        status_line = await reader.readline()
+        t_first = time.perf_counter_ns()
+        if not status_line:
+            raise(ConnectionError('Connection closed'))
+        status = int(status_line.split()[1])
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = b''
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                chunk = await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                body += chunk[:-2]
+        else:
+            body = await reader.readexactly(
+                int(headers.get('content-length', 0)))
+
+        keep_alive = headers.get('connection', '').lower() != 'close'
+
+        return(status, body, keep_alive, t_first)
+
+    async def get(self, query):
+        """GET path?query, returning (status, body, seconds)"""
+
+        request = (f'GET {self.path}?{query} HTTP/1.1\r\n'
+                   f'Host: {self.host}:{self.port}\r\n\r\n').encode()
+
+        if self.pool is None or self.loop is not asyncio.get_running_loop():
+            # Slots are connected on first use.  Connections from another
+            # event loop (an earlier asyncio.run) can't be used here.
+            self.loop = asyncio.get_running_loop()
+            self.pool = asyncio.Queue()
+            for _ in range(self.pool_size):
+                self.pool.put_nowait(None)
+
+        conn = await self.pool.get()
+        try:
+            for attempt in range(2):
+                if conn is None:
+                    conn = await asyncio.open_connection(self.host, self.port)
+                reader, writer = conn
+                try:
+                    t0 = time.perf_counter_ns()
+                    writer.write(request)
+                    status, body, keep_alive, t1 = await asyncio.wait_for(
+                        self._read_response(reader), self.timeout)
+                    dt = (t1 - t0) * 1e-9
+                    break
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    # A keep-alive connection the server already closed
+                    writer.close()
+                    conn = None
+                    if attempt:
+                        raise
+            if not keep_alive:
+                writer.close()
+                conn = None
+        except BaseException:
+            if conn is not None:
+                conn[1].close()
+            conn = None
+            raise
+        finally:
+            self.pool.put_nowait(conn)
+
+        return(status, body, dt)
+
+    async def warm_up(self, query='', rounds=2):
+        """
+        Connects every slot in the pool and sends rounds requests down each,
+        so the first real samples don't pay for connecting (or for the
+        server's caches).
+        """
+
+        await asyncio.gather(*(self.get(query)
+                               for _ in range(rounds * self.pool_size)))
+
+    async def close(self):
+        """Closes the connections; the pool starts afresh on the next get"""
+
+        if self.pool is None:
+            return
+        while not self.pool.empty():
+            conn = self.pool.get_nowait()
+            if conn is not None:
+                conn[1].close()
+        self.pool = None
+
+
+class FileHMACOracle(HTTPTimer):
+    """
+    Oracle for the challenge 31/32 servers: asks whether signature is the
+    HMAC of file_name.  The servers answer '200' or '500' in the body.
+    delay_time is passed on for the challenge 32 server.
+    """
+
+    def __init__(self, url, file_name, delay_time=None, pool_size=64,
+                 timeout=10):
+
+        super().__init__(url, pool_size, timeout)
+        self.params = {'file': file_name}
+        if delay_time is not None:
+            self.params['delay_time'] = str(delay_time)
+
+    def _query(self, signature):
+
+        return(urllib.parse.urlencode(
+            {**self.params, 'signature': bytes(signature).hex()}))
+
+    async def __call__(self, signature):
+
+        status, body, dt = await self.get(self._query(signature))
+
+        return(body.strip() == b'200', dt)
+
+    async def warm_up(self, rounds=2):
+
+        await super().warm_up(self._query(bytes(20)), rounds)
+
+
+class TimingAttack:
+    """
+    Recovers an n_bytes signature from a timing oracle, one byte at a time.
+
+    Each round times one guess per remaining candidate for the byte.  The
+    guesses go out in a fresh random order with up to concurrency in
+    flight, so drifts and bursts of noise hit every candidate alike, with
+    the garbage collector off while they're out (gc_off).
+
+    Each candidate's times are summed up by estimator (see timing_stats;
+    'min' by default).  All but one candidate are wrong and take the same
+    time, so the spread of their estimates after min_rounds is the
+    estimator's standard error, whatever the estimator, and it shrinks as
+    1/sqrt(rounds) after that.  A candidate more than 2 z standard errors
+    below the leader is dropped.  The byte is decided as soon as one
+    candidate is left, or the leader beats the runner-up by t > z.  The
+    last byte is the one that makes the oracle say valid.
+
+    A wrong byte means every guess for the next byte stops at the same
+    place, so their times fall back to the level of the losers of the
+    byte before.  When that happens -- or no winner turns up within
+    max_rounds, or no last byte is valid -- the attack backs up a byte and
+    tries again without the guess it took.
+
+    After recover(), stats has the request count, elapsed time, rounds per
+    byte and number of backtracks, samples has every timing taken (a
+    timing_stats.SampleBuffer) and report() prints the SNR per byte.  If
+    the oracle has warm_up() it's called first.
+    """
+
+    def __init__(self, oracle, n_bytes=20, concurrency=16, min_rounds=1,
+                 max_rounds=40, z=5.0, estimator='min', gc_off=True,
+                 max_backtracks=20, buffer_size=2**20):
+
+        self.oracle = oracle
+        self.n_bytes = n_bytes
+        self.concurrency = concurrency
+        self.min_rounds = min_rounds
+        self.max_rounds = max_rounds
+        self.z = z
+        self.estimator = estimator
+        self.estimate = timing_stats.get_estimator(estimator)
+        self.gc_off = gc_off
+        self.max_backtracks = max_backtracks
+        self.samples = timing_stats.SampleBuffer(buffer_size)
+        self.attempt = 0
+        self.requests = 0
+        self.result = None
+        self.stats = {}
+
+    async def _time_guesses(self, known, candidates, rounds):
+        """One timing per candidate, in random order; (times, valid one)"""
+
+        pad = bytes(self.n_bytes - len(known) - 1)
+        order = list(candidates)
+        random.shuffle(order)
+
+        async def time_one(c):
+            async with self.semaphore:
+                return(await self.oracle(known + bytes([c]) + pad))
+
+        gc_was_on = gc.isenabled()
+        if self.gc_off:
+            gc.disable()
+        try:
+            results = await asyncio.gather(*(time_one(c) for c in order))
+        finally:
+            if gc_was_on:
+                gc.enable()
+        self.requests += len(order)
+
+        oks, times = zip(*results)
+        self.samples.extend(position=len(known), attempt=self.attempt,
+                            candidate=np.array(order), round=rounds,
+                            ns=np.round(np.array(times) * 1e9),
+                            valid=np.array(oks))
+        valid = [c for c, ok in zip(order, oks) if ok]
+
+        return(dict(zip(order, times)), valid[0] if valid else None)
+
+    async def _attack_byte(self, known, excluded):
+        """
+        Returns (byte, rounds, level, base) for the next byte: level is the
+        winner's mean time and base the median over all the candidates.
+        byte is None if nothing stands out within max_rounds.
+        """
+
+        self.attempt += 1
+        alive = [c for c in range(256) if c not in excluded]
+        samples = {c: [] for c in alive}
+        last = len(known) == self.n_bytes - 1
+        base = spread = None
+
+        for rounds in range(1, self.max_rounds + 1):
+
+            times, valid = await self._time_guesses(known, alive, rounds)
+            if valid is not None:
+                return(valid, rounds, None, base)
+            if last:
+                break
+            for c, dt in times.items():
+                samples[c].append(dt)
+            if rounds < self.min_rounds:
+                continue
+
+            loc = self.estimate(np.array([samples[c] for c in alive]))
+            if spread is None:
+                # Measured across (nearly) all candidates, once
+                base = float(np.median(loc))
+                spread = max(timing_stats.robust_spread(loc), 1e-12)
+                first = rounds
+            se = spread * math.sqrt(first / rounds)
+
+            order = np.argsort(-loc)
+            lead = order[0]
+            winner, level = alive[lead], float(loc[lead])
+            if len(alive) == 1:
+                return(winner, rounds, level, base)
+
+            t = (loc[lead] - loc[order[1]]) / (se * math.sqrt(2))
+            alive = [c for c, m in zip(alive, loc)
+                     if m >= loc[lead] - 2 * self.z * se]
+            if t > self.z or len(alive) == 1:
+                return(winner, rounds, level, base)
+
+        return(None, rounds, None, base)
+
+    async def recover_async(self, known=b''):
+        """
+        Returns the signature, starting from the known first bytes (if
+        any).  Raises ValueError if it runs out of backtracks.
+        """
+
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        if hasattr(self.oracle, 'warm_up'):
+            await self.oracle.warm_up()
+        self.requests = 0
+        t0 = time.perf_counter()
+
+        known = bytearray(known)
+        n_known = len(known)
+        excluded = [set() for _ in range(self.n_bytes)]
+        levels = []             # (level, base) of each byte found here
+        rounds_per_byte = []
+        backtracks = 0
+
+        while len(known) < self.n_bytes:
+
+            pos = len(known)
+            byte, rounds, level, base = await self._attack_byte(
+                bytes(known), excluded[pos])
+            rounds_per_byte.append(rounds)
+
+            # Guesses at a wrong prefix all stop early, at the level of
+            # the previous byte's losers rather than its winner.
+            wrong = byte is None
+            if levels and base is not None:
+                prev_level, prev_base = levels[-1]
+                wrong |= base < (prev_level + prev_base) / 2
+
+            if not wrong:
+                known.append(byte)
+                levels.append((level, base))
+                continue
+
+            backtracks += 1
+            if backtracks > self.max_backtracks:
+                raise(ValueError(f'No byte stands out at position {pos}'))
+            if pos > n_known:
+                excluded[pos] = set()
+                excluded[pos-1].add(known.pop())
+                levels.pop()
+
+        dt = time.perf_counter() - t0
+        self.stats = {'requests': self.requests, 'seconds': dt,
+                      'rounds_per_byte': rounds_per_byte,
+                      'backtracks': backtracks}
+        self.result = bytes(known)
+
+        return(self.result)
+
+    def report(self, estimator=None):
+        """Prints (and returns) the SNR per byte of the last recover()"""
+
+        return(timing_stats.snr_report(self.samples, self.result,
+                                       estimator or self.estimator))
+
+    def recover(self, known=b''):
+        """
+        Blocking version of recover_async().  From inside a running event
+        loop (e.g. a Jupyter cell) await recover_async() instead.
+        """
+
+        async def run():
+            try:
+                return(await self.recover_async(known))
+            finally:
+                if hasattr(self.oracle, 'close'):
+                    await self.oracle.close()
+
+        return(asyncio.run(run()))
+
+
+def simulated_oracle(signature, delay=0.005, jitter=0.001):
+    """
+    An in-process stand-in for the challenge servers: insecure_compare
+    (sleep delay per matching byte) plus exponential jitter, timed the same
+    way as over HTTP.
+    """
+
+    async def oracle(guess):
+
+        t0 = time.perf_counter_ns()
+        matched = 0
+        for a, b in zip(signature, guess):
+            if a != b:
+                break
+            matched += 1
+        await asyncio.sleep(delay * matched + random.expovariate(1 / jitter))
+
+        return(matched == len(signature),
+               (time.perf_counter_ns() - t0) * 1e-9)
+
+    return(oracle)
+
+
+def run_timing_attack_tests(delay=0.005, n_bytes=20):
+    """
+    Recovers a random n_bytes signature from simulated_oracle (which
+    sleeps rather than blocks, so all 256 guesses can be in flight) with
+    each estimator, then again with a decoy byte that leads the attack
+    astray, to check it backs out of it.
+    """
+
+    signature = bytes(random.getrandbits(8) for _ in range(n_bytes))
+
+    for estimator, min_rounds in (('trimmed_mean', 3), ('quantile', 1),
+                                  ('min', 1)):
+        attack = TimingAttack(simulated_oracle(signature, delay), n_bytes,
+                              concurrency=256, min_rounds=min_rounds,
+                              estimator=estimator)
+        assert(attack.recover() == signature)
+        print(f"{estimator}, min_rounds={min_rounds}: {n_bytes} bytes, "
+              f"{attack.stats['requests']} requests in "
+              f"{attack.stats['seconds']:.1f} s, "
+              f"{attack.stats['backtracks']} backtracks")
+
+    rows = attack.report()
+    assert(len(rows) == n_bytes and all(r['z'] > 0 for r in rows))
+    assert(len(attack.samples) == attack.stats['requests'])
+
+    # A decoy: one wrong value for byte 1 answers slowest of all while
+    # byte 1 is being attacked, so it wins.  Byte 2 then shows it was wrong.
+    oracle = simulated_oracle(signature, delay)
+    decoy = signature[1] ^ 0x5a
+
+    async def decoyed(guess):
+        valid, dt = await oracle(guess)
+        if guess[1] == decoy and not any(guess[2:]):
+            dt += 2 * delay
+        return(valid, dt)
+
+    attack = TimingAttack(decoyed, n_bytes, concurrency=256)
+    assert(attack.recover() == signature)
+    assert(attack.stats['backtracks'] >= 1)
+
+    print('Timing attack tests passed')
+
+
+if __name__ == '__main__':
+
+    run_timing_attack_tests()
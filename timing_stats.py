@@ -0,0 +1,175 @@
+"""
+Measurement tools for the timing attacks: a columnar ring buffer for raw
+samples, estimators of where a candidate's times sit, and a per-byte
+signal-to-noise report.
+
+Estimators take an (n_candidates, n_samples) array of times and return one
+location per candidate.  Timing noise only ever adds time (scheduling,
+GC, the network), so the low end of the distribution is the stable part:
+'min' and low quantiles usually separate candidates with far fewer samples
+than the mean.
+"""
+
+import functools
+
+import numpy as np
+
+
+def minimum(samples):
+    """Fastest time per candidate"""
+
+    return(samples.min(axis=1))
+
+
+def trimmed_mean(samples, trim=0.2):
+    """Mean per candidate after dropping the slowest trim fraction"""
+
+    n = samples.shape[1]
+    keep = max(1, n - int(n * trim))
+
+    return(np.sort(samples, axis=1)[:, :keep].mean(axis=1))
+
+
+def quantile(samples, q=0.25):
+    """The q quantile per candidate"""
+
+    return(np.quantile(samples, q, axis=1))
+
+
+ESTIMATORS = {'min': minimum,
+              'trimmed_mean': trimmed_mean,
+              'median': functools.partial(quantile, q=0.5),
+              'quantile': quantile}
+
+
+def get_estimator(estimator):
+    """An estimator from its name in ESTIMATORS, or any callable as is"""
+
+    if callable(estimator):
+        return(estimator)
+    if estimator not in ESTIMATORS:
+        raise(ValueError(f'Unknown estimator {estimator!r}; choose from '
+                         f'{sorted(ESTIMATORS)} or pass a function'))
+
+    return(ESTIMATORS[estimator])
+
+
+def robust_spread(values):
+    """Standard deviation estimated from the median absolute deviation"""
+
+    values = np.asarray(values, dtype=float)
+
+    return(1.4826 * float(np.median(np.abs(values - np.median(values)))))
+
+
+class SampleBuffer:
+    """
+    Raw timing samples in a fixed-size ring buffer, one NumPy array per
+    column: which byte position and attempt at it (attempts go up when the
+    attack backtracks), the candidate byte, the round, the time in ns, and
+    whether the server said valid.  Once full, the oldest samples are
+    overwritten.
+    """
+
+    columns = (('position', np.int16), ('attempt', np.int32),
+               ('candidate', np.int16), ('round', np.int32),
+               ('ns', np.int64), ('valid', np.bool_))
+
+    def __init__(self, capacity=2**20):
+
+        self.capacity = capacity
+        self.data = {name: np.zeros(capacity, dtype=dtype)
+                     for name, dtype in self.columns}
+        self.next = 0           # Total samples ever added
+
+    def __len__(self):
+
+        return(min(self.next, self.capacity))
+
+    def extend(self, **values):
+        """
+        Adds samples: one array (or scalar, for values shared by all of
+        them) per column.
+        """
+
+        n = len(values['ns'])
+        if n > self.capacity:
+            values = {k: (v[-self.capacity:] if np.ndim(v) else v)
+                      for k, v in values.items()}
+            self.next += n - self.capacity
+            n = self.capacity
+
+        slots = (self.next + np.arange(n)) % self.capacity
+        for name, _ in self.columns:
+            self.data[name][slots] = values[name]
+        self.next += n
+
+    def column(self, name):
+        """A column's samples, oldest first"""
+
+        if self.next <= self.capacity:
+            return(self.data[name][:self.next])
+        start = self.next % self.capacity
+
+        return(np.concatenate([self.data[name][start:],
+                               self.data[name][:start]]))
+
+    def select(self, **equal):
+        """All the columns, for the samples where each given column == value"""
+
+        cols = {name: self.column(name) for name, _ in self.columns}
+        mask = np.ones(len(self), dtype=bool)
+        for name, value in equal.items():
+            mask &= cols[name] == value
+
+        return({name: col[mask] for name, col in cols.items()})
+
+
+def snr_report(buffer, chosen, estimator='min', verbose=True):
+    """
+    Signal-to-noise at each byte position of a finished attack, from the
+    last attempt at each position.  chosen is the recovered signature.
+
+    signal is the chosen byte's location (by estimator) above the median
+    location of the rest; noise is the spread of the rest's single samples,
+    and z the spread of the rest's locations -- what the attack's decision
+    was measured against.  Returns a list of dicts, one per position.
+    """
+
+    estimate = get_estimator(estimator)
+    positions = buffer.column('position')
+    attempts = buffer.column('attempt')
+
+    rows = []
+    for pos in range(len(chosen)):
+        at_pos = positions == pos
+        if not at_pos.any():
+            continue
+        s = buffer.select(position=pos, attempt=attempts[at_pos].max())
+        ns = s['ns'] / 1e3                       # us
+        candidates = np.unique(s['candidate'])
+        locs = {c: float(estimate(ns[s['candidate'] == c][None, :])[0])
+                for c in candidates}
+        others = [c for c in candidates if c != chosen[pos]]
+        if chosen[pos] not in locs or not others:
+            continue
+
+        rest = np.array([locs[c] for c in others])
+        noise = robust_spread(ns[np.isin(s['candidate'], others)])
+        signal = locs[chosen[pos]] - float(np.median(rest))
+        spread = robust_spread(rest)
+        rows.append({'position': pos, 'samples': len(ns),
+                     'rounds': int(s['round'].max()),
+                     'signal_us': signal, 'noise_us': noise,
+                     'snr': signal / noise if noise else float('inf'),
+                     'z': signal / spread if spread else float('inf')})
+
+    if verbose:
+        print(f"{'pos':>4} {'samples':>8} {'rounds':>6} {'signal us':>10} "
+              f"{'noise us':>9} {'SNR':>7} {'z':>8}")
+        for r in rows:
+            print(f"{r['position']:4d} {r['samples']:8d} {r['rounds']:6d} "
+                  f"{r['signal_us']:10.1f} {r['noise_us']:9.1f} "
+                  f"{r['snr']:7.1f} {r['z']:8.1f}")
+
+    return(rows)